@@ -0,0 +1,96 @@
+"""
+Benchmark dos motores de leitura das planilhas do SETOP.
+
+Uso:
+    python -m benchmarks.bench_leitura [planilhas...] [--repeticoes N]
+
+Sem argumentos, usa as amostras em temp/*.xlsx. Cada motor roda em um
+processo separado para que o pico de memória (RSS) de um não contamine
+a medição do outro.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import resource
+import subprocess
+import tracemalloc
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from scraper.leitura import ler_relatorio, motores_disponiveis
+
+def _rss_maximo_mb():
+    # ru_maxrss é em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def medir_motor(motor, planilhas, repeticoes):
+    """
+    Lê todas as planilhas com o motor informado e retorna as métricas
+    """
+    conteudos = []
+    for caminho in planilhas:
+        with open(caminho, 'rb') as f:
+            conteudos.append(f.read())
+
+    rss_inicial = _rss_maximo_mb()
+    linhas = 0
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        for content in conteudos:
+            linhas += len(ler_relatorio(content, motor))
+    tempo = time.perf_counter() - inicio
+
+    # O tracemalloc deixa a leitura bem mais lenta, então mede à parte
+    tracemalloc.start()
+    for content in conteudos:
+        ler_relatorio(content, motor)
+    _, pico_python = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'motor': motor,
+        'planilhas': len(conteudos) * repeticoes,
+        'linhas': linhas,
+        'tempo_s': round(tempo, 3),
+        'linhas_por_s': round(linhas / tempo) if tempo else 0,
+        'pico_python_mb': round(pico_python / (1024 * 1024), 1),
+        'pico_rss_mb': round(_rss_maximo_mb() - rss_inicial, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('planilhas', nargs='*', help="Planilhas .xls/.xlsx (padrão: temp/*.xlsx)")
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--motor', help=argparse.SUPPRESS)  # usado no processo filho
+    args = parser.parse_args()
+
+    planilhas = args.planilhas or sorted(glob.glob(os.path.join(RAIZ, 'temp', '*.xls*')))
+    if not planilhas:
+        print("Nenhuma planilha encontrada para o benchmark")
+        return 1
+
+    if args.motor:
+        print(json.dumps(medir_motor(args.motor, planilhas, args.repeticoes)))
+        return 0
+
+    print(f"Planilhas: {len(planilhas)} x {args.repeticoes} repetições\n")
+    print(f"{'motor':<10} {'linhas/s':>10} {'tempo (s)':>10} {'pico python (MB)':>17} {'pico RSS (MB)':>14}")
+    for motor in motores_disponiveis():
+        saida = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_leitura', '--motor', motor,
+             '--repeticoes', str(args.repeticoes), *planilhas],
+            capture_output=True, text=True, cwd=RAIZ
+        )
+        if saida.returncode != 0:
+            print(f"{motor:<10} erro: {saida.stderr.strip().splitlines()[-1]}")
+            continue
+        r = json.loads(saida.stdout.strip().splitlines()[-1])
+        print(f"{motor:<10} {r['linhas_por_s']:>10} {r['tempo_s']:>10} {r['pico_python_mb']:>17} {r['pico_rss_mb']:>14}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+Benchmark do pipeline do scraper contra o servidor SETOP local
+(benchmarks/servidor_setop.py), sem acessar o site real.
+
+Uso:
+    python -m benchmarks.bench_pipeline [--regioes N] [--edicoes N] [--latencia ms]
+        [--falhas fração] [--repeticoes N] [--banco URL|local] [--comparar REVISÃO]
+
+Mede cada etapa separadamente (descoberta, download, leitura e carga) e o
+pipeline completo (iniciar_scraping). A carga só roda com --banco, que deve
+apontar para um PostgreSQL dedicado aos benchmarks (as tabelas de preços
+desse banco são substituídas), ou com --banco local, que sobe um PostgreSQL
+embutido e temporário (pacote pgserver). Sem banco a carga não é medida: ela
+usa recursos do PostgreSQL (COPY, ON CONFLICT, tabelas particionadas, views
+materializadas) que não têm equivalente em um banco embutido como o SQLite.
+Os resultados ficam em benchmarks/resultados/<revisão>.json para comparação
+entre revisões.
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import statistics
+import subprocess
+from contextlib import redirect_stdout
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from benchmarks.servidor_setop import ServidorSetop, argumentos_servidor, opcoes_servidor
+
+try:
+    import pgserver
+except ImportError:  # opcional: só para --banco local
+    pgserver = None
+
+DIRETORIO_RESULTADOS = os.path.join(RAIZ, 'benchmarks', 'resultados')
+
+def revisao_atual():
+    """
+    Revisão do git (com o sufixo -sujo se houver alterações não commitadas)
+    """
+    try:
+        revisao = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+        alterado = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=RAIZ,
+                                  capture_output=True, text=True).stdout.strip()
+        return f"{revisao}-sujo" if alterado else revisao
+    except (OSError, subprocess.CalledProcessError):
+        return 'sem-git'
+
+def configurar_ambiente(diretorio, url, banco):
+    # Precisa ser feito antes de importar o scraper: as configurações
+    # são lidas das variáveis de ambiente na importação
+    os.environ.update({
+        'SETOP_URL': url,
+        'SETOP_DESCOBERTA': 'http',
+        'SETOP_CACHE': '0',
+        'SETOP_DADOS_DIR': diretorio,
+        'SETOP_CHECKPOINT_DIR': os.path.join(diretorio, 'checkpoint'),
+        'SETOP_METRICAS': os.path.join(diretorio, 'metricas.jsonl'),
+        'SETOP_METRICAS_ESTADO': os.path.join(diretorio, 'metricas_estado.json'),
+    })
+    if banco:
+        os.environ['DATABASE_URL'] = banco
+
+def iniciar_banco_local(diretorio):
+    """
+    PostgreSQL embutido em um diretório temporário, para medir a carga sem
+    um servidor externo. Retorna (servidor, URL).
+    """
+    if pgserver is None:
+        raise SystemExit("--banco local requer o pacote pgserver (pip install pgserver)")
+    servidor = pgserver.get_server(os.path.join(diretorio, 'postgres'), cleanup_mode='delete')
+    return servidor, servidor.get_uri()
+
+def cronometrar(funcao, repeticoes):
+    """
+    Roda funcao() `repeticoes` vezes sem a saída no console e retorna
+    (resultado da última, tempos)
+    """
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        with redirect_stdout(io.StringIO()):
+            inicio = time.perf_counter()
+            resultado = funcao()
+            tempos.append(time.perf_counter() - inicio)
+    return resultado, tempos
+
+def resumir(tempos, **quantidades):
+    """
+    Tempo mediano e melhor tempo, e a vazão de cada quantidade pela mediana
+    """
+    mediana = statistics.median(tempos)
+    resumo = {'tempo_s': round(mediana, 4), 'melhor_s': round(min(tempos), 4)}
+    for nome, valor in quantidades.items():
+        resumo[nome] = valor
+        resumo[f"{nome}_por_s"] = round(valor / mediana, 1) if mediana else 0
+    return resumo
+
+def medir_etapas(url, repeticoes, banco):
+    from scraper.descoberta import descobrir_planilhas_http
+    from scraper.downloads import baixar_planilhas
+    from scraper.scraping import MAX_PROCESSOS, processar_planilha
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+
+    etapas = {}
+
+    (regioes, tarefas), tempos = cronometrar(lambda: descobrir_planilhas_http(url), repeticoes)
+    etapas['descoberta'] = resumir(tempos, paginas=len(regioes) + 1, planilhas=len(tarefas))
+
+    baixadas, tempos = cronometrar(lambda: [item for item in baixar_planilhas(tarefas) if item[1] is not None],
+                                   repeticoes)
+    total_bytes = sum(len(content) for _, content in baixadas)
+    etapas['download'] = resumir(tempos, planilhas=len(baixadas), mb=round(total_bytes / (1024 * 1024), 2))
+
+    def ler():
+        with ProcessPoolExecutor(max_workers=MAX_PROCESSOS, mp_context=get_context('spawn')) as pool:
+            futuros = [
+                pool.submit(processar_planilha, tarefa['url'], tarefa['regiao'], content, tarefa['ano'])
+                for tarefa, content in baixadas
+            ]
+            return [futuro.result() for futuro in futuros]
+    dfs, tempos = cronometrar(ler, repeticoes)
+    dfs = [df for df in dfs if df is not None]
+    etapas['leitura'] = resumir(tempos, planilhas=len(dfs), linhas=sum(len(df) for df in dfs))
+    etapas['leitura']['processos'] = MAX_PROCESSOS
+
+    if banco:
+        from scraper import test_db
+
+        def carregar():
+            carregador = test_db.CarregadorPrecos()
+            for df in dfs:
+                carregador.adicionar(df)
+            return carregador.finalizar()
+        resultado, tempos = cronometrar(carregar, repeticoes)
+        etapas['carga'] = resumir(tempos, linhas=sum(len(df) for df in dfs))
+        etapas['carga']['modo'] = test_db.MODO_CARGA
+        etapas['carga']['ultima_carga'] = resultado
+
+    return etapas
+
+def ultimo_resumo(arquivo_metricas):
+    resumo = None
+    with open(arquivo_metricas, encoding='utf-8') as f:
+        for linha in f:
+            evento = json.loads(linha)
+            if evento['evento'] == 'resumo':
+                resumo = evento
+    return resumo
+
+def medir_completo(repeticoes, banco):
+    """
+    Pipeline completo; com banco inclui a importação, sem banco para
+    no CSV consolidado
+    """
+    from scraper import metricas
+    from scraper.scraping import iniciar_scraping, executar_scraper
+
+    def executar():
+        if banco:
+            return iniciar_scraping()['status']
+        metricas.iniciar_execucao()
+        try:
+            return 'success' if executar_scraper() else 'error'
+        finally:
+            metricas.finalizar_execucao()
+
+    status, tempos = cronometrar(executar, repeticoes)
+    resumo = ultimo_resumo(metricas.ARQUIVO_METRICAS) or {}
+    totais = resumo.get('totais', {})
+    completo = resumir(tempos, linhas=int(totais.get('setop_linhas_lidas_total', {}).get('total', 0)))
+    completo.update({
+        'status': status,
+        'com_banco': bool(banco),
+        'rss_pico_mb': resumo.get('rss_pico_mb'),
+        'rss_pico_filhos_mb': resumo.get('rss_pico_filhos_mb'),
+        'etapas_s': totais.get('setop_etapa_segundos_total', {}),
+    })
+    return completo
+
+def salvar_resultado(resultado):
+    os.makedirs(DIRETORIO_RESULTADOS, exist_ok=True)
+    caminho = os.path.join(DIRETORIO_RESULTADOS, f"{resultado['revisao']}.json")
+    with open(caminho, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    return caminho
+
+def carregar_resultado(revisao):
+    caminho = os.path.join(DIRETORIO_RESULTADOS, f"{revisao}.json")
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+def imprimir(resultado, anterior=None):
+    print(f"\nRevisão {resultado['revisao']} ({resultado['data']})")
+    print(f"{'etapa':<12} {'tempo (s)':>10} {'melhor (s)':>11}  vazão")
+    for nome, etapa in resultado['etapas'].items():
+        if nome == 'completo' and 'carga' not in resultado['etapas']:
+            print(f"{'carga':<12} não medida (use --banco URL ou --banco local)")
+        vazao = ', '.join(f"{chave[:-6]}/s {valor}" for chave, valor in etapa.items() if chave.endswith('_por_s'))
+        linha = f"{nome:<12} {etapa['tempo_s']:>10} {etapa['melhor_s']:>11}  {vazao}"
+        if anterior and nome in anterior['etapas']:
+            tempo_anterior = anterior['etapas'][nome]['tempo_s']
+            if tempo_anterior:
+                linha += f"  ({etapa['tempo_s'] / tempo_anterior:.2f}x do tempo em {anterior['revisao']})"
+        print(linha)
+    completo = resultado['etapas'].get('completo', {})
+    for nome, segundos in completo.get('etapas_s', {}).items():
+        print(f"    {nome.removeprefix('etapa='):<20} {segundos:>9.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argumentos_servidor(parser)
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--banco', help="URL de um PostgreSQL dedicado para medir a carga, "
+                                        "ou 'local' para um PostgreSQL embutido e temporário (pgserver)")
+    parser.add_argument('--comparar', metavar='REVISÃO', help="Compara com um resultado salvo")
+    parser.add_argument('--nao-salvar', action='store_true')
+    args = parser.parse_args()
+
+    anterior = carregar_resultado(args.comparar) if args.comparar else None
+    diretorio = tempfile.mkdtemp(prefix='bench_setop_')
+    banco = args.banco
+    banco_local = None
+    try:
+        if banco == 'local':
+            banco_local, banco = iniciar_banco_local(diretorio)
+            print(f"PostgreSQL embutido: {banco}")
+        with ServidorSetop(**opcoes_servidor(args)) as servidor:
+            configurar_ambiente(diretorio, servidor.url, banco)
+            print(f"Servidor local: {servidor.url} ({len(servidor.site.regioes)} regiões x {args.edicoes} edições)")
+
+            etapas = medir_etapas(servidor.url, args.repeticoes, banco)
+            etapas['completo'] = medir_completo(args.repeticoes, banco)
+            requisicoes = servidor.requisicoes
+            recusadas = servidor.recusadas
+
+        resultado = {
+            'revisao': revisao_atual(),
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'configuracao': {
+                **vars(args),
+                'banco': ('local' if args.banco == 'local' else 'externo') if args.banco else None,
+                'cpus': os.cpu_count(),
+                'python': sys.version.split()[0],
+                'requisicoes_servidor': requisicoes,
+                'recusadas_servidor': recusadas,
+            },
+            'etapas': etapas,
+        }
+    finally:
+        if banco_local:
+            banco_local.cleanup()
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    imprimir(resultado, anterior)
+    if not args.nao_salvar:
+        print(f"\nResultado salvo em: {salvar_resultado(resultado)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Servidor HTTP local que imita o site do SETOP para os benchmarks.
+
+Uso:
+    python -m benchmarks.servidor_setop [--porta 8765] [--latencia 50] [--falhas 0.05]
+
+Serve o mapa de regiões (/index.html), uma página por região e as
+planilhas de exemplo de temp/*.xlsx. Cada região aponta para uma das
+planilhas e pode ter várias edições (anos). A latência e a taxa de
+falhas (respostas 503) são configuráveis, e as planilhas respondem a
+requisições condicionais (ETag/If-None-Match) como o servidor real.
+Com --limite, requisições acima desse número de simultâneas recebem
+429 com Retry-After, como um servidor que limita a taxa.
+"""
+import os
+import re
+import sys
+import glob
+import time
+import random
+import hashlib
+import argparse
+import threading
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def nome_regiao(caminho):
+    # temp_planilha_Região_Zona_da_Mata_Leste.xlsx -> Zona da Mata Leste
+    nome = os.path.splitext(os.path.basename(caminho))[0]
+    nome = re.sub(r'^temp_planilha_(Região_)?', '', nome)
+    return nome.replace('_', ' ')
+
+class SiteSetop:
+    """
+    Conteúdo do site: regiões, edições e planilhas
+    """
+    def __init__(self, planilhas=None, regioes=None, edicoes=1):
+        planilhas = planilhas or sorted(glob.glob(os.path.join(RAIZ, 'temp', '*.xls*')))
+        if not planilhas:
+            raise FileNotFoundError("Nenhuma planilha de exemplo encontrada em temp/")
+        self.conteudos = []
+        for caminho in planilhas:
+            with open(caminho, 'rb') as f:
+                conteudo = f.read()
+            self.conteudos.append((nome_regiao(caminho), conteudo, hashlib.md5(conteudo).hexdigest()))
+
+        # Mais regiões do que planilhas: repete as planilhas com outro nome
+        total = regioes or len(self.conteudos)
+        self.regioes = []
+        for indice in range(total):
+            nome, _, _ = self.conteudos[indice % len(self.conteudos)]
+            if indice >= len(self.conteudos):
+                nome = f"{nome} {indice // len(self.conteudos) + 1}"
+            self.regioes.append(nome)
+        self.edicoes = edicoes
+
+    def pagina_mapa(self):
+        areas = '\n'.join(
+            f'<area shape="poly" title="{escape(nome)}" href="regiao/{indice}.html">'
+            for indice, nome in enumerate(self.regioes)
+        )
+        return f'<html><body><div class="map-container"><map name="mapa">\n{areas}\n</map></div></body></html>'
+
+    def pagina_regiao(self, indice):
+        ano_atual = 2024
+        links = '\n'.join(
+            f'<a href="../planilhas/{indice}-{edicao}.xlsx">{ano_atual - edicao} - Janeiro</a>'
+            for edicao in range(self.edicoes)
+        )
+        return f'<html><body>{links}</body></html>'
+
+    def planilha(self, indice):
+        _, conteudo, etag = self.conteudos[indice % len(self.conteudos)]
+        return conteudo, etag
+
+class ManipuladorSetop(BaseHTTPRequestHandler):
+    site = None
+    latencia = 0.0
+    variacao = 0.0
+    falhas = 0.0
+    limite = 0
+    retry_after = 1
+    requisicoes = 0
+    recusadas = 0
+    em_andamento = 0
+    _lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _responder(self, status, corpo=b'', tipo='text/html; charset=utf-8', cabecalhos=None):
+        self.send_response(status)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(corpo)))
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(corpo)
+
+    def do_GET(self):
+        classe = type(self)
+        with self._lock:
+            classe.requisicoes += 1
+            recusar = bool(self.limite) and classe.em_andamento >= self.limite
+            if recusar:
+                classe.recusadas += 1
+            else:
+                classe.em_andamento += 1
+        if recusar:
+            return self._responder(429, b'Muitas requisicoes', cabecalhos={'Retry-After': str(self.retry_after)})
+        try:
+            self._atender()
+        finally:
+            with self._lock:
+                classe.em_andamento -= 1
+
+    def _atender(self):
+        if self.latencia or self.variacao:
+            time.sleep(max(0.0, self.latencia + random.uniform(-self.variacao, self.variacao)))
+        if self.falhas and random.random() < self.falhas:
+            return self._responder(503, b'Servico indisponivel')
+
+        caminho = self.path.split('?')[0]
+        if caminho in ('/', '/index.html'):
+            return self._responder(200, self.site.pagina_mapa().encode())
+
+        encontrado = re.fullmatch(r'/regiao/(\d+)\.html', caminho)
+        if encontrado and int(encontrado.group(1)) < len(self.site.regioes):
+            return self._responder(200, self.site.pagina_regiao(int(encontrado.group(1))).encode())
+
+        encontrado = re.fullmatch(r'/planilhas/(\d+)-(\d+)\.xlsx', caminho)
+        if encontrado and int(encontrado.group(1)) < len(self.site.regioes):
+            conteudo, etag = self.site.planilha(int(encontrado.group(1)))
+            etag = f'"{etag}"'
+            if self.headers.get('If-None-Match') == etag:
+                return self._responder(304, cabecalhos={'ETag': etag})
+            return self._responder(
+                200, conteudo,
+                'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                {'ETag': etag}
+            )
+
+        self._responder(404, b'Nao encontrado')
+
+class ServidorSetop:
+    """
+    Sobe o servidor em uma thread; usado como gerenciador de contexto:
+
+        with ServidorSetop(latencia=0.05) as servidor:
+            servidor.url  # http://127.0.0.1:<porta>/index.html
+    """
+    def __init__(self, porta=0, latencia=0.0, variacao=0.0, falhas=0.0, regioes=None, edicoes=1,
+                 planilhas=None, limite=0, retry_after=1):
+        site = SiteSetop(planilhas, regioes, edicoes)
+        manipulador = type('Manipulador', (ManipuladorSetop,), {
+            'site': site, 'latencia': latencia, 'variacao': variacao, 'falhas': falhas,
+            'limite': limite, 'retry_after': retry_after
+        })
+        self.manipulador = manipulador
+        self.site = site
+        self.servidor = ThreadingHTTPServer(('127.0.0.1', porta), manipulador)
+        self.servidor.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.servidor.server_address[1]}/index.html"
+
+    @property
+    def requisicoes(self):
+        return self.manipulador.requisicoes
+
+    @property
+    def recusadas(self):
+        return self.manipulador.recusadas
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+def argumentos_servidor(parser):
+    parser.add_argument('--latencia', type=float, default=0, help="Latência por requisição em ms")
+    parser.add_argument('--variacao', type=float, default=0, help="Variação aleatória da latência em ms")
+    parser.add_argument('--falhas', type=float, default=0, help="Fração das requisições respondidas com 503")
+    parser.add_argument('--regioes', type=int, help="Quantidade de regiões (padrão: uma por planilha)")
+    parser.add_argument('--edicoes', type=int, default=1, help="Edições (anos) por região")
+    parser.add_argument('--limite', type=int, default=0,
+                        help="Requisições simultâneas aceitas; as excedentes recebem 429 (0: sem limite)")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After (s) das respostas 429")
+
+def opcoes_servidor(args):
+    return {
+        'latencia': args.latencia / 1000,
+        'variacao': args.variacao / 1000,
+        'falhas': args.falhas,
+        'regioes': args.regioes,
+        'edicoes': args.edicoes,
+        'limite': args.limite,
+        'retry_after': args.retry_after,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--porta', type=int, default=8765)
+    argumentos_servidor(parser)
+    args = parser.parse_args()
+
+    with ServidorSetop(args.porta, **opcoes_servidor(args)) as servidor:
+        print(f"Servidor SETOP local em {servidor.url} "
+              f"({len(servidor.site.regioes)} regiões x {args.edicoes} edições)")
+        print(f"Use SETOP_URL={servidor.url} para apontar o scraper para ele")
+        try:
+            servidor.thread.join()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,18 @@
 from django.urls import path
-from scraper.views import scraper_view, progress_stream
+from scraper.views import (
+    scraper_view, progress_stream, jobs_view, job_view,
+    precos_view, exportacao_view, matriz_view, historico_view, variacao_view, metricas_view
+)
 
 urlpatterns = [
     path('scraper/', scraper_view, name='scraper'),
     path('scraper/progress/', progress_stream, name='progress'),
-]
\ No newline at end of file
+    path('scraper/jobs/', jobs_view, name='jobs'),
+    path('scraper/jobs/<int:job_id>/', job_view, name='job'),
+    path('scraper/precos/', precos_view, name='precos'),
+    path('scraper/precos/exportar/', exportacao_view, name='exportacao'),
+    path('scraper/matriz/', matriz_view, name='matriz'),
+    path('scraper/historico/', historico_view, name='historico'),
+    path('scraper/variacao/', variacao_view, name='variacao'),
+    path('metrics/', metricas_view, name='metricas'),
+]
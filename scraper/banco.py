@@ -0,0 +1,45 @@
+import os
+import threading
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
+
+# Conexão com o PostgreSQL (no compose, o serviço 'db')
+DATABASE_URL = os.environ.get('DATABASE_URL', "postgresql://postgres:postgres@db:5432/postgres")
+
+# Ano das planilhas sem edição identificada no scraper e nos CSVs; no
+# banco o ano fica nulo e é ordenado depois das edições
+ANO_DESCONHECIDO = 'N/A'
+
+# Conexões mantidas abertas pelo pool de cada processo
+POOL_MIN = int(os.environ.get('SETOP_POOL_MIN', '1'))
+POOL_MAX = int(os.environ.get('SETOP_POOL_MAX', '10'))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def obter_pool():
+    """
+    Pool de conexões do processo, criado na primeira utilização
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(POOL_MIN, POOL_MAX, DATABASE_URL)
+        return _pool
+
+@contextmanager
+def conexao():
+    """
+    Empresta uma conexão do pool. Faz commit ao final do bloco, ou
+    rollback em caso de erro, e devolve a conexão ao pool.
+    """
+    pool = obter_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=conn.closed != 0)
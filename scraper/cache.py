@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import pandas as pd
+
+# Cache persistente das planilhas baixadas
+CACHE_ATIVO = os.environ.get('SETOP_CACHE', '1') != '0'
+CACHE_DIR = os.environ.get('SETOP_CACHE_DIR', '/app/data/cache')
+CACHE_MAX_MB = int(os.environ.get('SETOP_CACHE_MAX_MB', '1024'))
+
+# Incrementar quando processar_planilha mudar o formato do DataFrame gerado
+VERSAO_PROCESSAMENTO = 5
+
+_cache = None
+_cache_lock = threading.Lock()
+
+class CachePlanilhas:
+    """
+    Cache em disco das planilhas, indexado pela URL e endereçado pelo
+    hash SHA-256 do conteúdo. Guarda ETag/Last-Modified para requisições
+    condicionais e o DataFrame já processado de cada planilha.
+    """
+    def __init__(self, diretorio=CACHE_DIR, max_mb=CACHE_MAX_MB):
+        self.diretorio = diretorio
+        self.max_bytes = max_mb * 1024 * 1024
+        self.caminho_indice = os.path.join(diretorio, 'indice.json')
+        self.lock = threading.Lock()
+        self.inalteradas = set()
+        self.stats = {
+            'baixadas': 0,
+            'nao_modificadas': 0,
+            'inalteradas': 0,
+            'processamentos_reaproveitados': 0,
+            'bytes_baixados': 0,
+            'bytes_economizados': 0,
+            'removidas': 0,
+        }
+        os.makedirs(diretorio, exist_ok=True)
+        self.indice = self._carregar_indice()
+
+    def _carregar_indice(self):
+        try:
+            with open(self.caminho_indice, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _caminho(self, nome):
+        return os.path.join(self.diretorio, nome)
+
+    def _nome_processado(self, entrada):
+        return f"{entrada['sha256']}_v{VERSAO_PROCESSAMENTO}.pkl"
+
+    def _temporario(self, nome):
+        return self._caminho(f"{nome}.{threading.get_ident()}.tmp")
+
+    def _gravar(self, nome, dados):
+        temporario = self._temporario(nome)
+        with open(temporario, 'wb') as f:
+            f.write(dados)
+        os.replace(temporario, self._caminho(nome))
+
+    def cabecalhos_condicionais(self, url):
+        """
+        Retorna os cabeçalhos If-None-Match/If-Modified-Since para a URL
+        """
+        with self.lock:
+            entrada = self.indice.get(url)
+            if not entrada or not os.path.exists(self._caminho(entrada['arquivo'])):
+                return {}
+            cabecalhos = {}
+            if entrada.get('etag'):
+                cabecalhos['If-None-Match'] = entrada['etag']
+            if entrada.get('last_modified'):
+                cabecalhos['If-Modified-Since'] = entrada['last_modified']
+            return cabecalhos
+
+    def registrar_nao_modificada(self, url):
+        """
+        Marca a URL como inalterada (resposta 304) e devolve o conteúdo em cache
+        """
+        with self.lock:
+            entrada = self.indice[url]
+            entrada['acessado_em'] = time.time()
+            self.inalteradas.add(url)
+            self.stats['inalteradas'] += 1
+            self.stats['nao_modificadas'] += 1
+            self.stats['bytes_economizados'] += entrada['tamanho']
+            caminho = self._caminho(entrada['arquivo'])
+        with open(caminho, 'rb') as f:
+            return f.read()
+
+    def registrar_download(self, url, content, headers):
+        """
+        Guarda o conteúdo baixado e os validadores HTTP da resposta
+        """
+        sha256 = hashlib.sha256(content).hexdigest()
+        arquivo = f"{sha256}.bin"
+        if not os.path.exists(self._caminho(arquivo)):
+            self._gravar(arquivo, content)
+
+        with self.lock:
+            anterior = self.indice.get(url)
+            if anterior and anterior['sha256'] == sha256:
+                # Servidor não suporta validadores, mas o conteúdo é o mesmo
+                self.inalteradas.add(url)
+                self.stats['inalteradas'] += 1
+                processado = anterior.get('processado')
+                if processado != self._nome_processado(anterior):
+                    processado = None
+            else:
+                processado = None
+            self.indice[url] = {
+                'arquivo': arquivo,
+                'sha256': sha256,
+                'tamanho': len(content),
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'processado': processado,
+                'acessado_em': time.time(),
+            }
+            self.stats['baixadas'] += 1
+            self.stats['bytes_baixados'] += len(content)
+        return content
+
+    def ler_processado(self, url):
+        """
+        Retorna o DataFrame processado em cache se a planilha não mudou e
+        foi processada pela versão atual de processar_planilha
+        """
+        with self.lock:
+            entrada = self.indice.get(url)
+            if url not in self.inalteradas or not entrada or not entrada.get('processado'):
+                return None
+            if entrada['processado'] != self._nome_processado(entrada):
+                # Formato antigo: o arquivo é removido na próxima limpeza
+                entrada['processado'] = None
+                return None
+            caminho = self._caminho(entrada['processado'])
+        try:
+            df = pd.read_pickle(caminho)
+        except Exception:
+            return None
+        with self.lock:
+            self.stats['processamentos_reaproveitados'] += 1
+        return df
+
+    def salvar_processado(self, url, df):
+        """
+        Guarda o DataFrame processado junto da planilha em cache
+        """
+        with self.lock:
+            entrada = self.indice.get(url)
+            if not entrada:
+                return
+            nome = self._nome_processado(entrada)
+        temporario = self._temporario(nome)
+        df.to_pickle(temporario)
+        os.replace(temporario, self._caminho(nome))
+        with self.lock:
+            entrada['processado'] = nome
+
+    def _arquivos_da_entrada(self, entrada):
+        return [nome for nome in (entrada['arquivo'], entrada.get('processado')) if nome]
+
+    def tamanho_total(self):
+        nomes = set()
+        for entrada in self.indice.values():
+            nomes.update(self._arquivos_da_entrada(entrada))
+        total = 0
+        for nome in nomes:
+            try:
+                total += os.path.getsize(self._caminho(nome))
+            except OSError:
+                pass
+        return total
+
+    def evictar(self):
+        """
+        Remove as entradas acessadas há mais tempo até caber no limite de tamanho
+        """
+        with self.lock:
+            total = self.tamanho_total()
+            for url, entrada in sorted(self.indice.items(), key=lambda item: item[1]['acessado_em']):
+                if total <= self.max_bytes:
+                    break
+                del self.indice[url]
+                self.inalteradas.discard(url)
+                em_uso = set()
+                for outra in self.indice.values():
+                    em_uso.update(self._arquivos_da_entrada(outra))
+                for nome in self._arquivos_da_entrada(entrada):
+                    if nome in em_uso:
+                        continue
+                    try:
+                        total -= os.path.getsize(self._caminho(nome))
+                        os.remove(self._caminho(nome))
+                    except OSError:
+                        pass
+                self.stats['removidas'] += 1
+
+            # Remove versões antigas que não são mais referenciadas pelo índice
+            em_uso = {'indice.json'}
+            for entrada in self.indice.values():
+                em_uso.update(self._arquivos_da_entrada(entrada))
+            for nome in os.listdir(self.diretorio):
+                if nome not in em_uso and not nome.endswith('.tmp'):
+                    try:
+                        os.remove(self._caminho(nome))
+                    except OSError:
+                        pass
+
+    def salvar(self):
+        """
+        Aplica a política de tamanho e grava o índice em disco
+        """
+        self.evictar()
+        with self.lock:
+            self._gravar('indice.json', json.dumps(self.indice, indent=2).encode('utf-8'))
+
+    def relatorio(self):
+        """
+        Resumo do uso do cache na execução atual
+        """
+        mb = 1024 * 1024
+        return "\n".join([
+            "Estatísticas do cache de planilhas:",
+            f"  Planilhas baixadas: {self.stats['baixadas']}",
+            f"  Respostas 304 (não modificadas): {self.stats['nao_modificadas']}",
+            f"  Planilhas inalteradas: {self.stats['inalteradas']}",
+            f"  Processamentos reaproveitados: {self.stats['processamentos_reaproveitados']}",
+            f"  Baixado: {self.stats['bytes_baixados'] / mb:.1f} MB",
+            f"  Economizado: {self.stats['bytes_economizados'] / mb:.1f} MB",
+            f"  Entradas removidas por tamanho: {self.stats['removidas']}",
+            f"  Tamanho do cache: {self.tamanho_total() / mb:.1f} MB de {self.max_bytes / mb:.0f} MB",
+        ])
+
+def obter_cache():
+    """
+    Retorna o cache compartilhado do processo, ou None se estiver desativado
+    """
+    global _cache
+    if not CACHE_ATIVO:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = CachePlanilhas()
+        return _cache
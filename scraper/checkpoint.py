@@ -0,0 +1,192 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+import pandas as pd
+
+# Checkpoint por planilha, para retomar uma execução interrompida
+CHECKPOINT_ATIVO = os.environ.get('SETOP_CHECKPOINT', '1') != '0'
+CHECKPOINT_DIR = os.environ.get('SETOP_CHECKPOINT_DIR', '/app/data/checkpoint')
+
+PENDENTE = 'pendente'
+CONCLUIDA = 'concluida'
+ERRO = 'erro'
+
+class ManifestoExecucao:
+    """
+    Manifesto em disco da execução atual: o estado de cada planilha
+    (pendente, concluída ou erro) e o DataFrame processado das concluídas.
+    Uma execução retomada reaproveita as concluídas e só baixa e processa
+    as demais.
+    """
+    def __init__(self, diretorio=CHECKPOINT_DIR):
+        self.diretorio = diretorio
+        self.caminho = os.path.join(diretorio, 'manifesto.json')
+        self.lock = threading.Lock()
+        os.makedirs(diretorio, exist_ok=True)
+        self.dados = self._carregar()
+
+    def _carregar(self):
+        try:
+            with open(self.caminho, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _caminho(self, nome):
+        return os.path.join(self.diretorio, nome)
+
+    def _salvar(self):
+        self.dados['atualizado_em'] = datetime.now().isoformat(timespec='seconds')
+        temporario = f"{self.caminho}.{threading.get_ident()}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(self.dados, f, indent=2, ensure_ascii=False)
+        os.replace(temporario, self.caminho)
+
+    def _limpar_processados(self):
+        for nome in os.listdir(self.diretorio):
+            if nome.endswith(('.pkl', '.tmp')):
+                try:
+                    os.remove(self._caminho(nome))
+                except OSError:
+                    pass
+
+    def iniciar(self, retomar=False):
+        """
+        Retoma a execução anterior (se ela não terminou) ou começa uma nova.
+        Retorna True se retomou.
+        """
+        with self.lock:
+            anterior = self.dados
+            if retomar and anterior and not anterior.get('finalizada'):
+                anterior['retomadas'] = anterior.get('retomadas', 0) + 1
+                self._salvar()
+                contagem = self.contagem()
+                print(f"Retomando execução iniciada em {anterior['criado_em']}: "
+                      f"{contagem[CONCLUIDA]} planilhas concluídas, "
+                      f"{contagem[ERRO]} com erro e {contagem[PENDENTE]} pendentes")
+                return True
+            if retomar:
+                print("Nenhuma execução interrompida para retomar, iniciando uma nova")
+            self._limpar_processados()
+            self.dados = {
+                'criado_em': datetime.now().isoformat(timespec='seconds'),
+                'finalizada': False,
+                'retomadas': 0,
+                'planilhas': {},
+            }
+            self._salvar()
+            return False
+
+    def registrar_tarefas(self, tarefas):
+        """
+        Acrescenta ao manifesto as planilhas descobertas que ele ainda não tem
+        """
+        with self.lock:
+            planilhas = self.dados['planilhas']
+            for tarefa in tarefas:
+                planilhas.setdefault(tarefa['url'], {
+                    'regiao': tarefa['regiao'], 'ano': tarefa['ano'], 'estado': PENDENTE, 'tentativas': 0
+                })
+            self._salvar()
+
+    def nao_descobertas(self, urls):
+        """
+        Planilhas do manifesto que não apareceram na descoberta atual
+        (ex.: a página da região falhou nesta tentativa)
+        """
+        with self.lock:
+            return [
+                {'regiao': entrada['regiao'], 'url': url, 'ano': entrada['ano']}
+                for url, entrada in self.dados['planilhas'].items() if url not in urls
+            ]
+
+    def planejar(self, tarefas):
+        """
+        Registra as planilhas descobertas e acrescenta as do manifesto que
+        não apareceram agora
+        """
+        self.registrar_tarefas(tarefas)
+        return list(tarefas) + self.nao_descobertas({tarefa['url'] for tarefa in tarefas})
+
+    def ler_concluida(self, url):
+        """
+        DataFrame processado de uma planilha já concluída, ou None
+        """
+        with self.lock:
+            entrada = self.dados['planilhas'].get(url)
+            if not entrada or entrada['estado'] != CONCLUIDA:
+                return None
+            caminho = self._caminho(entrada['arquivo'])
+        try:
+            return pd.read_pickle(caminho)
+        except Exception:
+            return None
+
+    def registrar(self, tarefa, df_processado):
+        """
+        Grava o resultado de uma planilha: o DataFrame processado ou o erro
+        """
+        arquivo = None
+        if df_processado is not None:
+            arquivo = f"{hashlib.sha256(tarefa['url'].encode('utf-8')).hexdigest()[:32]}.pkl"
+            temporario = self._caminho(f"{arquivo}.{threading.get_ident()}.tmp")
+            df_processado.to_pickle(temporario)
+            os.replace(temporario, self._caminho(arquivo))
+
+        with self.lock:
+            entrada = self.dados['planilhas'].setdefault(tarefa['url'], {
+                'regiao': tarefa['regiao'], 'ano': tarefa['ano'], 'tentativas': 0
+            })
+            entrada['tentativas'] += 1
+            if arquivo:
+                entrada.update(estado=CONCLUIDA, arquivo=arquivo, linhas=len(df_processado))
+            else:
+                entrada['estado'] = ERRO
+            self._salvar()
+
+    def contagem(self):
+        contagem = {PENDENTE: 0, CONCLUIDA: 0, ERRO: 0}
+        for entrada in self.dados['planilhas'].values():
+            contagem[entrada['estado']] += 1
+        return contagem
+
+    def relatorio(self):
+        contagem = self.contagem()
+        linhas = [
+            "Checkpoint da execução:",
+            f"  Planilhas concluídas: {contagem[CONCLUIDA]}",
+            f"  Planilhas com erro: {contagem[ERRO]}",
+            f"  Planilhas pendentes: {contagem[PENDENTE]}",
+        ]
+        if contagem[ERRO] or contagem[PENDENTE]:
+            linhas.append("  Use a opção de retomar para reprocessar só as que faltam")
+        return "\n".join(linhas)
+
+    def finalizar(self):
+        """
+        Marca a execução como concluída (a próxima começa do zero). Se
+        restaram planilhas com erro ou pendentes, o manifesto continua
+        aberto para que elas possam ser retomadas.
+        """
+        contagem = self.contagem()
+        if contagem[ERRO] or contagem[PENDENTE]:
+            return False
+        with self.lock:
+            self.dados['finalizada'] = True
+            self._salvar()
+            self._limpar_processados()
+        return True
+
+def abrir_manifesto(retomar=False):
+    """
+    Manifesto da execução, ou None se o checkpoint estiver desativado
+    """
+    if not CHECKPOINT_ATIVO:
+        if retomar:
+            print("Checkpoint desativado (SETOP_CHECKPOINT=0), executando do zero")
+        return None
+    manifesto = ManifestoExecucao()
+    manifesto.iniciar(retomar)
+    return manifesto
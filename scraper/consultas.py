@@ -0,0 +1,266 @@
+import os
+import json
+import base64
+from decimal import Decimal
+from datetime import date, datetime
+from scraper.banco import ANO_DESCONHECIDO, conexao
+
+# Limite padrão e máximo de itens por página da API de preços
+LIMITE_PADRAO = 50
+LIMITE_MAXIMO = int(os.environ.get('SETOP_LIMITE_API', '500'))
+
+COLUNAS_RESPOSTA = ['codigo', 'descricao_servico', 'unidade', 'custo_unitario', 'regiao', 'ano']
+
+COLUNAS_MATRIZ = [
+    'codigo', 'ano', 'descricao_servico', 'unidade', 'regioes', 'custo_minimo',
+    'custo_maximo', 'custo_mediano', 'custo_medio', 'amplitude', 'amplitude_percentual',
+    'custos_por_regiao'
+]
+
+COLUNAS_HISTORICO = [
+    'codigo', 'regiao', 'ano', 'descricao_servico', 'unidade', 'custo_unitario', 'valido_de', 'valido_ate'
+]
+
+COLUNAS_VARIACAO = [
+    'codigo', 'regiao', 'descricao_servico', 'unidade', 'custo_anterior', 'custo_atual',
+    'variacao', 'variacao_percentual'
+]
+
+def codificar_cursor(linha, colunas):
+    chave = [linha[coluna] for coluna in colunas]
+    return base64.urlsafe_b64encode(json.dumps(chave).encode()).decode()
+
+def decodificar_cursor(cursor, tamanho):
+    """
+    Retorna a chave do último item da página anterior
+    """
+    try:
+        chave = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError("cursor inválido")
+    if not isinstance(chave, list) or len(chave) != tamanho:
+        raise ValueError("cursor inválido")
+    return chave
+
+def depois_do_cursor(chave, valores):
+    """
+    Condição para as linhas depois da posição do cursor na ordem da chave.
+    O ano pode ser nulo (ordenado com NULLS LAST), então a comparação por
+    linha, (a, b) > (x, y), não serve: cada coluna é comparada à parte.
+    Retorna (sql, parametros).
+    """
+    alternativas = []
+    parametros = []
+    for i, (coluna, valor) in enumerate(zip(chave, valores)):
+        if valor is None:
+            # Nada vem depois de um ano nulo nesta posição
+            continue
+        termos = []
+        for anterior, valor_anterior in zip(chave[:i], valores[:i]):
+            if valor_anterior is None:
+                termos.append(f"{anterior} IS NULL")
+            else:
+                termos.append(f"{anterior} = %s")
+                parametros.append(valor_anterior)
+        termos.append(f"({coluna} > %s OR {coluna} IS NULL)" if coluna == 'ano' else f"{coluna} > %s")
+        parametros.append(valor)
+        alternativas.append(f"({' AND '.join(termos)})")
+    return f"({' OR '.join(alternativas) or 'FALSE'})", parametros
+
+def filtro_ano(ano):
+    """
+    Condição do filtro por ano: 'N/A' (planilhas sem edição, gravadas com
+    o ano nulo) vira IS NULL e os demais valores precisam ser numéricos.
+    Retorna (sql, parametros).
+    """
+    if ano == ANO_DESCONHECIDO:
+        return "ano IS NULL", []
+    if not (ano.isascii() and ano.isdigit()):
+        raise ValueError(f"ano inválido: {ano} (use o ano da edição ou {ANO_DESCONHECIDO})")
+    return "ano = %s", [ano]
+
+def ordenacao(chave):
+    return ', '.join(f"{coluna} NULLS LAST" if coluna == 'ano' else coluna for coluna in chave)
+
+def _paginar(sql, parametros, colunas, chave, limite):
+    # Busca um item a mais para saber se existe próxima página
+    with conexao() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, parametros + [limite + 1])
+            linhas = [dict(zip(colunas, linha)) for linha in cur.fetchall()]
+
+    for linha in linhas:
+        for coluna, valor in linha.items():
+            if isinstance(valor, Decimal):
+                linha[coluna] = float(valor)
+            elif isinstance(valor, (date, datetime)):
+                linha[coluna] = valor.isoformat()
+
+    proximo = codificar_cursor(linhas[limite - 1], chave) if len(linhas) > limite else None
+    return {'resultados': linhas[:limite], 'proximo': proximo}
+
+def versao_dados():
+    """
+    Versão atual de precos_setop (incrementada a cada importação),
+    ou 0 se ainda não houve importação
+    """
+    with conexao() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('precos_setop_versao') IS NOT NULL")
+            if not cursor.fetchone()[0]:
+                return 0
+            cursor.execute("SELECT versao FROM precos_setop_versao WHERE id = 1")
+            linha = cursor.fetchone()
+            return linha[0] if linha else 0
+
+def buscar_precos(codigo=None, regiao=None, ano=None, busca=None, cursor=None, limite=LIMITE_PADRAO):
+    """
+    Consulta precos_setop por código, região/ano e termos da descrição,
+    na ordem da chave (codigo, regiao, ano), com paginação por cursor.
+    Retorna {'resultados': [...], 'proximo': cursor da próxima página}.
+    """
+    condicoes = []
+    parametros = []
+    if codigo:
+        condicoes.append("codigo = %s")
+        parametros.append(codigo)
+    if regiao:
+        condicoes.append("regiao = %s")
+        parametros.append(regiao)
+    if ano:
+        condicao, valores = filtro_ano(ano)
+        condicoes.append(condicao)
+        parametros.extend(valores)
+    if busca:
+        # Cada termo precisa aparecer na descrição; usa o índice trigram
+        for termo in busca.split():
+            condicoes.append("descricao_servico ILIKE %s")
+            parametros.append('%' + termo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+    if cursor:
+        posicao = decodificar_cursor(cursor, 3)
+        # A comparação atravessa o join da view; o limite só no código é
+        # aplicado direto no índice de servicos
+        depois, valores = depois_do_cursor(['codigo', 'regiao', 'ano'], posicao)
+        condicoes.append(f"codigo >= %s AND {depois}")
+        parametros.extend([posicao[0], *valores])
+
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+    sql = f"""
+        SELECT {', '.join(COLUNAS_RESPOSTA)}
+        FROM precos_setop
+        {where}
+        ORDER BY {ordenacao(['codigo', 'regiao', 'ano'])}
+        LIMIT %s
+    """
+    return _paginar(sql, parametros, COLUNAS_RESPOSTA, ['codigo', 'regiao', 'ano'], limite)
+
+def buscar_matriz(codigo=None, ano=None, cursor=None, limite=LIMITE_PADRAO):
+    """
+    Consulta a matriz código x região (precos_matriz): custos de cada
+    região e estatísticas do código, com paginação por cursor
+    """
+    condicoes = []
+    parametros = []
+    if codigo:
+        condicoes.append("codigo = %s")
+        parametros.append(codigo)
+    if ano:
+        condicao, valores = filtro_ano(ano)
+        condicoes.append(condicao)
+        parametros.extend(valores)
+    if cursor:
+        posicao = decodificar_cursor(cursor, 2)
+        depois, valores = depois_do_cursor(['codigo', 'ano'], posicao)
+        condicoes.append(f"codigo >= %s AND {depois}")
+        parametros.extend([posicao[0], *valores])
+
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+    sql = f"""
+        SELECT {', '.join(COLUNAS_MATRIZ)}
+        FROM precos_matriz
+        {where}
+        ORDER BY {ordenacao(['codigo', 'ano'])}
+        LIMIT %s
+    """
+    return _paginar(sql, parametros, COLUNAS_MATRIZ, ['codigo', 'ano'], limite)
+
+def _ler_data(valor):
+    try:
+        return datetime.fromisoformat(valor)
+    except ValueError:
+        raise ValueError("data inválida, use AAAA-MM-DD ou AAAA-MM-DDTHH:MM")
+
+def buscar_historico(codigo=None, regiao=None, ano=None, data=None, cursor=None, limite=LIMITE_PADRAO):
+    """
+    Consulta precos_historico. Sem data, retorna todas as versões de cada
+    preço; com data, retorna o preço vigente naquela data.
+    """
+    condicoes = []
+    parametros = []
+    for coluna, valor in (('codigo', codigo), ('regiao', regiao)):
+        if valor:
+            condicoes.append(f"{coluna} = %s")
+            parametros.append(valor)
+    if ano:
+        condicao, valores = filtro_ano(ano)
+        condicoes.append(condicao)
+        parametros.extend(valores)
+
+    chave = ['codigo', 'regiao', 'ano']
+    if data:
+        momento = _ler_data(data)
+        condicoes.append("valido_de <= %s AND (valido_ate IS NULL OR valido_ate > %s)")
+        parametros.extend([momento, momento])
+    else:
+        chave.append('valido_de')
+
+    if cursor:
+        posicao = decodificar_cursor(cursor, len(chave))
+        depois, valores = depois_do_cursor(chave, posicao)
+        condicoes.append(f"codigo >= %s AND {depois}")
+        parametros.extend([posicao[0], *valores])
+
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+    sql = f"""
+        SELECT {', '.join(COLUNAS_HISTORICO)}
+        FROM precos_historico
+        {where}
+        ORDER BY {ordenacao(chave)}
+        LIMIT %s
+    """
+    return _paginar(sql, parametros, COLUNAS_HISTORICO, chave, limite)
+
+def buscar_variacao(de, para, codigo=None, regiao=None, cursor=None, limite=LIMITE_PADRAO):
+    """
+    Variação dos preços atuais entre duas edições (anos) das planilhas,
+    para os códigos presentes nas duas
+    """
+    if not de or not para:
+        raise ValueError("informe as edições 'de' e 'para'")
+    condicoes = ["a.ano = %s", "a.valido_ate IS NULL"]
+    parametros = [para, de]
+    if codigo:
+        condicoes.append("a.codigo = %s")
+        parametros.append(codigo)
+    if regiao:
+        condicoes.append("a.regiao = %s")
+        parametros.append(regiao)
+    if cursor:
+        condicoes.append("(a.codigo, a.regiao) > (%s, %s)")
+        parametros.extend(decodificar_cursor(cursor, 2))
+
+    sql = f"""
+        SELECT a.codigo, a.regiao, b.descricao_servico, b.unidade,
+               a.custo_unitario AS custo_anterior,
+               b.custo_unitario AS custo_atual,
+               b.custo_unitario - a.custo_unitario AS variacao,
+               round((b.custo_unitario - a.custo_unitario) * 100 / NULLIF(a.custo_unitario, 0), 2)
+                   AS variacao_percentual
+        FROM precos_historico a
+        JOIN precos_historico b
+          ON b.codigo = a.codigo AND b.regiao = a.regiao AND b.ano = %s AND b.valido_ate IS NULL
+        WHERE {' AND '.join(condicoes)}
+        ORDER BY a.codigo, a.regiao
+        LIMIT %s
+    """
+    return _paginar(sql, parametros, COLUNAS_VARIACAO, ['codigo', 'regiao'], limite)
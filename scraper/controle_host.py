@@ -0,0 +1,164 @@
+import os
+import time
+import asyncio
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from scraper import metricas
+
+# Requisições simultâneas por host: o controlador começa em LIMITE_INICIAL
+# e ajusta o limite entre LIMITE_MINIMO e MAX_POR_HOST conforme o servidor responde
+MAX_POR_HOST = int(os.environ.get('SETOP_MAX_POR_HOST', '8'))
+LIMITE_INICIAL = float(os.environ.get('SETOP_LIMITE_INICIAL', '2'))
+LIMITE_MINIMO = float(os.environ.get('SETOP_LIMITE_MINIMO', '1'))
+
+# Respostas mais lentas que isso (até o primeiro byte) contam como congestionamento
+LATENCIA_ALVO = float(os.environ.get('SETOP_LATENCIA_ALVO', '2.0'))
+
+# Fator aplicado ao limite a cada congestionamento (429, 5xx, timeout ou lentidão)
+FATOR_REDUCAO = float(os.environ.get('SETOP_FATOR_REDUCAO', '0.5'))
+
+# Intervalo mínimo (s) entre o início de duas requisições ao mesmo host
+INTERVALO_MINIMO = float(os.environ.get('SETOP_INTERVALO_MINIMO', '0'))
+
+# Maior pausa aceita de um Retry-After (s)
+RETRY_AFTER_MAX = float(os.environ.get('SETOP_RETRY_AFTER_MAX', '120'))
+
+# Respostas que indicam servidor sobrecarregado e podem ser repetidas
+STATUS_RETRY = {500, 502, 503, 504, 429}
+
+# No motor async, intervalo entre tentativas de reservar uma vaga
+ESPERA_ASYNC = 0.05
+
+_controladores = {}
+_controladores_lock = threading.Lock()
+
+def segundos_retry_after(valor):
+    """
+    Converte o cabeçalho Retry-After (segundos ou data HTTP) em segundos
+    """
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        data = parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return None
+    if data.tzinfo is None:
+        data = data.replace(tzinfo=timezone.utc)
+    return max(0.0, (data - datetime.now(timezone.utc)).total_seconds())
+
+class ControladorHost:
+    """
+    Limite de requisições simultâneas a um host, ajustado por AIMD: cada
+    resposta rápida e bem-sucedida soma 1/limite (cerca de +1 a cada rodada
+    de requisições) e cada congestionamento multiplica o limite por
+    FATOR_REDUCAO, no máximo uma vez por latência média. Um Retry-After
+    pausa todas as requisições ao host. Compartilhado entre as threads de
+    download e o event loop do motor async.
+    """
+    def __init__(self, host, inicial=LIMITE_INICIAL, minimo=LIMITE_MINIMO, maximo=MAX_POR_HOST):
+        self.host = host
+        self.minimo = max(1.0, minimo)
+        self.maximo = max(self.minimo, float(maximo))
+        self.limite = min(self.maximo, max(self.minimo, inicial))
+        self.em_voo = 0
+        self.pausado_ate = 0.0
+        self.ultimo_inicio = 0.0
+        self.ultima_reducao = 0.0
+        self.latencia_media = None
+        self.condicao = threading.Condition()
+
+    def _espera(self, agora):
+        """
+        Segundos até poder iniciar uma requisição: 0 se já pode, None se
+        depende de outra requisição terminar
+        """
+        if agora < self.pausado_ate:
+            return self.pausado_ate - agora
+        if INTERVALO_MINIMO and agora < self.ultimo_inicio + INTERVALO_MINIMO:
+            return self.ultimo_inicio + INTERVALO_MINIMO - agora
+        if self.em_voo >= int(self.limite):
+            return None
+        return 0
+
+    def _ocupar(self, agora, inicio_espera):
+        self.em_voo += 1
+        self.ultimo_inicio = agora
+        if agora > inicio_espera:
+            metricas.contar('setop_espera_host_segundos_total', agora - inicio_espera, host=self.host)
+
+    def tentar_reservar(self, inicio_espera=None):
+        """
+        Reserva uma vaga sem bloquear; retorna 0 se conseguiu ou quanto
+        esperar antes de tentar de novo (None: até outra requisição terminar)
+        """
+        with self.condicao:
+            agora = time.monotonic()
+            espera = self._espera(agora)
+            if espera == 0:
+                self._ocupar(agora, inicio_espera or agora)
+            return espera
+
+    def reservar(self):
+        """
+        Bloqueia a thread até haver uma vaga para este host
+        """
+        with self.condicao:
+            inicio = time.monotonic()
+            while (espera := self._espera(time.monotonic())) != 0:
+                self.condicao.wait(espera)
+            self._ocupar(time.monotonic(), inicio)
+
+    async def reservar_async(self):
+        """
+        Versão para o event loop: aguarda sem bloquear as outras tarefas
+        """
+        inicio = time.monotonic()
+        while (espera := self.tentar_reservar(inicio)) != 0:
+            await asyncio.sleep(min(espera, 1.0) if espera is not None else ESPERA_ASYNC)
+
+    def liberar(self, status=None, latencia=None, retry_after=None, falha=False):
+        """
+        Libera a vaga e ajusta o limite pelo resultado da requisição:
+        status HTTP, latência até o primeiro byte (s), Retry-After (s) e
+        falha (timeout ou erro de conexão)
+        """
+        with self.condicao:
+            self.em_voo -= 1
+            agora = time.monotonic()
+            if retry_after:
+                pausa = min(retry_after, RETRY_AFTER_MAX)
+                self.pausado_ate = max(self.pausado_ate, agora + pausa)
+                metricas.contar('setop_retry_after_total', host=self.host)
+                print(f"Servidor {self.host} pediu para aguardar {pausa:.0f}s (Retry-After)")
+            if latencia is not None:
+                self.latencia_media = latencia if self.latencia_media is None else (
+                    0.8 * self.latencia_media + 0.2 * latencia
+                )
+
+            congestionado = falha or status in STATUS_RETRY or (latencia or 0) > LATENCIA_ALVO
+            if congestionado:
+                # Várias respostas da mesma rodada reduzem o limite uma vez só
+                if agora - self.ultima_reducao >= (self.latencia_media or 1.0):
+                    self.limite = max(self.minimo, self.limite * FATOR_REDUCAO)
+                    self.ultima_reducao = agora
+                    metricas.contar('setop_reducoes_limite_total', host=self.host)
+            elif status is not None and status < 400:
+                self.limite = min(self.maximo, self.limite + 1 / self.limite)
+            metricas.medida('setop_limite_host', round(self.limite, 2), host=self.host)
+            self.condicao.notify_all()
+
+def obter_controlador(url):
+    """
+    Controlador compartilhado do host da URL
+    """
+    host = urlparse(url).netloc
+    with _controladores_lock:
+        if host not in _controladores:
+            _controladores[host] = ControladorHost(host)
+        return _controladores[host]
@@ -0,0 +1,256 @@
+import os
+import sys
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+from scraper.downloads import obter_sessao, requisitar
+from scraper.controle_host import obter_controlador
+
+# Página do mapa de regiões (pode apontar para o servidor local dos benchmarks)
+URL_SETOP = os.environ.get(
+    'SETOP_URL', "http://www.infraestrutura.mg.gov.br/component/gmg/page/102-consulta-a-planilha-preco-setop"
+)
+
+# Modo de descoberta dos links: 'http' (sem navegador) ou 'selenium'
+MODO_DESCOBERTA = os.environ.get('SETOP_DESCOBERTA', 'http')
+
+EXTENSOES_PLANILHA = ('.xls', '.xlsx')
+
+class _ExtratorLinks(HTMLParser):
+    """
+    Coleta as áreas do mapa de regiões e os links de planilhas de uma página
+    """
+    def __init__(self, base_url):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.areas = []
+        self.links = []
+        self._link_atual = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'area' and attrs.get('title') is not None:
+            self.areas.append({
+                'nome': attrs['title'],
+                'href': urljoin(self.base_url, attrs.get('href') or '')
+            })
+        elif tag == 'a' and (attrs.get('href') or '').endswith(EXTENSOES_PLANILHA):
+            self._link_atual = {'url': urljoin(self.base_url, attrs['href']), 'partes': []}
+
+    def handle_data(self, data):
+        if self._link_atual is not None:
+            self._link_atual['partes'].append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._link_atual is not None:
+            texto = ' '.join(''.join(self._link_atual['partes']).split())
+            self.links.append({'url': self._link_atual['url'], 'texto': texto})
+            self._link_atual = None
+
+def _extrair(html, base_url):
+    extrator = _ExtratorLinks(base_url)
+    extrator.feed(html)
+    extrator.close()
+    return extrator
+
+def extrair_regioes(html, base_url=URL_SETOP):
+    """
+    Lê as regiões (area[title]) do mapa da página principal do SETOP
+    """
+    return _extrair(html, base_url).areas
+
+def extrair_planilhas(html, base_url):
+    """
+    Lê os links de planilhas (.xls/.xlsx) da página de uma região
+    """
+    return _extrair(html, base_url).links
+
+def criar_tarefa(regiao, link):
+    texto = link['texto'].strip()
+    return {
+        'regiao': regiao,
+        'url': link['url'],
+        'ano': texto.split()[0] if texto else "N/A"
+    }
+
+def _baixar_pagina(session, url):
+    response = requisitar(session, url)
+    response.raise_for_status()
+    return response.text
+
+def descobrir_regioes(url=URL_SETOP, session=None):
+    """
+    Lê só o mapa de regiões, com uma requisição HTTP
+    """
+    if session is None:
+        session = obter_sessao()
+
+    print(f"Tentando acessar: {url}")
+    regioes_info = extrair_regioes(_baixar_pagina(session, url), url)
+    print(f"Encontradas {len(regioes_info)} regiões")
+    return regioes_info
+
+def listar_planilhas_regiao(regiao, session=None):
+    """
+    Planilhas (tarefas) da página de uma região
+    """
+    if session is None:
+        session = obter_sessao()
+
+    print(f"\nListando planilhas da região: {regiao['nome']}")
+    links = extrair_planilhas(_baixar_pagina(session, regiao['href']), regiao['href'])
+    if not links:
+        print(f"Nenhuma planilha encontrada para a região {regiao['nome']}")
+    return [criar_tarefa(regiao['nome'], link) for link in links]
+
+def descobrir_planilhas_http(url=URL_SETOP, session=None):
+    """
+    Descobre regiões e planilhas apenas com requisições HTTP, sem navegador
+    """
+    if session is None:
+        session = obter_sessao()
+
+    regioes_info = descobrir_regioes(url, session)
+
+    tarefas = []
+    for regiao in regioes_info:
+        try:
+            tarefas.extend(listar_planilhas_regiao(regiao, session))
+        except Exception as e:
+            print(f"Erro ao processar região {regiao['nome']}: {str(e)}")
+            continue
+
+    return regioes_info, tarefas
+
+def fechar_navegador_com_timeout(driver, timeout=10):
+    """
+    Fecha o navegador com um timeout
+    """
+    try:
+        print("Tentando fechar navegador normalmente...")
+        driver.quit()
+        print("Navegador fechado com sucesso")
+        return True
+    except Exception as e:
+        print(f"Erro ao fechar navegador: {str(e)}")
+        try:
+            print("Tentando forçar fechamento...")
+            driver.quit()
+        except:
+            print("Não foi possível fechar o navegador")
+        return False
+
+def _abrir_pagina(driver, url):
+    """
+    driver.get passando pelo controlador do host, que limita a concorrência
+    e respeita as pausas pedidas pelo servidor. Sem status HTTP, o
+    resultado não ajusta o limite.
+    """
+    controlador = obter_controlador(url)
+    controlador.reservar()
+    try:
+        driver.get(url)
+    except Exception:
+        controlador.liberar(falha=True)
+        raise
+    controlador.liberar()
+
+def descobrir_planilhas_selenium(url=URL_SETOP):
+    """
+    Descobre regiões e planilhas navegando com o Firefox em modo headless
+    """
+    # Importado aqui para que o modo HTTP funcione sem o Selenium/Firefox
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException
+
+    driver = None
+    try:
+        firefox_options = webdriver.FirefoxOptions()
+        firefox_options.add_argument('--headless')
+        firefox_options.add_argument('--ignore-certificate-errors')
+        firefox_options.add_argument('--ignore-ssl-errors')
+        firefox_options.log.level = 'fatal'
+
+        print("Configurando Firefox...")
+        driver = webdriver.Firefox(options=firefox_options)
+        driver.implicitly_wait(10)  # Aumentado para 10 segundos
+        wait = WebDriverWait(driver, 10)  # Aumentado para 10 segundos
+
+        print(f"Tentando acessar: {url}")
+        _abrir_pagina(driver, url)
+
+        try:
+            wait.until(EC.presence_of_element_located((By.CLASS_NAME, "map-container")))
+        except TimeoutException:
+            wait.until(EC.presence_of_element_located((By.TAG_NAME, "map")))
+
+        regioes_info = []
+        municipios = driver.find_elements(By.CSS_SELECTOR, "area[title]")
+
+        for municipio in municipios:
+            regioes_info.append({
+                'nome': municipio.get_attribute("title"),
+                'href': municipio.get_attribute("href")
+            })
+
+        print(f"Encontradas {len(regioes_info)} regiões")
+
+        tarefas = []
+        for regiao in regioes_info:
+            try:
+                print(f"\nListando planilhas da região: {regiao['nome']}")
+                _abrir_pagina(driver, regiao['href'])
+
+                links_planilhas = wait.until(
+                    EC.presence_of_all_elements_located(
+                        (By.CSS_SELECTOR, "a[href$='.xls'], a[href$='.xlsx']")
+                    )
+                )
+
+                for link in links_planilhas:
+                    tarefas.append(criar_tarefa(regiao['nome'], {
+                        'url': link.get_attribute("href"),
+                        'texto': link.text
+                    }))
+
+            except Exception as e:
+                print(f"Erro ao processar região {regiao['nome']}: {str(e)}")
+                continue
+
+        return regioes_info, tarefas
+    finally:
+        if driver:
+            print("Fechando navegador após a coleta dos links...")
+            fechar_navegador_com_timeout(driver)
+
+def descobrir_planilhas(modo=None):
+    """
+    Retorna (regioes_info, tarefas) usando o modo configurado.
+    No modo 'http', cai para o Selenium se nenhuma região for encontrada.
+    """
+    modo = modo or MODO_DESCOBERTA
+    if modo == 'selenium':
+        return descobrir_planilhas_selenium()
+
+    try:
+        regioes_info, tarefas = descobrir_planilhas_http()
+        if regioes_info:
+            return regioes_info, tarefas
+        print("Nenhuma região encontrada via HTTP, tentando com Selenium...")
+    except Exception as e:
+        print(f"Erro na descoberta via HTTP: {str(e)}. Tentando com Selenium...")
+    return descobrir_planilhas_selenium()
+
+if __name__ == "__main__":
+    # Uso: python -m scraper.descoberta pagina.html [url_base]
+    # Permite conferir o parser contra páginas do SETOP salvas em disco
+    caminho = sys.argv[1]
+    base_url = sys.argv[2] if len(sys.argv) > 2 else URL_SETOP
+    with open(caminho, encoding='utf-8') as f:
+        html = f.read()
+    for regiao in extrair_regioes(html, base_url):
+        print(f"REGIÃO   {regiao['nome']}: {regiao['href']}")
+    for link in extrair_planilhas(html, base_url):
+        print(f"PLANILHA {link['texto']}: {link['url']}")
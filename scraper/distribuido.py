@@ -0,0 +1,468 @@
+import os
+import re
+import time
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import psycopg2
+from psycopg2.errors import UndefinedTable
+from psycopg2.extras import Json
+from scraper.banco import DATABASE_URL, conexao
+from scraper.cache import CACHE_ATIVO, CACHE_DIR, CachePlanilhas
+from scraper.descoberta import MODO_DESCOBERTA, descobrir_planilhas, descobrir_regioes, listar_planilhas_regiao
+from scraper.scraping import DIRETORIO_DADOS, MAX_PROCESSOS, SaidasScraper, processar_tarefas
+from scraper.test_db import CarregadorPrecos, copiar_dataframe, preparar_dados
+from scraper import metricas
+
+# Validade do lease de uma região: sem heartbeat por mais tempo que isso
+# (ex.: container do worker encerrado), outro worker pode reservá-la
+DURACAO_LEASE = int(os.environ.get('SETOP_LEASE_REGIAO', '60'))
+INTERVALO_HEARTBEAT = DURACAO_LEASE / 4
+
+# Reservas de uma mesma região antes de ela ser marcada como erro
+MAX_TENTATIVAS = int(os.environ.get('SETOP_TENTATIVAS_REGIAO', '3'))
+
+# Intervalo entre consultas à tabela de regiões quando não há nada livre
+INTERVALO_CONSULTA = float(os.environ.get('SETOP_INTERVALO_WORKER', '2'))
+
+PENDENTE = 'pendente'
+EXECUTANDO = 'executando'
+CONCLUIDA = 'concluida'
+ERRO = 'erro'
+
+class LeasePerdido(Exception):
+    """
+    O lease da região expirou e ela foi reservada por outro worker
+    """
+
+def identificador_worker():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def criar_tabelas_distribuicao(cursor):
+    """
+    Rodadas distribuídas, uma linha por região de cada rodada (com a
+    página e as planilhas dela e o lease do worker que a processa) e a
+    staging onde os workers gravam as linhas de cada região concluída
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS distribuicao_rodadas (
+            id BIGSERIAL PRIMARY KEY,
+            status VARCHAR(20) NOT NULL DEFAULT 'ativa',
+            criada_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+            finalizada_em TIMESTAMPTZ
+        );
+        -- Uma única rodada ativa por vez
+        CREATE UNIQUE INDEX IF NOT EXISTS distribuicao_rodadas_ativa
+            ON distribuicao_rodadas ((true)) WHERE status = 'ativa';
+        CREATE TABLE IF NOT EXISTS distribuicao_regioes (
+            rodada_id BIGINT NOT NULL,
+            regiao VARCHAR(50) NOT NULL,
+            href TEXT,
+            planilhas JSONB,
+            estado VARCHAR(20) NOT NULL DEFAULT 'pendente',
+            worker VARCHAR(100),
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            lease_ate TIMESTAMPTZ,
+            heartbeat_em TIMESTAMPTZ,
+            linhas INTEGER,
+            planilhas_erro INTEGER,
+            mensagem TEXT,
+            PRIMARY KEY (rodada_id, regiao)
+        );
+        CREATE TABLE IF NOT EXISTS distribuicao_staging (
+            ordem BIGSERIAL,
+            rodada_id BIGINT NOT NULL,
+            codigo VARCHAR(50),
+            descricao_servico TEXT,
+            unidade VARCHAR(20),
+            custo_unitario DECIMAL(10,2),
+            regiao VARCHAR(50),
+            ano VARCHAR(20),
+            planilha INTEGER
+        );
+        ALTER TABLE distribuicao_staging ADD COLUMN IF NOT EXISTS planilha INTEGER;
+        CREATE INDEX IF NOT EXISTS distribuicao_staging_regiao ON distribuicao_staging (rodada_id, regiao);
+    """)
+
+def rodada_ativa():
+    """
+    Id da rodada distribuída em andamento, ou None
+    """
+    with conexao() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('distribuicao_rodadas') IS NOT NULL")
+            if not cursor.fetchone()[0]:
+                return None
+            cursor.execute("SELECT id FROM distribuicao_rodadas WHERE status = 'ativa'")
+            linha = cursor.fetchone()
+            return linha[0] if linha else None
+
+def criar_rodada(regioes, log_message=print):
+    """
+    Cancela a rodada ativa (se houver) e cria uma nova com uma linha por
+    região: {'nome', 'href', 'planilhas'}, onde planilhas é None quando
+    o worker que reservar a região deve listá-las na página dela.
+    Retorna o id da rodada.
+    """
+    with conexao() as conn:
+        with conn.cursor() as cursor:
+            criar_tabelas_distribuicao(cursor)
+            cursor.execute("""
+                UPDATE distribuicao_rodadas SET status = 'cancelada', finalizada_em = now()
+                WHERE status = 'ativa' RETURNING id
+            """)
+            for (anterior,) in cursor.fetchall():
+                cursor.execute("DELETE FROM distribuicao_staging WHERE rodada_id = %s", (anterior,))
+                log_message(f"Rodada distribuída {anterior} cancelada")
+            cursor.execute("INSERT INTO distribuicao_rodadas DEFAULT VALUES RETURNING id")
+            rodada_id = cursor.fetchone()[0]
+            for regiao in regioes:
+                planilhas = regiao.get('planilhas')
+                cursor.execute(
+                    "INSERT INTO distribuicao_regioes (rodada_id, regiao, href, planilhas) VALUES (%s, %s, %s, %s)",
+                    (rodada_id, regiao['nome'], regiao.get('href'), Json(planilhas) if planilhas is not None else None)
+                )
+    return rodada_id
+
+def reservar_regiao(worker):
+    """
+    Reserva uma região livre da rodada ativa: pendente ou com o lease
+    expirado (worker que parou de enviar heartbeat). Com as planilhas já
+    conhecidas, as maiores primeiro, para as últimas a terminar serem as
+    menores. Retorna a reserva ou None se não houver região livre.
+    """
+    try:
+        with conexao() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE distribuicao_regioes d SET
+                        estado = 'executando', worker = %s, tentativas = d.tentativas + 1,
+                        lease_ate = now() + make_interval(secs => %s), heartbeat_em = now(), mensagem = NULL
+                    FROM (
+                        SELECT r.rodada_id, r.regiao
+                        FROM distribuicao_regioes r
+                        JOIN distribuicao_rodadas o ON o.id = r.rodada_id AND o.status = 'ativa'
+                        WHERE (r.estado = 'pendente' OR (r.estado = 'executando' AND r.lease_ate < now()))
+                          AND r.tentativas < %s
+                        ORDER BY coalesce(jsonb_array_length(r.planilhas), 0) DESC, r.regiao
+                        LIMIT 1
+                        FOR UPDATE OF r SKIP LOCKED
+                    ) livre
+                    WHERE d.rodada_id = livre.rodada_id AND d.regiao = livre.regiao
+                    RETURNING d.rodada_id, d.regiao, d.href, d.planilhas, d.tentativas
+                """, (worker, DURACAO_LEASE, MAX_TENTATIVAS))
+                linha = cursor.fetchone()
+    except UndefinedTable:
+        # Nenhuma rodada distribuída foi criada ainda
+        return None
+    if linha is None:
+        return None
+    rodada_id, regiao, href, planilhas, tentativa = linha
+    return {
+        'rodada_id': rodada_id, 'regiao': regiao, 'href': href, 'planilhas': planilhas,
+        'tentativa': tentativa, 'worker': worker,
+    }
+
+# Condição que só vale enquanto a reserva ainda é deste worker: uma nova
+# reserva da região (após o lease expirar) incrementa as tentativas
+_DONO_RESERVA = "rodada_id = %s AND regiao = %s AND worker = %s AND tentativas = %s AND estado = 'executando'"
+
+def _chave_reserva(reserva):
+    return (reserva['rodada_id'], reserva['regiao'], reserva['worker'], reserva['tentativa'])
+
+def renovar_lease(reserva):
+    """
+    Estende o lease da região. Retorna False se a reserva foi perdida.
+    """
+    with conexao() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                UPDATE distribuicao_regioes SET
+                    lease_ate = now() + make_interval(secs => %s), heartbeat_em = now()
+                WHERE {_DONO_RESERVA}
+            """, (DURACAO_LEASE, *_chave_reserva(reserva)))
+            return cursor.rowcount == 1
+
+def devolver_regiao(reserva, mensagem):
+    """
+    Devolve a região após uma falha: volta a ficar pendente para outro
+    worker, ou vira erro se já atingiu MAX_TENTATIVAS
+    """
+    with conexao() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                UPDATE distribuicao_regioes SET
+                    estado = CASE WHEN tentativas >= %s THEN 'erro' ELSE 'pendente' END,
+                    lease_ate = NULL, mensagem = %s
+                WHERE {_DONO_RESERVA}
+            """, (MAX_TENTATIVAS, mensagem[:1000], *_chave_reserva(reserva)))
+
+class HeartbeatRegiao(threading.Thread):
+    """
+    Renova o lease da região enquanto ela é processada. Se a reserva for
+    perdida, sinaliza `perdido` para o processamento ser interrompido.
+    """
+    def __init__(self, reserva):
+        super().__init__(daemon=True)
+        self.reserva = reserva
+        self.parar = threading.Event()
+        self.perdido = threading.Event()
+
+    def run(self):
+        while not self.parar.wait(INTERVALO_HEARTBEAT):
+            try:
+                if not renovar_lease(self.reserva):
+                    print(f"Lease da região {self.reserva['regiao']} perdido")
+                    self.perdido.set()
+                    return
+            except Exception as e:
+                # Falha passageira do banco: tenta de novo no próximo intervalo
+                print(f"Erro ao renovar o lease da região {self.reserva['regiao']}: {str(e)}")
+
+class CarregadorRegiao:
+    """
+    Carregador das planilhas de uma região reservada: as linhas vão para
+    distribuicao_staging em uma transação que só é confirmada junto com
+    a conclusão da região, se a reserva ainda for deste worker. Um worker
+    que cai no meio da região não deixa linhas para trás.
+    """
+    def __init__(self, reserva, perdido):
+        self.reserva = reserva
+        self.perdido = perdido
+        self.registros = 0
+        self.conn = psycopg2.connect(DATABASE_URL)
+        self.cursor = self.conn.cursor()
+
+    def adicionar(self, df, planilha=None):
+        if self.perdido.is_set():
+            raise LeasePerdido(f"região {self.reserva['regiao']} reservada por outro worker")
+        dados = preparar_dados(df)
+        dados.insert(0, 'rodada_id', self.reserva['rodada_id'])
+        dados['planilha'] = planilha
+        inicio = time.time()
+        copiar_dataframe(self.cursor, dados, 'distribuicao_staging')
+        self.registros += len(dados)
+        metricas.contar('setop_etapa_segundos_total', time.time() - inicio, etapa='copy')
+        metricas.contar('setop_linhas_enviadas_total', len(dados))
+
+    def concluir(self, planilhas, planilhas_erro):
+        """
+        Marca a região como concluída na mesma transação das linhas
+        """
+        self.cursor.execute(f"""
+            UPDATE distribuicao_regioes SET
+                estado = 'concluida', lease_ate = NULL, heartbeat_em = now(),
+                planilhas = %s, linhas = %s, planilhas_erro = %s
+            WHERE {_DONO_RESERVA}
+        """, (Json(planilhas), self.registros, planilhas_erro, *_chave_reserva(self.reserva)))
+        if self.cursor.rowcount != 1:
+            raise LeasePerdido(f"região {self.reserva['regiao']} reservada por outro worker")
+        self.conn.commit()
+        self.conn.close()
+
+    def cancelar(self):
+        try:
+            self.conn.rollback()
+            self.conn.close()
+        except Exception:
+            pass
+
+def _nome_diretorio(regiao):
+    return re.sub(r'\W+', '_', regiao.lower()).strip('_') or 'sem_nome'
+
+class WorkerRegioes:
+    """
+    Reserva regiões da rodada ativa e processa as planilhas de cada uma
+    com o pool de leitura do processo
+    """
+    def __init__(self, pool, worker=None):
+        self.pool = pool
+        self.worker = worker or identificador_worker()
+
+    def processar_proxima(self):
+        """
+        Processa uma região livre. Retorna False se não havia nenhuma.
+        """
+        reserva = reservar_regiao(self.worker)
+        if reserva is None:
+            return False
+
+        regiao = reserva['regiao']
+        print(f"\nRegião {regiao} (rodada {reserva['rodada_id']}, tentativa {reserva['tentativa']})")
+        inicio = time.perf_counter()
+        heartbeat = HeartbeatRegiao(reserva)
+        heartbeat.start()
+        carregador = None
+        saidas = None
+        # Cache e quarentena por região: cada uma é processada por um
+        # worker de cada vez, em qualquer container
+        diretorio = os.path.join(DIRETORIO_DADOS, 'regioes', _nome_diretorio(regiao))
+        cache = CachePlanilhas(os.path.join(CACHE_DIR, 'regioes', _nome_diretorio(regiao))) if CACHE_ATIVO else None
+        try:
+            os.makedirs(diretorio, exist_ok=True)
+            carregador = CarregadorRegiao(reserva, heartbeat.perdido)
+            saidas = SaidasScraper(os.path.join(diretorio, 'planilhas_consolidadas.csv'), carregador,
+                                   exportar_csv=False, exportar_colunar=False)
+            planilhas = reserva['planilhas']
+            if planilhas is None:
+                # A página da região é lida por quem a reserva, não pelo coordenador
+                with metricas.medir('descoberta', regiao=regiao):
+                    tarefas = listar_planilhas_regiao({'nome': regiao, 'href': reserva['href']})
+                planilhas = [{'url': tarefa['url'], 'ano': tarefa['ano']} for tarefa in tarefas]
+            tarefas = [
+                {'regiao': regiao, 'url': planilha['url'], 'ano': planilha['ano'], 'indice': indice}
+                for indice, planilha in enumerate(planilhas)
+            ]
+            print(f"{len(tarefas)} planilhas na região {regiao}")
+            with metricas.medir('regiao', regiao=regiao):
+                processar_tarefas(tarefas, saidas, cache, self.pool)
+                saidas.finalizar()
+            if saidas.erros and not saidas.entregues:
+                raise RuntimeError("nenhuma planilha da região pôde ser processada")
+            heartbeat.parar.set()
+            carregador.concluir(planilhas, saidas.erros)
+            print(f"Região {regiao} concluída: {carregador.registros} linhas, {saidas.erros} planilhas com erro "
+                  f"em {time.perf_counter() - inicio:.1f}s")
+        except Exception as e:
+            if carregador:
+                carregador.cancelar()
+            print(f"Erro na região {regiao}: {str(e)}")
+            if not isinstance(e, LeasePerdido):
+                devolver_regiao(reserva, str(e))
+        finally:
+            heartbeat.parar.set()
+            heartbeat.join()
+            if saidas:
+                saidas.fechar()
+            if cache:
+                cache.salvar()
+        return True
+
+def situacao_rodada(rodada_id):
+    """
+    Regiões da rodada por estado. Regiões abandonadas (lease expirado)
+    que já esgotaram as tentativas são marcadas como erro.
+    """
+    with conexao() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE distribuicao_regioes SET estado = 'erro', lease_ate = NULL,
+                    mensagem = coalesce(mensagem, 'lease expirado na última tentativa')
+                WHERE rodada_id = %s AND estado = 'executando' AND lease_ate < now() AND tentativas >= %s
+            """, (rodada_id, MAX_TENTATIVAS))
+            cursor.execute("""
+                SELECT estado, count(*), coalesce(sum(linhas), 0), coalesce(sum(planilhas_erro), 0)
+                FROM distribuicao_regioes WHERE rodada_id = %s GROUP BY estado
+            """, (rodada_id,))
+            situacao = {PENDENTE: 0, EXECUTANDO: 0, CONCLUIDA: 0, ERRO: 0, 'linhas': 0, 'planilhas_erro': 0}
+            for estado, regioes, linhas, planilhas_erro in cursor.fetchall():
+                situacao[estado] = regioes
+                situacao['linhas'] += linhas
+                situacao['planilhas_erro'] += planilhas_erro
+            return situacao
+
+def encerrar_rodada(rodada_id, status, cursor=None):
+    """
+    Encerra a rodada e apaga as linhas dela da staging (na transação do
+    cursor informado, ou em uma conexão do pool)
+    """
+    if cursor is None:
+        with conexao() as conn:
+            with conn.cursor() as cursor:
+                return encerrar_rodada(rodada_id, status, cursor)
+    cursor.execute(
+        "UPDATE distribuicao_rodadas SET status = %s, finalizada_em = now() WHERE id = %s", (status, rodada_id)
+    )
+    cursor.execute("DELETE FROM distribuicao_staging WHERE rodada_id = %s", (rodada_id,))
+
+def carregar_rodada(rodada_id, log_message=print):
+    """
+    Merge das linhas de todas as regiões concluídas em precos_fatos, com o
+    carregador de sempre (merge incremental ou troca, histórico, matriz e
+    versão), encerrando a rodada na mesma transação
+    """
+    carregador = CarregadorPrecos(log_message)
+    try:
+        carregador.adicionar_consulta("""
+            SELECT codigo, descricao_servico, unidade, custo_unitario, regiao, ano, planilha
+            FROM distribuicao_staging WHERE rodada_id = %s ORDER BY ordem
+        """, (rodada_id,))
+        if not carregador.registros:
+            log_message("\nNenhum registro foi enviado para o banco")
+            carregador.cancelar()
+            encerrar_rodada(rodada_id, 'erro')
+            return None
+
+        with metricas.medir('importacao'):
+            resultado = carregador.finalizar(lambda cursor: encerrar_rodada(rodada_id, 'concluida', cursor))
+        log_message("\nImportação concluída com sucesso!")
+        return resultado
+    except Exception as e:
+        carregador.cancelar()
+        log_message(f"\nErro durante a importação da rodada distribuída: {str(e)}")
+        return None
+
+def _descobrir_regioes():
+    """
+    Regiões da rodada. Via HTTP só o mapa é lido aqui e as páginas das
+    regiões ficam para os workers; com o Selenium (configurado ou como
+    fallback), as planilhas já vêm listadas.
+    """
+    if MODO_DESCOBERTA != 'selenium':
+        try:
+            regioes_info = descobrir_regioes()
+            if regioes_info:
+                return [{'nome': regiao['nome'], 'href': regiao['href'], 'planilhas': None} for regiao in regioes_info]
+            print("Nenhuma região encontrada via HTTP, tentando com Selenium...")
+        except Exception as e:
+            print(f"Erro na descoberta via HTTP: {str(e)}. Tentando com Selenium...")
+    regioes_info, tarefas = descobrir_planilhas('selenium')
+    regioes = {regiao['nome']: {**regiao, 'planilhas': []} for regiao in regioes_info}
+    for tarefa in tarefas:
+        regioes[tarefa['regiao']]['planilhas'].append({'url': tarefa['url'], 'ano': tarefa['ano']})
+    return list(regioes.values())
+
+def coordenar(log_message=print, retomar=False):
+    """
+    Pipeline distribuído: lê o mapa de regiões, cria uma rodada com uma
+    linha por região e espera os workers (manage.py worker_regioes)
+    processarem todas, processando regiões também enquanto espera. Depois
+    carrega o resultado em precos_fatos. Com retomar=True, continua a
+    rodada ativa sem nova descoberta. Retorna o resultado da carga ou
+    None em caso de erro.
+    """
+    log_message("\n" + "="*50)
+    log_message("INICIANDO SCRAPING DISTRIBUÍDO POR REGIÃO")
+    log_message("="*50)
+
+    rodada_id = rodada_ativa() if retomar else None
+    if rodada_id:
+        log_message(f"Retomando a rodada distribuída {rodada_id}")
+    else:
+        with metricas.medir('descoberta'):
+            regioes = _descobrir_regioes()
+        if not regioes:
+            log_message("\nNenhuma região encontrada")
+            return None
+        rodada_id = criar_rodada(regioes, log_message)
+        log_message(f"Rodada {rodada_id}: {len(regioes)} regiões aguardando os workers")
+
+    anterior = None
+    with ProcessPoolExecutor(max_workers=MAX_PROCESSOS, mp_context=get_context('spawn')) as pool:
+        worker = WorkerRegioes(pool)
+        while True:
+            situacao = situacao_rodada(rodada_id)
+            if situacao != anterior:
+                log_message(f"Regiões: {situacao[CONCLUIDA]} concluídas, {situacao[EXECUTANDO]} em andamento, "
+                            f"{situacao[PENDENTE]} pendentes, {situacao[ERRO]} com erro")
+                anterior = situacao
+            if not situacao[PENDENTE] and not situacao[EXECUTANDO]:
+                break
+            if not worker.processar_proxima():
+                time.sleep(INTERVALO_CONSULTA)
+
+    if situacao[ERRO] or situacao['planilhas_erro']:
+        log_message(f"\nAtenção: {situacao[ERRO]} regiões e {situacao['planilhas_erro']} planilhas com erro "
+                    f"ficaram fora da carga")
+    return carregar_rodada(rodada_id, log_message)
@@ -0,0 +1,133 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+from scraper import metricas
+from scraper.controle_host import MAX_POR_HOST, STATUS_RETRY, obter_controlador, segundos_retry_after
+
+# Threads do pool de downloads; as requisições simultâneas a cada host
+# são limitadas pelo controlador do host (scraper/controle_host.py)
+MAX_DOWNLOADS = int(os.environ.get('SETOP_MAX_DOWNLOADS', '8'))
+
+_sessao = None
+_sessao_lock = threading.Lock()
+
+def criar_sessao(pool_maxsize=MAX_POR_HOST):
+    """
+    Cria uma sessão HTTP com pool de conexões. Os retries ficam em
+    requisitar(), para que o controlador do host veja cada resposta.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=MAX_DOWNLOADS,
+        pool_maxsize=pool_maxsize
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def obter_sessao():
+    """
+    Retorna a sessão compartilhada do processo, criando-a na primeira chamada
+    """
+    global _sessao
+    with _sessao_lock:
+        if _sessao is None:
+            _sessao = criar_sessao()
+        return _sessao
+
+def requisitar(session, url, headers=None, max_retries=3, backoff_factor=0.5, timeout=30):
+    """
+    GET com retry passando pelo controlador do host: espera uma vaga,
+    informa o status, a latência e o Retry-After de cada tentativa e
+    repete em 429/5xx, timeout ou erro de conexão
+    """
+    controlador = obter_controlador(url)
+    for tentativa in range(max_retries + 1):
+        if tentativa:
+            metricas.contar('setop_retries_total')
+        controlador.reservar()
+        liberado = False
+        try:
+            response = session.get(url, timeout=timeout, headers=headers or {})
+            retry_after = segundos_retry_after(response.headers.get('Retry-After')) \
+                if response.status_code in STATUS_RETRY else None
+            # elapsed vai até os cabeçalhos, sem o tempo de transferência do corpo
+            controlador.liberar(response.status_code, response.elapsed.total_seconds(), retry_after)
+            liberado = True
+            if response.status_code not in STATUS_RETRY or tentativa == max_retries:
+                return response
+        except (requests.Timeout, requests.ConnectionError):
+            if tentativa == max_retries:
+                raise
+        finally:
+            # Qualquer outro erro (redirecionamentos, URL inválida...) sobe,
+            # mas a vaga do host é sempre devolvida
+            if not liberado:
+                controlador.liberar(falha=True)
+        time.sleep(backoff_factor * (2 ** tentativa))
+
+def download_planilha(url, max_retries=3, backoff_factor=0.5, session=None, cache=None):
+    """
+    Tenta baixar a planilha com sistema de retry.
+    Com cache, faz uma requisição condicional e reaproveita o conteúdo salvo.
+    """
+    if session is None:
+        session = obter_sessao()
+
+    inicio = time.perf_counter()
+    status = None
+    try:
+        headers = cache.cabecalhos_condicionais(url) if cache else {}
+        response = requisitar(session, url, headers, max_retries, backoff_factor)
+        status = response.status_code
+        metricas.contar('setop_bytes_baixados_total', len(response.content))
+        if response.status_code == 304 and cache:
+            return cache.registrar_nao_modificada(url)
+        if response.status_code == 200:
+            if cache:
+                return cache.registrar_download(url, response.content, response.headers)
+            return response.content
+        else:
+            print(f"Erro ao baixar planilha. Status code: {response.status_code}")
+            return None
+    except Exception as e:
+        status = type(e).__name__
+        print(f"Erro ao baixar planilha: {str(e)}")
+        return None
+    finally:
+        metricas.contar('setop_downloads_total', status=str(status))
+        metricas.contar('setop_etapa_segundos_total', time.perf_counter() - inicio, etapa='download')
+
+def baixar_planilhas(tarefas, max_workers=MAX_DOWNLOADS, cache=None):
+    """
+    Baixa as planilhas em paralelo usando a sessão compartilhada.
+    Recebe uma lista de dicts com a chave 'url' e gera (tarefa, conteúdo)
+    conforme cada download termina. O conteúdo é None em caso de falha.
+    Só max_workers planilhas ficam baixando ou esperando por vez: a
+    próxima só começa quando uma baixada é consumida, então quem consome
+    devagar não acumula todas as planilhas em memória.
+    """
+    if not tarefas:
+        return
+    session = obter_sessao()
+    workers = max(1, min(max_workers, len(tarefas)))
+    restantes = iter(tarefas)
+    futuros = {}
+
+    def iniciar_proxima():
+        tarefa = next(restantes, None)
+        if tarefa is not None:
+            futuros[executor.submit(download_planilha, tarefa['url'], session=session, cache=cache)] = tarefa
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in range(workers):
+            iniciar_proxima()
+        while futuros:
+            concluidos, _ = wait(futuros, return_when=FIRST_COMPLETED)
+            for futuro in concluidos:
+                tarefa = futuros.pop(futuro)
+                iniciar_proxima()
+                yield tarefa, futuro.result()
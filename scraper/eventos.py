@@ -0,0 +1,119 @@
+import os
+import asyncio
+from collections import deque
+from scraper.models import Execucao, EventoExecucao
+
+# Eventos recentes de cada execução mantidos em memória no processo web
+TAMANHO_BUFFER = int(os.environ.get('SETOP_BUFFER_EVENTOS', '500'))
+
+# Intervalo (s) entre leituras de novos eventos no banco e entre heartbeats
+INTERVALO_LEITURA = 0.5
+INTERVALO_HEARTBEAT = 15
+
+class TransmissorExecucao:
+    """
+    Lê os eventos de uma execução no banco e distribui para todos os
+    clientes que acompanham ela. Só há uma leitura no banco por execução,
+    independente da quantidade de clientes.
+    """
+    def __init__(self, execucao_id):
+        self.execucao_id = execucao_id
+        self.buffer = deque(maxlen=TAMANHO_BUFFER)
+        self.descartou = False
+        self.ultimo_id = 0
+        self.status = None
+        self.finalizada = False
+        self.assinantes = 0
+        self.condicao = asyncio.Condition()
+        self.tarefa = None
+
+    def iniciar(self):
+        if self.tarefa is None or self.tarefa.done():
+            self.tarefa = asyncio.create_task(self._ler())
+
+    async def _ler(self):
+        try:
+            while self.assinantes:
+                eventos = [
+                    evento async for evento in EventoExecucao.objects.filter(
+                        execucao_id=self.execucao_id, id__gt=self.ultimo_id
+                    ).order_by('id').values_list('id', 'mensagem')
+                ]
+                if not eventos:
+                    # Só encerra depois de ler todos os eventos da execução
+                    self.status = await Execucao.objects.filter(
+                        id=self.execucao_id
+                    ).values_list('status', flat=True).afirst()
+                    if self.status not in Execucao.ATIVOS:
+                        self.finalizada = True
+                if eventos:
+                    self.descartou = self.descartou or len(self.buffer) + len(eventos) > TAMANHO_BUFFER
+                    self.buffer.extend(eventos)
+                    self.ultimo_id = eventos[-1][0]
+                if eventos or self.finalizada:
+                    async with self.condicao:
+                        self.condicao.notify_all()
+                if self.finalizada:
+                    return
+                await asyncio.sleep(INTERVALO_LEITURA)
+        finally:
+            if _transmissores.get(self.execucao_id) is self:
+                del _transmissores[self.execucao_id]
+
+    def _atrasado(self, ultimo_id):
+        # Pode haver eventos entre ultimo_id e o início do buffer que já
+        # foram descartados dele
+        return self.descartou and self.buffer and ultimo_id < self.buffer[0][0] - 1
+
+    async def _anteriores(self, ultimo_id, limite):
+        # Cliente atrasado em relação ao buffer: busca o que faltou no banco
+        filtro = EventoExecucao.objects.filter(
+            execucao_id=self.execucao_id, id__gt=ultimo_id, id__lt=limite
+        )
+        return [evento async for evento in filtro.order_by('id').values_list('id', 'mensagem')]
+
+    async def acompanhar(self, ultimo_id=0):
+        """
+        Gera os eventos com id maior que ultimo_id, depois os novos eventos
+        conforme chegam. Gera None como heartbeat e ('fim', status) quando
+        a execução termina.
+        """
+        self.assinantes += 1
+        self.iniciar()
+        try:
+            while True:
+                # Verificado a cada volta: enquanto um cliente lento recebe,
+                # o buffer pode descartar eventos que ele ainda não viu
+                while self._atrasado(ultimo_id):
+                    limite = self.buffer[0][0]
+                    for evento in await self._anteriores(ultimo_id, limite):
+                        ultimo_id = evento[0]
+                        yield evento
+                    # Tudo antes de limite já foi enviado
+                    ultimo_id = max(ultimo_id, limite - 1)
+                novos = [evento for evento in self.buffer if evento[0] > ultimo_id]
+                for evento in novos:
+                    ultimo_id = evento[0]
+                    yield evento
+                if self.finalizada and self.ultimo_id <= ultimo_id:
+                    yield ('fim', self.status)
+                    return
+                if not novos:
+                    try:
+                        async with self.condicao:
+                            await asyncio.wait_for(
+                                self.condicao.wait_for(lambda: self.ultimo_id > ultimo_id or self.finalizada),
+                                INTERVALO_HEARTBEAT
+                            )
+                    except asyncio.TimeoutError:
+                        yield None
+        finally:
+            self.assinantes -= 1
+
+_transmissores = {}
+
+def obter_transmissor(execucao_id):
+    transmissor = _transmissores.get(execucao_id)
+    if transmissor is None:
+        transmissor = _transmissores[execucao_id] = TransmissorExecucao(execucao_id)
+    return transmissor
@@ -0,0 +1,201 @@
+import os
+import sys
+import socket
+import threading
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from scraper.models import Execucao, EventoExecucao
+from scraper import metricas
+
+# Intervalo entre consultas do worker à fila e entre heartbeats (segundos)
+INTERVALO_WORKER = float(os.environ.get('SETOP_INTERVALO_WORKER', '2'))
+
+# Execuções sem heartbeat há mais tempo que isso voltam para a fila
+TIMEOUT_HEARTBEAT = int(os.environ.get('SETOP_TIMEOUT_HEARTBEAT', '120'))
+
+# Quantidade de eventos mantidos por execução (os mais antigos são apagados)
+EVENTOS_MAX = int(os.environ.get('SETOP_EVENTOS_MAX', '2000'))
+
+def enfileirar_execucao(parametros=None):
+    """
+    Cria uma execução pendente. Se já houver uma pendente ou em andamento,
+    retorna ela em vez de criar outra. Retorna (execucao, criada).
+    """
+    try:
+        with transaction.atomic():
+            return Execucao.objects.create(parametros=parametros or {}), True
+    except IntegrityError:
+        ativa = Execucao.objects.filter(status__in=Execucao.ATIVOS).first()
+        if ativa is None:
+            # A execução ativa terminou entre o INSERT e a consulta
+            return enfileirar_execucao(parametros)
+        return ativa, False
+
+def identificador_worker():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def reservar_proxima(worker):
+    """
+    Marca a execução pendente mais antiga como em andamento para este
+    worker. Retorna a execução ou None se a fila estiver vazia.
+    """
+    agora = timezone.now()
+    with transaction.atomic():
+        execucao = Execucao.objects.filter(status=Execucao.PENDENTE).order_by('id').first()
+        if execucao is None:
+            return None
+        reservadas = Execucao.objects.filter(id=execucao.id, status=Execucao.PENDENTE).update(
+            status=Execucao.EXECUTANDO, worker=worker, iniciado_em=agora, heartbeat_em=agora
+        )
+    if not reservadas:
+        return None
+    execucao.refresh_from_db()
+    return execucao
+
+def recuperar_abandonadas():
+    """
+    Devolve para a fila execuções cujo worker parou de enviar heartbeat
+    (ex.: container reiniciado no meio da execução). Elas voltam marcadas
+    para retomar do checkpoint, sem refazer as planilhas já concluídas.
+    """
+    limite = timezone.now() - timedelta(seconds=TIMEOUT_HEARTBEAT)
+    recuperadas = 0
+    for execucao in Execucao.objects.filter(status=Execucao.EXECUTANDO, heartbeat_em__lt=limite):
+        recuperadas += Execucao.objects.filter(
+            id=execucao.id, status=Execucao.EXECUTANDO, heartbeat_em__lt=limite
+        ).update(
+            status=Execucao.PENDENTE, worker='', heartbeat_em=None,
+            parametros={**execucao.parametros, 'retomar': True}
+        )
+    return recuperadas
+
+def finalizar_execucao(execucao, resultado):
+    execucao.status = Execucao.SUCESSO if resultado.get('status') == 'success' else Execucao.ERRO
+    execucao.mensagem = resultado.get('message', '')
+    execucao.tempo_execucao = resultado.get('tempo_execucao', '')
+    execucao.finalizado_em = timezone.now()
+    execucao.chave_ativa = None
+    execucao.save(update_fields=['status', 'mensagem', 'tempo_execucao', 'finalizado_em', 'chave_ativa'])
+
+def gravar_eventos(execucao_id, linhas):
+    """
+    Acrescenta linhas ao log da execução, mantendo só os EVENTOS_MAX
+    mais recentes
+    """
+    EventoExecucao.objects.bulk_create([
+        EventoExecucao(execucao_id=execucao_id, mensagem=linha) for linha in linhas
+    ])
+    corte = (
+        EventoExecucao.objects.filter(execucao_id=execucao_id)
+        .order_by('-id').values_list('id', flat=True)[EVENTOS_MAX:EVENTOS_MAX + 1]
+    )
+    if corte:
+        EventoExecucao.objects.filter(execucao_id=execucao_id, id__lte=corte[0]).delete()
+
+class SaidaExecucao:
+    """
+    Instalada uma única vez como sys.stdout do worker: repassa o texto
+    para a saída original e, enquanto houver uma execução ativa, guarda
+    cada linha para ser gravada como evento dela. As linhas são gravadas
+    em lote pela thread de heartbeat.
+    """
+    def __init__(self, saida_original):
+        self.saida_original = saida_original
+        self.execucao_id = None
+        self.pendentes = []
+        self.parcial = ''
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        self.saida_original.write(text)
+        with self.lock:
+            if self.execucao_id is not None:
+                self.parcial += text
+                *linhas, self.parcial = self.parcial.split('\n')
+                self.pendentes.extend(linha for linha in linhas if linha.strip())
+        return len(text)
+
+    def flush(self):
+        self.saida_original.flush()
+
+    def iniciar(self, execucao):
+        with self.lock:
+            self.execucao_id = execucao.id
+            self.pendentes = []
+            self.parcial = ''
+
+    def encerrar(self):
+        with self.lock:
+            if self.parcial.strip():
+                self.pendentes.append(self.parcial)
+            self.parcial = ''
+        self.gravar()
+        with self.lock:
+            self.execucao_id = None
+
+    def gravar(self):
+        with self.lock:
+            execucao_id = self.execucao_id
+            linhas, self.pendentes = self.pendentes, []
+        if linhas and execucao_id is not None:
+            gravar_eventos(execucao_id, linhas)
+
+def instalar_saida():
+    """
+    Substitui o sys.stdout do processo por uma SaidaExecucao. Chamado
+    na inicialização do worker, antes de qualquer thread ser criada.
+    """
+    if not isinstance(sys.stdout, SaidaExecucao):
+        sys.stdout = SaidaExecucao(sys.stdout)
+    return sys.stdout
+
+class Heartbeat(threading.Thread):
+    """
+    Atualiza o heartbeat da execução e grava os eventos pendentes
+    periodicamente enquanto ela roda
+    """
+    def __init__(self, execucao, saida):
+        super().__init__(daemon=True)
+        self.execucao = execucao
+        self.saida = saida
+        self.parar = threading.Event()
+
+    def run(self):
+        while not self.parar.wait(INTERVALO_WORKER):
+            self.pulsar()
+
+    def pulsar(self):
+        try:
+            Execucao.objects.filter(id=self.execucao.id).update(heartbeat_em=timezone.now())
+            self.saida.gravar()
+            # Mantém o /metrics atualizado durante a execução
+            metricas.salvar_estado()
+        except Exception as e:
+            self.saida.saida_original.write(f"Erro ao gravar eventos da execução: {str(e)}\n")
+
+def executar(execucao, funcao, saida=None):
+    """
+    Roda funcao() gravando a saída como eventos da execução e registra
+    o resultado ao final
+    """
+    saida = saida or instalar_saida()
+    heartbeat = Heartbeat(execucao, saida)
+    saida.iniciar(execucao)
+    heartbeat.start()
+    try:
+        try:
+            resultado = funcao()
+        except Exception as e:
+            resultado = {'status': 'error', 'message': f'ERRO: {str(e)}', 'tempo_execucao': '0:0'}
+        mensagem = resultado['message']
+        if resultado.get('status') != 'success' and not mensagem.startswith('ERRO'):
+            mensagem = f"ERRO: {mensagem}"
+        print(f"\n{mensagem}")
+    finally:
+        heartbeat.parar.set()
+        heartbeat.join()
+        heartbeat.pulsar()
+        saida.encerrar()
+    finalizar_execucao(execucao, resultado)
+    return resultado
@@ -0,0 +1,141 @@
+import os
+import shutil
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # exportação colunar é opcional
+    pa = None
+    ds = None
+    pq = None
+
+# Exporta Parquet particionado e arquivo Arrow IPC junto com o CSV
+EXPORTAR_COLUNAR = os.environ.get('SETOP_EXPORTAR_COLUNAR', '1') != '0'
+
+COLUNAS_PARTICAO = ['regiao', 'ANO']
+
+def esquema_precos():
+    """
+    Esquema Arrow dos dados consolidados: UNIDADE e regiao como
+    dicionário e o custo como float64
+    """
+    texto_dicionario = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('CÓDIGO', pa.string()),
+        ('DESCRIÇÃO DO SERVIÇO', pa.string()),
+        ('UNIDADE', texto_dicionario),
+        ('CUSTO UNITÁRIO', pa.float64()),
+        ('regiao', texto_dicionario),
+        ('ANO', pa.string()),
+    ])
+
+def esquema_sem_dicionario(esquema):
+    # O formato de arquivo IPC não aceita dicionários diferentes entre lotes
+    return pa.schema([
+        pa.field(campo.name, campo.type.value_type if pa.types.is_dictionary(campo.type) else campo.type)
+        for campo in esquema
+    ])
+
+def para_tabela_arrow(df):
+    """
+    Converte um DataFrame do scraper para uma tabela Arrow tipada
+    """
+    df = df.copy()
+    if 'ANO' not in df.columns:
+        df['ANO'] = "N/A"
+    for coluna in ['CÓDIGO', 'DESCRIÇÃO DO SERVIÇO', 'UNIDADE', 'regiao', 'ANO']:
+        df[coluna] = df[coluna].astype('string')
+    for coluna in ['UNIDADE', 'regiao']:
+        df[coluna] = df[coluna].astype('category')
+    esquema = esquema_precos()
+    return pa.Table.from_pandas(df[esquema.names], schema=esquema, preserve_index=False)
+
+class ExportadorColunar:
+    """
+    Grava os dados em Parquet particionado por região e ano e em um
+    arquivo Arrow IPC (mapeável em memória), lote a lote. Os arquivos
+    finais só são substituídos em finalizar().
+    """
+    def __init__(self, diretorio='/app/data', nome='planilhas_consolidadas'):
+        self.dir_parquet = os.path.join(diretorio, f'{nome}_parquet')
+        self.caminho_arrow = os.path.join(diretorio, f'{nome}.arrow')
+        self.dir_parquet_tmp = self.dir_parquet + '.tmp'
+        self.caminho_arrow_tmp = self.caminho_arrow + '.tmp'
+        self.esquema_ipc = esquema_sem_dicionario(esquema_precos())
+        self.escritor_ipc = None
+        self.lotes = 0
+        self.registros = 0
+        shutil.rmtree(self.dir_parquet_tmp, ignore_errors=True)
+
+    def adicionar(self, df):
+        """
+        Acrescenta um lote (ex.: uma planilha) às saídas colunares
+        """
+        tabela = para_tabela_arrow(df)
+        pq.write_to_dataset(
+            tabela,
+            self.dir_parquet_tmp,
+            partition_cols=COLUNAS_PARTICAO,
+            basename_template=f'parte-{self.lotes}-{{i}}.parquet'
+        )
+        if self.escritor_ipc is None:
+            self.escritor_ipc = pa.ipc.new_file(self.caminho_arrow_tmp, self.esquema_ipc)
+        self.escritor_ipc.write_table(tabela.cast(self.esquema_ipc))
+        self.lotes += 1
+        self.registros += tabela.num_rows
+
+    def finalizar(self):
+        """
+        Fecha os arquivos e substitui as saídas anteriores
+        """
+        if self.escritor_ipc is None:
+            return None
+        self.escritor_ipc.close()
+        os.replace(self.caminho_arrow_tmp, self.caminho_arrow)
+        shutil.rmtree(self.dir_parquet, ignore_errors=True)
+        os.replace(self.dir_parquet_tmp, self.dir_parquet)
+        print(f"Parquet salvo em: {self.dir_parquet}")
+        print(f"Arrow IPC salvo em: {self.caminho_arrow}")
+        return self.dir_parquet
+
+    def cancelar(self):
+        if self.escritor_ipc is not None:
+            self.escritor_ipc.close()
+        shutil.rmtree(self.dir_parquet_tmp, ignore_errors=True)
+        if os.path.exists(self.caminho_arrow_tmp):
+            os.remove(self.caminho_arrow_tmp)
+
+def criar_exportador(diretorio='/app/data'):
+    """
+    Retorna um ExportadorColunar, ou None se a exportação estiver
+    desativada ou o pyarrow não estiver instalado
+    """
+    if not EXPORTAR_COLUNAR:
+        return None
+    if pa is None:
+        print("pyarrow não está instalado, exportação Parquet/Arrow desativada")
+        return None
+    return ExportadorColunar(diretorio)
+
+def ler_arrow(caminho='/app/data/planilhas_consolidadas.arrow'):
+    """
+    Abre o arquivo Arrow IPC mapeado em memória, sem copiar os dados
+    """
+    return pa.ipc.open_file(pa.memory_map(caminho, 'r')).read_all()
+
+def ler_parquet(diretorio='/app/data/planilhas_consolidadas_parquet', regiao=None, ano=None):
+    """
+    Lê o Parquet particionado, lendo só as partições da região/ano pedidos
+    """
+    particoes = ds.partitioning(
+        pa.schema([(coluna, pa.string()) for coluna in COLUNAS_PARTICAO]),
+        flavor='hive'
+    )
+    dataset = ds.dataset(diretorio, format='parquet', partitioning=particoes)
+    filtro = None
+    for coluna, valor in (('regiao', regiao), ('ANO', ano)):
+        if valor is not None:
+            condicao = ds.field(coluna) == valor
+            filtro = condicao if filtro is None else filtro & condicao
+    return dataset.to_table(filter=filtro)
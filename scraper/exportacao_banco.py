@@ -0,0 +1,422 @@
+import os
+import zlib
+import queue
+import asyncio
+import threading
+import psycopg2
+from scraper.banco import DATABASE_URL
+from scraper.consultas import COLUNAS_RESPOSTA, filtro_ano
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # exportação Parquet é opcional
+    pa = None
+    pq = None
+
+# Blocos enviados ao cliente e quantos ficam em fila entre a thread que
+# lê do banco e a resposta: a memória de cada exportação fica limitada a
+# BLOCOS_EM_FILA * TAMANHO_BLOCO, qualquer que seja o tamanho da tabela
+TAMANHO_BLOCO = 64 * 1024
+BLOCOS_EM_FILA = 16
+
+# Linhas por grupo do Parquet (lidas de uma vez com um cursor no servidor)
+LINHAS_POR_GRUPO = int(os.environ.get('SETOP_EXPORTACAO_LINHAS_GRUPO', '50000'))
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+_FIM = object()
+
+# Medições de tamanho em andamento (uma por versão e filtros)
+_medicoes = set()
+_medicoes_lock = threading.Lock()
+
+class _Interrompida(Exception):
+    """
+    Encerra a leitura do banco: o cliente desconectou ou o intervalo
+    pedido (Range) já foi enviado
+    """
+
+class _Saida:
+    """
+    Arquivo só de escrita onde o COPY ou o ParquetWriter gravam: comprime
+    (gzip), descarta os bytes antes do início do intervalo pedido e
+    entrega blocos de TAMANHO_BLOCO para `enviar`
+    """
+    def __init__(self, enviar, comprimir=False, inicio=0, fim=None):
+        self.enviar = enviar
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None
+        self.inicio = inicio
+        self.fim = fim
+        self.escritos = 0
+        self.gerados = 0
+        self.buffer = bytearray()
+        self.closed = False
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        # Posição no arquivo antes da compressão (usada pelo ParquetWriter)
+        return self.escritos
+
+    def flush(self):
+        pass
+
+    def write(self, dados):
+        self.escritos += len(dados)
+        if self.compressor:
+            dados = self.compressor.compress(dados)
+        self._acrescentar(dados)
+        return len(dados)
+
+    def _acrescentar(self, dados):
+        # Posição dos dados na saída final (depois da compressão)
+        inicio_dados = self.gerados
+        self.gerados += len(dados)
+        if self.gerados <= self.inicio:
+            return
+        self.buffer += dados[max(0, self.inicio - inicio_dados):]
+        if self.fim is not None and self.gerados > self.fim:
+            # Corta no fim do intervalo e interrompe o COPY
+            del self.buffer[len(self.buffer) - (self.gerados - self.fim - 1):]
+            self._esvaziar()
+            raise _Interrompida()
+        if len(self.buffer) >= TAMANHO_BLOCO:
+            self._esvaziar()
+
+    def _esvaziar(self):
+        if self.buffer:
+            self.enviar(bytes(self.buffer))
+            self.buffer.clear()
+
+    def concluir(self):
+        if self.compressor:
+            self._acrescentar(self.compressor.flush())
+        self._esvaziar()
+
+class ExportacaoPrecos:
+    """
+    Exportação de precos_setop (com filtros por região e ano) em CSV, via
+    COPY ... TO STDOUT, ou Parquet, lida e enviada em blocos. Abre uma
+    conexão própria em uma transação REPEATABLE READ: a versão dos dados
+    (e o ETag) e as linhas exportadas vêm do mesmo snapshot, e a saída é
+    sempre igual para a mesma versão, o que permite retomar com Range.
+    """
+    def __init__(self, formato='csv', regiao=None, ano=None, comprimir=False):
+        if formato not in FORMATOS:
+            raise ValueError(f"formato inválido: {formato} (use {' ou '.join(FORMATOS)})")
+        if formato == 'parquet' and pa is None:
+            raise ValueError("exportação Parquet requer o pyarrow instalado")
+        if ano:
+            filtro_ano(ano)
+        self.formato = formato
+        self.comprimir = comprimir and formato == 'csv'
+        self.filtros = {'regiao': regiao, 'ano': ano}
+        self.conn = None
+        self.thread = None
+        self.cancelada = threading.Event()
+
+        self.conn = psycopg2.connect(DATABASE_URL)
+        try:
+            self.conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT to_regclass('precos_setop') IS NOT NULL")
+            if not cursor.fetchone()[0]:
+                raise LookupError("nenhuma importação de preços no banco")
+            cursor.execute("SELECT to_regclass('precos_setop_versao') IS NOT NULL")
+            self.versao = 0
+            if cursor.fetchone()[0]:
+                cursor.execute("SELECT versao FROM precos_setop_versao WHERE id = 1")
+                linha = cursor.fetchone()
+                self.versao = linha[0] if linha else 0
+        except Exception:
+            self.fechar()
+            raise
+
+    @property
+    def tipo_conteudo(self):
+        return 'application/gzip' if self.comprimir else FORMATOS[self.formato][0]
+
+    @property
+    def nome_arquivo(self):
+        partes = ['precos_setop'] + [valor for valor in self.filtros.values() if valor]
+        nome = '_'.join(partes).replace(' ', '_').replace('/', '-')
+        return f"{nome}.{FORMATOS[self.formato][1]}{'.gz' if self.comprimir else ''}"
+
+    def _consulta(self, cursor):
+        colunas = [
+            f"{coluna}::float8 AS {coluna}" if self.formato == 'parquet' and coluna == 'custo_unitario' else coluna
+            for coluna in COLUNAS_RESPOSTA
+        ]
+        condicoes = []
+        parametros = []
+        if self.filtros['regiao']:
+            condicoes.append("regiao = %s")
+            parametros.append(self.filtros['regiao'])
+        if self.filtros['ano']:
+            condicao, valores = filtro_ano(self.filtros['ano'])
+            condicoes.append(condicao)
+            parametros.extend(valores)
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        # Ordem da chave: a saída é a mesma a cada exportação da mesma versão
+        sql = f"SELECT {', '.join(colunas)} FROM precos_setop {where} ORDER BY codigo, regiao, ano NULLS LAST"
+        return cursor.mogrify(sql, parametros).decode()
+
+    def _gerar(self, saida):
+        """
+        Lê o banco e grava na saída; roda na thread produtora
+        """
+        if self.formato == 'csv':
+            with self.conn.cursor() as cursor:
+                cursor.copy_expert(f"COPY ({self._consulta(cursor)}) TO STDOUT WITH (FORMAT csv, HEADER)", saida)
+        else:
+            esquema = pa.schema([
+                ('codigo', pa.string()),
+                ('descricao_servico', pa.string()),
+                ('unidade', pa.string()),
+                ('custo_unitario', pa.float64()),
+                ('regiao', pa.string()),
+                ('ano', pa.string()),
+            ])
+            with self.conn.cursor() as cursor:
+                sql = self._consulta(cursor)
+            # Cursor no servidor: só LINHAS_POR_GRUPO linhas em memória por vez
+            with self.conn.cursor(name='exportacao_precos') as cursor:
+                cursor.execute(sql)
+                escritor = pq.ParquetWriter(saida, esquema, compression='zstd')
+                while linhas := cursor.fetchmany(LINHAS_POR_GRUPO):
+                    colunas = list(zip(*linhas))
+                    escritor.write_batch(pa.record_batch(
+                        [pa.array(valores, campo.type) for valores, campo in zip(colunas, esquema)],
+                        schema=esquema
+                    ))
+                escritor.close()
+        saida.concluir()
+
+    def medir(self):
+        """
+        Tamanho da exportação completa em bytes, gerando-a sem enviar
+        """
+        try:
+            saida = _Saida(lambda bloco: None, self.comprimir)
+            self._gerar(saida)
+            return saida.gerados
+        finally:
+            self._fechar_conexao()
+
+    def medir_em_segundo_plano(self, ao_medir):
+        """
+        Mede o tamanho desta exportação em uma thread, com conexão própria,
+        e chama ao_medir(tamanho) se a versão dos dados ainda for a mesma.
+        Não faz nada se a mesma medição já estiver em andamento.
+        """
+        chave = (self.versao, self.formato, self.comprimir, tuple(self.filtros.items()))
+        with _medicoes_lock:
+            if chave in _medicoes:
+                return
+            _medicoes.add(chave)
+
+        def medir():
+            try:
+                exportacao = ExportacaoPrecos(self.formato, comprimir=self.comprimir, **self.filtros)
+                if exportacao.versao != self.versao:
+                    exportacao.fechar()
+                    return
+                ao_medir(exportacao.medir())
+            except Exception as e:
+                print(f"Erro ao medir a exportação de preços: {str(e)}")
+            finally:
+                with _medicoes_lock:
+                    _medicoes.discard(chave)
+
+        threading.Thread(target=medir, daemon=True).start()
+
+    def _produzir(self, enviar, inicio, fim, ao_concluir, ao_interromper):
+        saida = _Saida(enviar, self.comprimir, inicio, fim)
+        # Sem o marcador de fim, o consumidor recebe o erro: nunca fica
+        # esperando por um bloco que não vem, mesmo se a thread falhar
+        final = RuntimeError("exportação interrompida")
+        concluida = False
+        try:
+            self._gerar(saida)
+            concluida = True
+            final = _FIM
+            # Gerada até o fim (a partir de qualquer início): o total é conhecido
+            if ao_concluir and fim is None:
+                ao_concluir(saida.gerados)
+        except _Interrompida:
+            final = _FIM
+        except Exception as e:
+            if not self.cancelada.is_set():
+                print(f"Erro na exportação de preços: {str(e)}")
+            final = e
+        finally:
+            try:
+                self._fechar_conexao()
+            except psycopg2.Error:
+                pass
+            try:
+                enviar(final)
+            except _Interrompida:
+                # Ninguém mais lê a fila
+                pass
+            if not concluida and self.cancelada.is_set() and ao_interromper:
+                ao_interromper()
+
+    def iterar(self, inicio=0, fim=None, ao_concluir=None, ao_interromper=None):
+        """
+        Blocos da exportação (bytes inicio..fim, inclusive) para uma
+        resposta síncrona (WSGI)
+        """
+        fila = queue.Queue(BLOCOS_EM_FILA)
+
+        def enviar(bloco):
+            # Com a fila cheia, a leitura do banco espera o cliente
+            while True:
+                if self.cancelada.is_set():
+                    raise _Interrompida()
+                try:
+                    fila.put(bloco, timeout=1)
+                    return
+                except queue.Full:
+                    continue
+
+        self._iniciar(enviar, inicio, fim, ao_concluir, ao_interromper)
+        try:
+            while (bloco := fila.get()) is not _FIM:
+                if isinstance(bloco, BaseException):
+                    raise bloco
+                yield bloco
+        finally:
+            self.cancelada.set()
+
+    async def iterar_async(self, inicio=0, fim=None, ao_concluir=None, ao_interromper=None):
+        """
+        Versão para o servidor ASGI: os blocos chegam por uma fila do
+        event loop, sem ocupar uma thread por cliente enquanto ele recebe
+        """
+        loop = asyncio.get_running_loop()
+        fila = asyncio.Queue(BLOCOS_EM_FILA)
+
+        def enviar(bloco):
+            # Um único put por bloco: cancelar e repetir depois de um timeout
+            # duplicaria o bloco se o put já tivesse terminado
+            if self.cancelada.is_set():
+                raise _Interrompida()
+            futuro = asyncio.run_coroutine_threadsafe(fila.put(bloco), loop)
+            while True:
+                try:
+                    futuro.result(timeout=1)
+                    return
+                except TimeoutError:
+                    if self.cancelada.is_set():
+                        futuro.cancel()
+                        raise _Interrompida()
+
+        self._iniciar(enviar, inicio, fim, ao_concluir, ao_interromper)
+        try:
+            while (bloco := await fila.get()) is not _FIM:
+                if isinstance(bloco, BaseException):
+                    raise bloco
+                yield bloco
+        finally:
+            self.cancelada.set()
+
+    def corpo(self, assincrono, inicio=0, fim=None, ao_concluir=None, ao_interromper=None):
+        """
+        Corpo para StreamingHttpResponse: iterável síncrono ou assíncrono
+        (conforme o servidor) com close(), que a resposta chama ao
+        terminar e libera a conexão mesmo se o envio nem começar.
+        ao_concluir(tamanho) é chamado quando a exportação é gerada até o
+        fim e ao_interromper() quando o cliente desconecta antes.
+        """
+        if assincrono:
+            return _CorpoAsync(self.iterar_async(inicio, fim, ao_concluir, ao_interromper), self.fechar)
+        return _Corpo(self.iterar(inicio, fim, ao_concluir, ao_interromper), self.fechar)
+
+    def _iniciar(self, enviar, inicio, fim, ao_concluir, ao_interromper):
+        self.thread = threading.Thread(
+            target=self._produzir, args=(enviar, inicio, fim, ao_concluir, ao_interromper), daemon=True
+        )
+        self.thread.start()
+
+    def fechar(self):
+        """
+        Encerra a transação e a conexão (também chamado pela resposta ao
+        terminar, mesmo que o corpo não tenha sido enviado)
+        """
+        self.cancelada.set()
+        if self.thread is None:
+            self._fechar_conexao()
+            return
+        # Com a leitura em andamento, interrompe a consulta no servidor; a
+        # thread produtora percebe o cancelamento e fecha a conexão
+        conn = self.conn
+        if conn is not None and self.thread.is_alive():
+            try:
+                conn.cancel()
+            except psycopg2.Error:
+                pass
+
+    def _fechar_conexao(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            finally:
+                self.conn = None
+
+class _Corpo:
+    def __init__(self, blocos, fechar):
+        self.blocos = blocos
+        self.fechar = fechar
+
+    def __iter__(self):
+        return self.blocos
+
+    def close(self):
+        self.blocos.close()
+        self.fechar()
+
+class _CorpoAsync:
+    def __init__(self, blocos, fechar):
+        self.blocos = blocos
+        self.fechar = fechar
+
+    def __aiter__(self):
+        return self.blocos
+
+    def close(self):
+        self.fechar()
+
+def ler_intervalo(cabecalho, total):
+    """
+    Interpreta um cabeçalho Range de um único intervalo de bytes.
+    Retorna (inicio, fim), None se o cabeçalho deve ser ignorado
+    (ausente, inválido ou com vários intervalos) ou False se o
+    intervalo não pode ser atendido. Com o total desconhecido (None) o
+    cabeçalho é ignorado: sem saber onde o arquivo termina, um intervalo
+    além do fim viraria um 206 menor do que o anunciado.
+    """
+    if not cabecalho or not cabecalho.startswith('bytes=') or ',' in cabecalho:
+        return None
+    if total is None:
+        return None
+    inicio, _, fim = cabecalho[len('bytes='):].strip().partition('-')
+    try:
+        if not inicio:
+            # bytes=-N: os últimos N bytes
+            tamanho = int(fim)
+            if tamanho <= 0:
+                return False
+            return max(0, total - tamanho), total - 1
+        inicio = int(inicio)
+        fim = min(int(fim), total - 1) if fim else total - 1
+    except ValueError:
+        return None
+    if inicio >= total or fim < inicio:
+        return False
+    return inicio, fim
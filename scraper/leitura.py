@@ -0,0 +1,86 @@
+import os
+from io import BytesIO
+import numpy as np
+import pandas as pd
+
+try:
+    import python_calamine
+except ImportError:  # calamine é opcional, o openpyxl é usado como fallback
+    python_calamine = None
+
+# Motor de leitura das planilhas: 'auto', 'calamine', 'openpyxl' ou 'pandas'
+MOTOR_EXCEL = os.environ.get('SETOP_MOTOR_EXCEL', 'auto')
+
+ABA_RELATORIO = 'Relatório'
+
+# Colunas lidas da aba: o cabeçalho e as posições das colunas são
+# detectados depois (scraper.normalizacao), então a aba é lida desde a
+# primeira linha
+NUM_COLUNAS = 16
+
+def _linhas_para_dataframe(linhas):
+    largura = min(NUM_COLUNAS, max((len(linha) for linha in linhas), default=0))
+    if all(len(linha) == largura for linha in linhas):
+        grade = np.array(linhas, dtype=object).reshape(len(linhas), largura)
+    else:
+        grade = np.array([list(linha[:largura]) + [None] * (largura - len(linha)) for linha in linhas],
+                         dtype=object).reshape(len(linhas), largura)
+    return pd.DataFrame(grade, columns=range(largura), dtype=object)
+
+def ler_calamine(content):
+    """
+    Lê a aba de relatório com o python-calamine (leitor em Rust, .xls e .xlsx)
+    """
+    workbook = python_calamine.CalamineWorkbook.from_filelike(BytesIO(content))
+    aba = workbook.get_sheet_by_name(ABA_RELATORIO)
+    return _linhas_para_dataframe(aba.to_python(skip_empty_area=False))
+
+def ler_openpyxl(content):
+    """
+    Lê apenas as linhas e colunas necessárias com o openpyxl em modo read-only
+    """
+    if not content.startswith(b'PK'):
+        # .xls antigo não é suportado pelo openpyxl
+        return ler_pandas(content)
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(BytesIO(content), read_only=True, data_only=True)
+    try:
+        aba = workbook[ABA_RELATORIO]
+        linhas = list(aba.iter_rows(max_col=NUM_COLUNAS, values_only=True))
+    finally:
+        workbook.close()
+    return _linhas_para_dataframe(linhas)
+
+def ler_pandas(content):
+    """
+    Leitura original: carrega a aba inteira com pd.read_excel
+    """
+    df = pd.read_excel(BytesIO(content), sheet_name=ABA_RELATORIO, header=None, dtype=object)
+    df = df.iloc[:, :NUM_COLUNAS]
+    df.columns = range(len(df.columns))
+    return df
+
+MOTORES = {
+    'calamine': ler_calamine,
+    'openpyxl': ler_openpyxl,
+    'pandas': ler_pandas,
+}
+
+def motores_disponiveis():
+    return [nome for nome in MOTORES if nome != 'calamine' or python_calamine is not None]
+
+def ler_relatorio(content, motor=None):
+    """
+    Retorna a aba 'Relatório' inteira (até NUM_COLUNAS colunas) como
+    DataFrame de objetos com as colunas numeradas, usando o motor configurado.
+    As células vêm como o motor as lê (texto, número, vazio); a conversão
+    fica em scraper.normalizacao.
+    """
+    motor = motor or MOTOR_EXCEL
+    if motor == 'auto':
+        motor = 'calamine' if python_calamine is not None else 'openpyxl'
+    elif motor == 'calamine' and python_calamine is None:
+        print("python-calamine não está instalado, usando openpyxl")
+        motor = 'openpyxl'
+    return MOTORES[motor](content)
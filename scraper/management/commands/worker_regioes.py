@@ -0,0 +1,36 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import psycopg2
+from django.core.management.base import BaseCommand
+from scraper import distribuido
+from scraper.scraping import MAX_PROCESSOS
+from scraper.downloads import obter_sessao
+
+class Command(BaseCommand):
+    help = "Processa as regiões das rodadas distribuídas do scraper (SETOP_PIPELINE=distribuido)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uma-vez', action='store_true',
+                            help="Processa as regiões livres e encerra")
+
+    def handle(self, *args, **options):
+        obter_sessao()
+        # O pool de leitura fica aberto entre as regiões
+        with ProcessPoolExecutor(max_workers=MAX_PROCESSOS, mp_context=get_context('spawn')) as pool:
+            worker = distribuido.WorkerRegioes(pool)
+            self.stdout.write(f"Worker {worker.worker} aguardando regiões...")
+
+            while True:
+                try:
+                    processou = worker.processar_proxima()
+                except psycopg2.OperationalError as e:
+                    # Ex.: PostgreSQL ainda subindo no compose
+                    self.stdout.write(f"Banco indisponível: {str(e)}")
+                    time.sleep(distribuido.INTERVALO_CONSULTA)
+                    continue
+
+                if not processou:
+                    if options['uma_vez']:
+                        return
+                    time.sleep(distribuido.INTERVALO_CONSULTA)
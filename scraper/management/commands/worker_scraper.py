@@ -0,0 +1,47 @@
+import time
+from functools import partial
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections
+from scraper import execucoes
+# Importados uma única vez: o worker mantém pandas, a sessão HTTP e o
+# cache de planilhas carregados entre as execuções
+from scraper.scraping import iniciar_scraping
+from scraper.downloads import obter_sessao
+
+class Command(BaseCommand):
+    help = "Processa a fila de execuções do scraper"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uma-vez', action='store_true',
+                            help="Processa as execuções pendentes e encerra")
+
+    def handle(self, *args, **options):
+        worker = execucoes.identificador_worker()
+        saida = execucoes.instalar_saida()
+        obter_sessao()
+        self.stdout.write(f"Worker {worker} aguardando execuções...")
+
+        while True:
+            close_old_connections()
+            try:
+                recuperadas = execucoes.recuperar_abandonadas()
+                if recuperadas:
+                    self.stdout.write(f"{recuperadas} execução(ões) abandonada(s) devolvida(s) para a fila")
+                execucao = execucoes.reservar_proxima(worker)
+            except OperationalError as e:
+                # Ex.: migrações ainda não aplicadas na subida do compose
+                self.stdout.write(f"Banco indisponível: {str(e)}")
+                time.sleep(execucoes.INTERVALO_WORKER)
+                continue
+
+            if execucao is None:
+                if options['uma_vez']:
+                    return
+                time.sleep(execucoes.INTERVALO_WORKER)
+                continue
+
+            self.stdout.write(f"Iniciando execução {execucao.id}")
+            # Execuções retomadas continuam do checkpoint da anterior
+            retomar = bool(execucao.parametros.get('retomar'))
+            resultado = execucoes.executar(execucao, partial(iniciar_scraping, retomar=retomar), saida)
+            self.stdout.write(f"Execução {execucao.id} finalizada: {resultado['message']}")
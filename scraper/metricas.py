@@ -0,0 +1,240 @@
+import os
+import glob
+import json
+import time
+import uuid
+import socket
+import pstats
+import cProfile
+import resource
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+# Eventos das execuções em JSON lines ('' desativa o arquivo)
+ARQUIVO_METRICAS = os.environ.get('SETOP_METRICAS', '/app/data/metricas.jsonl')
+
+# Contadores acumulados pelos processos, lidos pelo endpoint /metrics. Cada
+# processo grava o seu arquivo ao lado deste (metricas_estado.<host>-<pid>.json)
+ARQUIVO_ESTADO = os.environ.get('SETOP_METRICAS_ESTADO', '/app/data/metricas_estado.json')
+
+# Perfil do cProfile por execução (opcional)
+PERFIL = os.environ.get('SETOP_PERFIL', '0') == '1'
+DIRETORIO_PERFIS = os.environ.get('SETOP_PERFIS_DIR', '/app/data/perfis')
+
+_lock = threading.Lock()
+_contadores = defaultdict(float)
+_medidas = {}
+_execucao = {'id': None, 'inicio': None, 'totais': defaultdict(float)}
+
+def _chave(nome, rotulos):
+    return (nome, tuple(sorted(rotulos.items())))
+
+def registrar(evento, **campos):
+    """
+    Grava um evento como uma linha JSON no arquivo de métricas
+    """
+    if not ARQUIVO_METRICAS:
+        return
+    linha = {
+        'momento': datetime.now().isoformat(timespec='milliseconds'),
+        'execucao': _execucao['id'],
+        'evento': evento,
+        **campos
+    }
+    with _lock:
+        try:
+            with open(ARQUIVO_METRICAS, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(linha, ensure_ascii=False, default=str) + '\n')
+        except OSError as e:
+            print(f"Erro ao gravar métricas: {str(e)}")
+
+def contar(nome, valor=1, **rotulos):
+    """
+    Soma valor ao contador (acumulado no processo e na execução atual)
+    """
+    chave = _chave(nome, rotulos)
+    with _lock:
+        _contadores[chave] += valor
+        _execucao['totais'][chave] += valor
+
+def medida(nome, valor, **rotulos):
+    """
+    Define o valor atual de uma medida (ex.: pico de memória)
+    """
+    with _lock:
+        _medidas[_chave(nome, rotulos)] = valor
+
+@contextmanager
+def medir(etapa, **campos):
+    """
+    Mede a duração de uma etapa e registra o evento ao final
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracao = time.perf_counter() - inicio
+        contar('setop_etapa_segundos_total', duracao, etapa=etapa)
+        contar('setop_etapa_total', etapa=etapa)
+        registrar('etapa', etapa=etapa, duracao_s=round(duracao, 4), **campos)
+
+def rss_pico_mb():
+    """
+    Pico de memória (RSS) deste processo e dos processos filhos já
+    encerrados (ex.: o pool de leitura das planilhas)
+    """
+    # ru_maxrss é em KB no Linux
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    )
+
+def iniciar_execucao():
+    with _lock:
+        _execucao['id'] = uuid.uuid4().hex[:12]
+        _execucao['inicio'] = time.perf_counter()
+        _execucao['totais'] = defaultdict(float)
+    registrar('inicio')
+
+def resumo_execucao():
+    """
+    Totais da execução atual agrupados por métrica
+    """
+    resumo = defaultdict(dict)
+    with _lock:
+        totais = dict(_execucao['totais'])
+    for (nome, rotulos), valor in sorted(totais.items()):
+        rotulo = ','.join(f"{chave}={valor_rotulo}" for chave, valor_rotulo in rotulos) or 'total'
+        resumo[nome][rotulo] = round(valor, 4)
+    return dict(resumo)
+
+def finalizar_execucao():
+    """
+    Registra o resumo da execução, imprime o tempo por etapa e salva o
+    estado dos contadores
+    """
+    if _execucao['id'] is None:
+        return
+    duracao = time.perf_counter() - _execucao['inicio']
+    rss_principal, rss_filhos = rss_pico_mb()
+    medida('setop_rss_pico_mb', round(rss_principal, 1), processo='principal')
+    medida('setop_rss_pico_mb', round(rss_filhos, 1), processo='filhos')
+    medida('setop_ultima_execucao_segundos', round(duracao, 3))
+    medida('setop_ultima_execucao_timestamp', time.time())
+
+    resumo = resumo_execucao()
+    registrar('resumo', duracao_s=round(duracao, 3), rss_pico_mb=round(rss_principal, 1),
+              rss_pico_filhos_mb=round(rss_filhos, 1), totais=resumo)
+
+    print("\nTempo por etapa:")
+    for rotulo, segundos in resumo.get('setop_etapa_segundos_total', {}).items():
+        print(f"  {rotulo.removeprefix('etapa='):<20} {segundos:>9.2f}s")
+    print(f"Pico de memória: {rss_principal:.0f} MB (processos de leitura: {rss_filhos:.0f} MB)")
+    salvar_estado()
+    _execucao['id'] = None
+
+def _arquivo_processo():
+    raiz, extensao = os.path.splitext(ARQUIVO_ESTADO)
+    return f"{raiz}.{socket.gethostname()}-{os.getpid()}{extensao}"
+
+def salvar_estado():
+    """
+    Grava os contadores do processo para o endpoint /metrics, em um arquivo
+    só dele: os workers (worker e réplicas do worker_regioes) não
+    sobrescrevem os contadores uns dos outros
+    """
+    if not ARQUIVO_ESTADO:
+        return
+    arquivo = _arquivo_processo()
+    with _lock:
+        estado = {
+            'contadores': [[nome, dict(rotulos), valor] for (nome, rotulos), valor in _contadores.items()],
+            'medidas': [[nome, dict(rotulos), valor] for (nome, rotulos), valor in _medidas.items()],
+        }
+    try:
+        temporario = f"{arquivo}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(estado, f)
+        os.replace(temporario, arquivo)
+    except OSError as e:
+        print(f"Erro ao salvar estado das métricas: {str(e)}")
+
+def ler_estado():
+    """
+    Junta os estados gravados pelos processos: os contadores são somados
+    (os de processos encerrados continuam no total) e, em cada medida,
+    vale o arquivo gravado por último
+    """
+    if not ARQUIVO_ESTADO:
+        return {'contadores': [], 'medidas': []}
+    raiz, extensao = os.path.splitext(ARQUIVO_ESTADO)
+    # O arquivo único das versões anteriores também entra na soma
+    arquivos = []
+    for caminho in [ARQUIVO_ESTADO] + glob.glob(f"{glob.escape(raiz)}.*{extensao}"):
+        try:
+            arquivos.append((os.path.getmtime(caminho), caminho))
+        except OSError:
+            continue
+
+    contadores = defaultdict(float)
+    medidas = {}
+    for _, caminho in sorted(arquivos):
+        try:
+            with open(caminho, encoding='utf-8') as f:
+                estado = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for nome, rotulos, valor in estado.get('contadores', []):
+            contadores[_chave(nome, rotulos)] += valor
+        for nome, rotulos, valor in estado.get('medidas', []):
+            medidas[_chave(nome, rotulos)] = valor
+    return {
+        'contadores': [[nome, dict(rotulos), valor] for (nome, rotulos), valor in contadores.items()],
+        'medidas': [[nome, dict(rotulos), valor] for (nome, rotulos), valor in medidas.items()],
+    }
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def formato_prometheus(estado):
+    """
+    Converte o estado salvo para o formato texto do Prometheus
+    """
+    series = defaultdict(list)
+    tipos = {}
+    for grupo, tipo in (('contadores', 'counter'), ('medidas', 'gauge')):
+        for nome, rotulos, valor in estado.get(grupo, []):
+            tipos[nome] = tipo
+            series[nome].append((rotulos, valor))
+
+    linhas = []
+    for nome in sorted(series):
+        linhas.append(f"# TYPE {nome} {tipos[nome]}")
+        for rotulos, valor in sorted(series[nome], key=lambda serie: sorted(serie[0].items())):
+            texto = ','.join(f'{chave}="{_escapar(valor_rotulo)}"' for chave, valor_rotulo in sorted(rotulos.items()))
+            linhas.append(f"{nome}{{{texto}}} {valor}" if texto else f"{nome} {valor}")
+    return '\n'.join(linhas) + '\n'
+
+@contextmanager
+def perfil(nome='execucao'):
+    """
+    Com SETOP_PERFIL=1, roda o bloco sob o cProfile e salva o .prof da
+    execução em SETOP_PERFIS_DIR (abrir com snakeviz ou pstats). O cProfile
+    só vê a thread atual; downloads e leitura aparecem como espera.
+    """
+    if not PERFIL:
+        yield
+        return
+    perfilador = cProfile.Profile()
+    perfilador.enable()
+    try:
+        yield
+    finally:
+        perfilador.disable()
+        os.makedirs(DIRETORIO_PERFIS, exist_ok=True)
+        caminho = os.path.join(DIRETORIO_PERFIS, f"{nome}_{datetime.now().strftime('%Y%m%d%H%M%S')}.prof")
+        perfilador.dump_stats(caminho)
+        print(f"Perfil salvo em: {caminho}")
+        pstats.Stats(perfilador).sort_stats('cumulative').print_stats(15)
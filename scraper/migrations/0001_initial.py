@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Execucao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('executando', 'Executando'), ('sucesso', 'Sucesso'), ('erro', 'Erro')], db_index=True, default='pendente', max_length=20)),
+                ('chave_ativa', models.CharField(blank=True, default='scraper', max_length=50, null=True, unique=True)),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('mensagem', models.TextField(blank=True)),
+                ('tempo_execucao', models.CharField(blank=True, max_length=20)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('iniciado_em', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_em', models.DateTimeField(blank=True, null=True)),
+                ('finalizado_em', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='EventoExecucao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mensagem', models.TextField()),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('execucao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='eventos', to='scraper.execucao')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
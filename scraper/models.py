@@ -0,0 +1,58 @@
+from django.db import models
+
+class Execucao(models.Model):
+    """
+    Execução do scraper enfileirada pela interface web e processada
+    pelo worker (python manage.py worker_scraper)
+    """
+    PENDENTE = 'pendente'
+    EXECUTANDO = 'executando'
+    SUCESSO = 'sucesso'
+    ERRO = 'erro'
+    STATUS = [
+        (PENDENTE, 'Pendente'),
+        (EXECUTANDO, 'Executando'),
+        (SUCESSO, 'Sucesso'),
+        (ERRO, 'Erro'),
+    ]
+    ATIVOS = [PENDENTE, EXECUTANDO]
+
+    status = models.CharField(max_length=20, choices=STATUS, default=PENDENTE, db_index=True)
+    # Preenchida só enquanto a execução está ativa: o índice único
+    # impede duas execuções simultâneas (NULL não conflita)
+    chave_ativa = models.CharField(max_length=50, null=True, blank=True, unique=True, default='scraper')
+    parametros = models.JSONField(default=dict, blank=True)
+    mensagem = models.TextField(blank=True)
+    tempo_execucao = models.CharField(max_length=20, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    heartbeat_em = models.DateTimeField(null=True, blank=True)
+    finalizado_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-id']
+
+    def como_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'parametros': self.parametros,
+            'mensagem': self.mensagem,
+            'tempo_execucao': self.tempo_execucao,
+            'worker': self.worker,
+            'criado_em': self.criado_em.isoformat() if self.criado_em else None,
+            'iniciado_em': self.iniciado_em.isoformat() if self.iniciado_em else None,
+            'finalizado_em': self.finalizado_em.isoformat() if self.finalizado_em else None,
+        }
+
+class EventoExecucao(models.Model):
+    """
+    Linha de log de uma execução, lida pelo stream de progresso
+    """
+    execucao = models.ForeignKey(Execucao, on_delete=models.CASCADE, related_name='eventos')
+    mensagem = models.TextField()
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
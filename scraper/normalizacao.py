@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+
+# Campos extraídos da aba de relatório e os prefixos aceitos no texto do
+# cabeçalho (em maiúsculas), em ordem de preferência. Código e unidade
+# também aparecem nas linhas de dados, então o cabeçalho só é aceito
+# quando todos os campos estão na mesma linha.
+CAMPOS = {
+    'CÓDIGO': ('CÓDIGO', 'CODIGO', 'CÓD', 'COD'),
+    'DESCRIÇÃO DO SERVIÇO': ('DESCRIÇÃO', 'DESCRICAO', 'DISCRIMINAÇÃO', 'DISCRIMINACAO'),
+    'UNIDADE': ('UNIDADE', 'UNID', 'UND', 'UN'),
+    'CUSTO UNITÁRIO': ('CUSTO UNITÁRIO', 'CUSTO UNITARIO', 'PREÇO UNITÁRIO', 'PRECO UNITARIO',
+                       'VALOR UNITÁRIO', 'VALOR UNITARIO', 'CUSTO', 'PREÇO', 'PRECO'),
+}
+
+# Linhas do início da aba onde o cabeçalho é procurado
+LINHAS_CABECALHO = 60
+
+# Linhas descartadas sem ir para a quarentena
+VAZIA = 'vazia'
+CABECALHO = 'cabecalho'
+TITULO = 'titulo'
+
+# Motivos de quarentena: parecem linhas de preço, mas não podem ser carregadas
+SEM_CODIGO = 'sem_codigo'
+SEM_CUSTO = 'sem_custo'
+CUSTO_INVALIDO = 'custo_invalido'
+
+COLUNAS_QUARENTENA = ['linha', 'motivo', 'CÓDIGO', 'DESCRIÇÃO DO SERVIÇO', 'UNIDADE', 'CUSTO UNITÁRIO']
+
+# isinstance como ufunc: o tipo de cada célula sem laço em Python e sem
+# converter a coluna inteira para um array de texto de largura fixa
+_e_texto = np.frompyfunc(isinstance, 2, 1)
+
+def _maiusculas(valores):
+    return np.strings.upper(np.strings.strip(np.asarray(valores, dtype=object).astype(str)))
+
+def detectar_layout(grade):
+    """
+    Procura o cabeçalho nas primeiras LINHAS_CABECALHO linhas da grade
+    (array de objetos) e retorna (linha do cabeçalho, {campo: coluna}).
+    Levanta ValueError se nenhuma linha tiver todos os campos.
+    """
+    topo = _maiusculas(grade[:LINHAS_CABECALHO])
+    encontrados = {
+        campo: np.logical_or.reduce([np.strings.startswith(topo, prefixo) for prefixo in prefixos])
+        for campo, prefixos in CAMPOS.items()
+    }
+    completas = np.logical_and.reduce([matriz.any(axis=1) for matriz in encontrados.values()])
+    if not completas.any():
+        faltando = [campo for campo, matriz in encontrados.items() if not matriz.any()]
+        raise ValueError(f"cabeçalho não encontrado nas primeiras {LINHAS_CABECALHO} linhas "
+                         f"(campos ausentes: {', '.join(faltando) or 'nenhum na mesma linha'})")
+
+    linha = int(np.argmax(completas))
+    colunas = {}
+    for campo, prefixos in CAMPOS.items():
+        # Primeiro prefixo que aparece na linha (ex.: 'CUSTO UNITÁRIO' antes de 'CUSTO')
+        for prefixo in prefixos:
+            posicoes = np.flatnonzero(np.strings.startswith(topo[linha], prefixo))
+            if len(posicoes):
+                colunas[campo] = int(posicoes[0])
+                break
+    if len(set(colunas.values())) < len(colunas):
+        raise ValueError(f"cabeçalho ambíguo na linha {linha + 1}: {colunas}")
+    return linha, colunas
+
+def _separar_tipos(valores):
+    """
+    Separa uma coluna de células em texto (sem espaços nas pontas, None
+    para números e vazios) e números (NaN para textos e vazios)
+    """
+    valores = np.asarray(valores, dtype=object)
+    e_texto = _e_texto(valores, str).astype(bool)
+    texto = np.full(len(valores), None, dtype=object)
+    if e_texto.any():
+        texto[e_texto] = pd.Series(valores[e_texto], dtype='str').str.strip().to_numpy(dtype=object)
+        texto[e_texto & (texto == '')] = None
+    numeros = pd.to_numeric(np.where(e_texto, None, valores), errors='coerce').astype('float64')
+    return texto, numeros
+
+def normalizar_custos(valores):
+    """
+    Converte os custos para float em uma passada: números como estão e
+    textos no formato brasileiro ('1.234,56', 'R$ 0,50', '1.234').
+    Retorna (custos, invalidos), onde invalidos marca os textos que não
+    são números.
+    """
+    texto, custos = _separar_tipos(valores)
+    e_texto = pd.notna(texto)
+    if e_texto.any():
+        limpo = texto[e_texto].astype(str)
+        for simbolo in ('R$', ' ', '\xa0'):
+            limpo = np.strings.replace(limpo, simbolo, '')
+        # Com vírgula: ponto é separador de milhar e vírgula, de decimais.
+        # Sem vírgula, só pontos de milhar ('1.234' ou '1.234.567') são removidos.
+        virgula = np.strings.find(limpo, ',') >= 0
+        milhar = pd.Series(limpo, dtype=object).str.fullmatch(r'\d{1,3}(\.\d{3})+').to_numpy(dtype=bool)
+        sem_pontos = np.strings.replace(limpo, '.', '')
+        limpo = np.where(virgula, np.strings.replace(sem_pontos, ',', '.'), np.where(milhar, sem_pontos, limpo))
+        custos[e_texto] = pd.to_numeric(limpo, errors='coerce')
+    invalidos = e_texto & np.isnan(custos)
+    return custos, invalidos
+
+def normalizar_codigos(valores):
+    """
+    Códigos como texto em maiúsculas; números inteiros gravados como
+    float na planilha (ex.: 8662.0) voltam a '8662'. None para vazios.
+    """
+    texto, numeros = _separar_tipos(valores)
+    e_texto = pd.notna(texto)
+    if e_texto.any():
+        texto[e_texto] = pd.Series(texto[e_texto], dtype='str').str.upper().to_numpy(dtype=object)
+    numericos = ~np.isnan(numeros)
+    if numericos.any():
+        inteiros = numeros[numericos] == np.floor(numeros[numericos])
+        texto[numericos] = np.where(inteiros, numeros[numericos].astype('int64').astype(str),
+                                    numeros[numericos].astype(str)).astype(object)
+    return texto
+
+def normalizar_texto(valores):
+    """
+    Descrições e unidades: texto sem espaços nas pontas, números como
+    texto e None para vazios
+    """
+    texto, numeros = _separar_tipos(valores)
+    numericos = ~np.isnan(numeros)
+    if numericos.any():
+        texto[numericos] = numeros[numericos].astype(str).astype(object)
+    return texto
+
+def extrair_precos(grade):
+    """
+    Detecta o layout da grade lida da aba de relatório e normaliza as
+    linhas de dados. Retorna (precos, quarentena, contagem):
+    - precos: DataFrame com CÓDIGO, DESCRIÇÃO DO SERVIÇO, UNIDADE e CUSTO UNITÁRIO
+    - quarentena: linhas que parecem preços mas foram rejeitadas, com o
+      número da linha na planilha, o motivo e as células originais
+    - contagem: linhas por destino (carregadas, descartadas e cada motivo)
+    """
+    grade = np.asarray(grade, dtype=object)
+    linha_cabecalho, colunas = detectar_layout(grade)
+    dados = grade[linha_cabecalho + 1:]
+    numero_linha = np.arange(linha_cabecalho + 2, len(grade) + 1)
+
+    codigos = normalizar_codigos(dados[:, colunas['CÓDIGO']])
+    descricoes = normalizar_texto(dados[:, colunas['DESCRIÇÃO DO SERVIÇO']])
+    unidades = normalizar_texto(dados[:, colunas['UNIDADE']])
+    custos_brutos = dados[:, colunas['CUSTO UNITÁRIO']]
+    custos, invalidos = normalizar_custos(custos_brutos)
+
+    sem_codigo = pd.isna(codigos)
+    sem_unidade = pd.isna(unidades)
+    sem_custo = np.isnan(custos) & ~invalidos
+    vazia = sem_codigo & pd.isna(descricoes) & sem_unidade & sem_custo
+    # Cabeçalho repetido (ex.: quebra de página) e títulos de grupo ou
+    # rodapés (sem unidade nem custo) não são preços
+    cabecalho = codigos == str(_maiusculas([grade[linha_cabecalho, colunas['CÓDIGO']]])[0])
+    titulo = ~vazia & sem_unidade & sem_custo
+
+    # Cada linha fica com o primeiro motivo que se aplica
+    motivos = np.select(
+        [vazia, cabecalho, titulo, sem_codigo, invalidos, sem_custo],
+        [VAZIA, CABECALHO, TITULO, SEM_CODIGO, CUSTO_INVALIDO, SEM_CUSTO],
+        default=''
+    )
+    valida = motivos == ''
+
+    precos = pd.DataFrame({
+        'CÓDIGO': codigos[valida],
+        'DESCRIÇÃO DO SERVIÇO': np.where(pd.isna(descricoes[valida]), '', descricoes[valida]).astype(object),
+        'UNIDADE': pd.Categorical(unidades[valida]),
+        'CUSTO UNITÁRIO': custos[valida],
+    })
+
+    rejeitada = ~valida & np.isin(motivos, [SEM_CODIGO, SEM_CUSTO, CUSTO_INVALIDO])
+    quarentena = pd.DataFrame({
+        'linha': numero_linha[rejeitada],
+        'motivo': motivos[rejeitada],
+        'CÓDIGO': codigos[rejeitada],
+        'DESCRIÇÃO DO SERVIÇO': descricoes[rejeitada],
+        'UNIDADE': unidades[rejeitada],
+        'CUSTO UNITÁRIO': custos_brutos[rejeitada],
+    }, columns=COLUNAS_QUARENTENA)
+
+    nomes, quantidades = np.unique(motivos[~valida], return_counts=True)
+    contagem = {'carregadas': int(valida.sum()), **dict(zip(nomes.tolist(), quantidades.tolist()))}
+    return precos, quarentena, contagem
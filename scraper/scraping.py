@@ -1,220 +1,410 @@
 import os
 import time
+import asyncio
+import numpy as np
 import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import get_context
+from scraper.leitura import ler_relatorio
+from scraper.normalizacao import extrair_precos, COLUNAS_QUARENTENA
+from scraper.downloads import download_planilha, baixar_planilhas
+from scraper.descoberta import descobrir_planilhas
+from scraper.cache import obter_cache
+from scraper.exportacao import criar_exportador
+from scraper.checkpoint import abrir_manifesto
+from scraper import metricas
 
-def fechar_navegador_com_timeout(driver, timeout=10):
-    """
-    Fecha o navegador com um timeout
-    """
-    try:
-        print("Tentando fechar navegador normalmente...")
-        driver.quit()
-        print("Navegador fechado com sucesso")
-        return True
-    except Exception as e:
-        print(f"Erro ao fechar navegador: {str(e)}")
-        try:
-            print("Tentando forçar fechamento...")
-            driver.quit()
-        except:
-            print("Não foi possível fechar o navegador")
-        return False
+# Motor do scraper: 'sync' (threads + processos) ou 'async' (asyncio + aiohttp)
+MOTOR_SCRAPER = os.environ.get('SETOP_MOTOR', 'sync')
 
-def download_planilha(url, max_retries=3, backoff_factor=0.5):
-    """
-    Tenta baixar a planilha com sistema de retry
-    """
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=max_retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=[500, 502, 503, 504, 429]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    
-    try:
-        response = session.get(url, timeout=30)  # Aumentado timeout para 30 segundos
-        if response.status_code == 200:
-            return response.content
-        else:
-            print(f"Erro ao baixar planilha. Status code: {response.status_code}")
-            return None
-    except Exception as e:
-        print(f"Erro ao baixar planilha: {str(e)}")
-        return None
+# Pipeline: 'csv' (CSV consolidado e depois importação), 'stream' (direto para o
+# banco) ou 'distribuido' (regiões divididas entre workers, ver scraper/distribuido.py)
+MODO_PIPELINE = os.environ.get('SETOP_PIPELINE', 'csv')
+EXPORTAR_CSV = os.environ.get('SETOP_EXPORTAR_CSV', '1') != '0'
+
+# Processos usados para ler as planilhas (padrão: um por núcleo)
+MAX_PROCESSOS = int(os.environ.get('SETOP_MAX_PROCESSOS', '0')) or os.cpu_count() or 1
+
+# Diretório do CSV consolidado e das exportações
+DIRETORIO_DADOS = os.environ.get('SETOP_DADOS_DIR', '/app/data')
 
-def processar_planilha(url_planilha, regiao):
+# Linhas rejeitadas na normalização, gravadas junto com o CSV consolidado
+ARQUIVO_QUARENTENA = 'planilhas_quarentena.csv'
+
+def processar_planilha(url_planilha, regiao, content=None, ano="N/A"):
     try:
-        # Tenta baixar a planilha com retry
-        content = download_planilha(url_planilha)
+        # Tenta baixar a planilha com retry, se ainda não foi baixada
+        if content is None:
+            content = download_planilha(url_planilha)
         if content is None:
             return None
             
-        # Lê o conteúdo da planilha usando BytesIO
-        df = pd.read_excel(BytesIO(content), sheet_name='Relatório')
-        
-        # Define a linha 25 como cabeçalho
-        header_row = 25
+        # Lê a aba 'Relatório'; o cabeçalho e as colunas são localizados
+        # pelo texto, então mudanças de posição no modelo não quebram a leitura
+        inicio = time.perf_counter()
+        grade = ler_relatorio(content)
+        try:
+            df, quarentena, contagem = extrair_precos(grade.to_numpy())
+        except ValueError as e:
+            print(f"Erro: layout não reconhecido na planilha {url_planilha}: {str(e)}")
+            return None
         
-        # Pega os dados após o cabeçalho
-        df = df.iloc[header_row+1:].reset_index(drop=True)
+        # Região e ano têm um único valor por planilha: viram categorias
+        # com um código de 1 byte por linha em vez da string repetida
+        codigos = np.zeros(len(df), dtype='int8')
+        df['regiao'] = pd.Categorical.from_codes(codigos, [regiao])
+        df['ANO'] = pd.Categorical.from_codes(codigos, [ano])
         
-        # Verifica o número de colunas e ajusta conforme necessário
-        num_columns = len(df.columns)
-        if num_columns >= 8:  # Garante que temos pelo menos 8 colunas
-            # Se tivermos mais que 8 colunas, pegamos apenas as primeiras 8
-            df = df.iloc[:, :8]
-            
-            # Renomeia as colunas manualmente
-            new_columns = ['CÓDIGO', None, 'DESCRIÇÃO DO SERVIÇO', None, None, None, 'UNIDADE', 'CUSTO UNITÁRIO']
-            df.columns = new_columns
-            
-            # Remove colunas None/nan
-            df = df.drop(columns=[col for col in df.columns if col is None])
-            
-            # Adiciona a coluna região
-            df['regiao'] = regiao
+        # Roda em outro processo: o tempo, as linhas rejeitadas e a contagem
+        # por motivo voltam junto com o DataFrame
+        df.attrs['tempo_leitura'] = time.perf_counter() - inicio
+        df.attrs['quarentena'] = quarentena
+        df.attrs['contagem_linhas'] = contagem
+        return df
             
-            # Remove linhas totalmente vazias
-            df = df.dropna(how='all')
-            
-            # Garante que os tipos de dados estejam corretos
-            df['CÓDIGO'] = df['CÓDIGO'].astype(str)
-            df['DESCRIÇÃO DO SERVIÇO'] = df['DESCRIÇÃO DO SERVIÇO'].astype(str)
-            df['UNIDADE'] = df['UNIDADE'].astype(str)
-            df['CUSTO UNITÁRIO'] = pd.to_numeric(df['CUSTO UNITÁRIO'], errors='coerce')
-            
-            return df
+    except Exception as e:
+        print(f"Erro ao processar planilha {url_planilha}: {str(e)}")
+        return None
+
+def registrar_planilha(tarefa, df_processado):
+    """
+    Métricas de uma planilha: origem (processada, cache ou erro), bytes,
+    linhas, linhas descartadas por motivo e tempo de leitura
+    """
+    origem = tarefa.get('origem', 'processada') if df_processado is not None else 'erro'
+    linhas = len(df_processado) if df_processado is not None else 0
+    tempo_leitura = df_processado.attrs.get('tempo_leitura') if origem == 'processada' else None
+    descartadas = {}
+    if df_processado is not None:
+        descartadas = {motivo: quantidade for motivo, quantidade
+                       in df_processado.attrs.get('contagem_linhas', {}).items() if motivo != 'carregadas'}
+    metricas.contar('setop_planilhas_total', origem=origem)
+    metricas.contar('setop_linhas_lidas_total', linhas)
+    for motivo, quantidade in descartadas.items():
+        metricas.contar('setop_linhas_descartadas_total', quantidade, motivo=motivo)
+    if tempo_leitura is not None:
+        metricas.contar('setop_etapa_segundos_total', tempo_leitura, etapa='leitura')
+    metricas.registrar(
+        'planilha', indice=tarefa['indice'], regiao=tarefa['regiao'], ano=tarefa['ano'],
+        url=tarefa['url'], origem=origem, bytes=tarefa.get('bytes'), linhas=linhas,
+        descartadas=descartadas,
+        tempo_leitura_s=round(tempo_leitura, 4) if tempo_leitura is not None else None
+    )
+
+class SaidasScraper:
+    """
+    Destinos das planilhas processadas: o banco (modo streaming), o CSV
+    consolidado, a exportação colunar e o CSV de quarentena com as linhas
+    rejeitadas. Compartilhado pelos motores síncrono e assíncrono.
+    """
+    def __init__(self, csv_path, carregador=None, exportar_csv=True, manifesto=None, exportar_colunar=True):
+        self.csv_path = csv_path
+        self.carregador = carregador
+        self.manifesto = manifesto
+        self.resultados = {}
+        self.entregues = 0
+        self.erros = 0
+        self.arquivo_csv = None
+        if carregador and exportar_csv:
+            self.arquivo_csv = open(csv_path, 'w', encoding='utf-8-sig', newline='')
+        self.exportador = criar_exportador(os.path.dirname(csv_path)) if exportar_colunar else None
+
+        # A quarentena é refeita a cada execução (as planilhas do cache e
+        # do checkpoint trazem as linhas rejeitadas junto com o DataFrame)
+        self.caminho_quarentena = os.path.join(os.path.dirname(csv_path), ARQUIVO_QUARENTENA)
+        self.arquivo_quarentena = None
+        self.quarentena = {}
+        if os.path.exists(self.caminho_quarentena):
+            os.remove(self.caminho_quarentena)
+
+    def _registrar_quarentena(self, tarefa, quarentena):
+        if quarentena is None or quarentena.empty:
+            return
+        if self.arquivo_quarentena is None:
+            self.arquivo_quarentena = open(self.caminho_quarentena, 'w', encoding='utf-8-sig', newline='')
+            cabecalho = True
+        else:
+            cabecalho = False
+        quarentena = quarentena.assign(regiao=tarefa['regiao'], ANO=tarefa['ano'], url=tarefa['url'])
+        quarentena[['regiao', 'ANO', 'url'] + COLUNAS_QUARENTENA].to_csv(
+            self.arquivo_quarentena, index=False, header=cabecalho
+        )
+        for motivo, quantidade in quarentena['motivo'].value_counts().items():
+            self.quarentena[motivo] = self.quarentena.get(motivo, 0) + int(quantidade)
+
+    def entregar(self, tarefa, df_processado):
+        # Checkpoint da planilha antes das saídas: se o processo cair,
+        # uma execução retomada não precisa baixá-la de novo
+        if self.manifesto and tarefa.get('origem') != 'checkpoint':
+            self.manifesto.registrar(tarefa, df_processado)
+        if df_processado is None:
+            self.erros += 1
+            registrar_planilha(tarefa, None)
+            return
+        registrar_planilha(tarefa, df_processado)
+        # Já gravada no cache e no checkpoint; não precisa seguir com o DataFrame
+        self._registrar_quarentena(tarefa, df_processado.attrs.pop('quarentena', None))
+        self.entregues += 1
+        if self.exportador:
+            with metricas.medir('exportacao_colunar', planilha=tarefa['indice']):
+                self.exportador.adicionar(df_processado)
+        if self.carregador:
+            # Modo streaming: nada fica acumulado em memória
+            self.carregador.adicionar(df_processado, tarefa['indice'])
+            if self.arquivo_csv:
+                df_processado.to_csv(self.arquivo_csv, index=False, header=self.entregues == 1)
         else:
-            print(f"Erro: número insuficiente de colunas ({num_columns}) na planilha {url_planilha}")
+            self.resultados[tarefa['indice']] = df_processado
+
+    def finalizar(self):
+        """
+        Conclui as saídas e retorna o caminho do CSV (ou None se não houver)
+        """
+        if self.exportador:
+            self.exportador.finalizar()
+            self.exportador = None
+        
+        if self.arquivo_quarentena:
+            self.arquivo_quarentena.close()
+            self.arquivo_quarentena = None
+            motivos = ', '.join(f"{motivo}: {quantidade}" for motivo, quantidade in sorted(self.quarentena.items()))
+            print(f"\n{sum(self.quarentena.values())} linhas rejeitadas ({motivos}) "
+                  f"salvas em: {self.caminho_quarentena}")
+        
+        if self.carregador:
+            print(f"\n{self.entregues} planilhas enviadas para o banco")
+            if self.arquivo_csv and self.entregues:
+                print(f"Dados salvos em: {self.csv_path}")
+                return self.csv_path
             return None
+        
+        if self.resultados:
+            print("\nConsolidando dados...")
+            with metricas.medir('consolidacao_csv'):
+                # Grava planilha a planilha, na ordem original, sem montar um
+                # DataFrame único (o concat copiaria todos os dados e converteria
+                # as categorias de volta para texto em cada linha)
+                print("Salvando CSV...")
+                with open(self.csv_path, 'w', encoding='utf-8-sig', newline='') as arquivo:
+                    for posicao, indice in enumerate(sorted(self.resultados)):
+                        self.resultados[indice].to_csv(arquivo, index=False, header=posicao == 0)
+            print(f"Dados salvos em: {self.csv_path}")
             
-    except Exception as e:
-        print(f"Erro ao processar planilha {url_planilha}: {str(e)}")
+            print("Retornando caminho do CSV...")
+            return self.csv_path
         return None
 
-def scraper_seinfra():
+    def fechar(self):
+        if self.exportador:
+            self.exportador.cancelar()
+        if self.arquivo_csv:
+            self.arquivo_csv.close()
+        if self.arquivo_quarentena:
+            self.arquivo_quarentena.close()
+
+def entregar_concluidas(saidas, tarefas):
     """
-    Scraper principal que coleta dados de preços do SETOP para todas as regiões.
+    Entrega as planilhas que já estão concluídas no checkpoint e retorna
+    as que ainda precisam ser baixadas e processadas
     """
-    print("Iniciando scraper_seinfra...")
-    dados_processados = []
-    driver = None
-    
+    if not saidas.manifesto:
+        return tarefas
+    pendentes = []
+    for tarefa in tarefas:
+        df_processado = saidas.manifesto.ler_concluida(tarefa['url'])
+        if df_processado is None:
+            pendentes.append(tarefa)
+            continue
+        tarefa['origem'] = 'checkpoint'
+        saidas.entregar(tarefa, df_processado)
+    if len(pendentes) < len(tarefas):
+        print(f"{len(tarefas) - len(pendentes)} planilhas reaproveitadas do checkpoint")
+    return pendentes
+
+def processar_tarefas(tarefas, saidas, cache, pool):
+    """
+    Baixa as planilhas em paralelo e processa no pool conforme chegam,
+    entregando cada uma às saídas (também usado pelos workers do modo
+    distribuído, uma região por vez). As processadas são entregues
+    enquanto os downloads continuam e no máximo 2 * MAX_PROCESSOS ficam no
+    pool por vez: a memória não cresce com o número de planilhas.
+    """
+    futuros = {}
+    limite = 2 * MAX_PROCESSOS
+    planilha_atual = 0
+
+    def entregar_processadas(esperar):
+        concluidos, _ = wait(futuros, timeout=None if esperar else 0, return_when=FIRST_COMPLETED)
+        for futuro in concluidos:
+            tarefa = futuros.pop(futuro)
+            try:
+                df_processado = futuro.result()
+            except Exception as e:
+                # Ex.: processo do pool encerrado de forma inesperada
+                print(f"Erro ao processar planilha {tarefa['url']}: {str(e)}")
+                saidas.entregar(tarefa, None)
+                continue
+            if cache and df_processado is not None:
+                cache.salvar_processado(tarefa['url'], df_processado)
+            saidas.entregar(tarefa, df_processado)
+
+    for tarefa, content in baixar_planilhas(tarefas, cache=cache):
+        planilha_atual += 1
+        if content is None:
+            print(f"Erro ao baixar planilha {tarefa['url']}")
+            saidas.entregar(tarefa, None)
+            continue
+        tarefa['bytes'] = len(content)
+        
+        # Planilha inalterada desde a última execução: reaproveita o processamento
+        df_processado = cache.ler_processado(tarefa['url']) if cache else None
+        if df_processado is not None:
+            print(f"Planilha {planilha_atual}/{len(tarefas)} inalterada: {tarefa['regiao']}")
+            tarefa['origem'] = 'cache'
+            saidas.entregar(tarefa, df_processado)
+            continue
+        
+        print(f"Processando planilha {planilha_atual}/{len(tarefas)}: {tarefa['regiao']}")
+        futuro = pool.submit(processar_planilha, tarefa['url'], tarefa['regiao'], content, tarefa['ano'])
+        futuros[futuro] = tarefa
+        del content
+        # Com o pool cheio, espera uma planilha sair antes de receber outro download
+        entregar_processadas(esperar=len(futuros) >= limite)
+
+    while futuros:
+        entregar_processadas(esperar=True)
+
+def preparar_diretorio_saida():
     # Define o caminho absoluto para salvar o CSV na pasta data
-    csv_path = os.path.join('/app/data', 'planilhas_consolidadas.csv')
+    csv_path = os.path.join(DIRETORIO_DADOS, 'planilhas_consolidadas.csv')
     
     # Cria o diretório se não existir
-    os.makedirs('/app/data', exist_ok=True)
+    os.makedirs(DIRETORIO_DADOS, exist_ok=True)
     
     print(f"Tentando salvar em: {os.path.abspath(csv_path)}")
     print(f"Diretório atual é: {os.getcwd()}")
+    return csv_path
+
+def scraper_seinfra(carregador=None, exportar_csv=True, manifesto=None):
+    """
+    Scraper principal que coleta dados de preços do SETOP para todas as regiões.
+    Com um carregador (modo streaming), cada planilha processada é enviada
+    direto para o banco e o CSV consolidado vira uma saída opcional.
+    Com um manifesto, as planilhas já concluídas em uma execução
+    interrompida são reaproveitadas sem novo download.
+    """
+    print("Iniciando scraper_seinfra...")
+    saidas = None
+    csv_path = preparar_diretorio_saida()
+    cache = obter_cache()
     
     try:
-        firefox_options = webdriver.FirefoxOptions()
-        firefox_options.add_argument('--headless')
-        firefox_options.add_argument('--ignore-certificate-errors')
-        firefox_options.add_argument('--ignore-ssl-errors')
-        firefox_options.log.level = 'fatal'
+        with metricas.medir('descoberta'):
+            regioes_info, tarefas = descobrir_planilhas()
+        print(f"\nTotal de planilhas encontradas em {len(regioes_info)} regiões: {len(tarefas)}")
+        if manifesto:
+            tarefas = manifesto.planejar(tarefas)
+        for indice, tarefa in enumerate(tarefas):
+            tarefa['indice'] = indice
+        saidas = SaidasScraper(csv_path, carregador, exportar_csv, manifesto)
+        tarefas = entregar_concluidas(saidas, tarefas)
         
-        print("Configurando Firefox...")
-        driver = webdriver.Firefox(options=firefox_options)
-        driver.implicitly_wait(10)  # Aumentado para 10 segundos
-        wait = WebDriverWait(driver, 10)  # Aumentado para 10 segundos
+        # Baixa as planilhas em paralelo e processa conforme chegam
+        print(f"\nBaixando {len(tarefas)} planilhas...")
         
-        url = "http://www.infraestrutura.mg.gov.br/component/gmg/page/102-consulta-a-planilha-preco-setop"
-        print(f"Tentando acessar: {url}")
-        driver.get(url)
-        time.sleep(0.5)
+        # A leitura do Excel usa CPU, então roda em processos separados
+        # enquanto os downloads seguem nas threads
+        print(f"Processando com até {MAX_PROCESSOS} processos")
+        with ProcessPoolExecutor(max_workers=MAX_PROCESSOS, mp_context=get_context('spawn')) as pool:
+            processar_tarefas(tarefas, saidas, cache, pool)
         
-        try:
-            wait.until(EC.presence_of_element_located((By.CLASS_NAME, "map-container")))
-        except TimeoutException:
-            wait.until(EC.presence_of_element_located((By.TAG_NAME, "map")))
-        
-        regioes_info = []
-        municipios = driver.find_elements(By.CSS_SELECTOR, "area[title]")
-        
-        for municipio in municipios:
-            regioes_info.append({
-                'nome': municipio.get_attribute("title"),
-                'href': municipio.get_attribute("href")
-            })
-        
-        print(f"Encontradas {len(regioes_info)} regiões")
-        total_planilhas = 0
-        planilha_atual = 0
-        
-        # Processa planilhas
-        for regiao in regioes_info:
-            try:
-                print(f"\nProcessando região: {regiao['nome']}")
-                driver.get(regiao['href'])
-                time.sleep(0.5)
-                
-                links_planilhas = wait.until(
-                    EC.presence_of_all_elements_located(
-                        (By.CSS_SELECTOR, "a[href$='.xls'], a[href$='.xlsx']")
-                    )
-                )
-                
-                if links_planilhas:
-                    for link in links_planilhas:
-                        planilha_atual += 1
-                        url_planilha = link.get_attribute("href")
-                        texto = link.text.strip()
-                        ano = texto.split()[0] if texto else "N/A"
-                        
-                        print(f"Baixando planilha {planilha_atual}: {regiao['nome']}")
-                        df_processado = processar_planilha(url_planilha, regiao['nome'])
-                        
-                        if df_processado is not None:
-                            dados_processados.append(df_processado)
-                            
-            except Exception as e:
-                print(f"Erro ao processar região {regiao['nome']}: {str(e)}")
-                continue
-        
-        if dados_processados:
-            print("\nConsolidando dados...")
-            df_final = pd.concat(dados_processados, ignore_index=True)
-            
-            print("Salvando CSV...")
-            df_final.to_csv(csv_path, index=False, encoding='utf-8-sig')
-            print(f"Dados salvos em: {csv_path}")
-            
-            print("Preparando para fechar navegador...")
-            if driver:
-                print("Iniciando fechamento do navegador...")
-                fechar_navegador_com_timeout(driver)
-                driver = None
-            print("Navegador fechado")
-            
-            print("Retornando caminho do CSV...")
-            return csv_path
+        return saidas.finalizar()
             
     except Exception as e:
         print(f"Erro em scraper_seinfra: {str(e)}")
         raise
     finally:
-        if driver:
-            print("Fechando navegador no finally...")
-            fechar_navegador_com_timeout(driver)
-            driver = None
+        if saidas:
+            saidas.fechar()
+        if cache:
+            cache.salvar()
+            print(cache.relatorio())
+        if manifesto:
+            print(manifesto.relatorio())
         print("Finalizando scraper_seinfra...")
 
-def iniciar_scraping(request=None):
+def executar_scraper(carregador=None, exportar_csv=True, manifesto=None):
+    """
+    Executa o scraper com o motor configurado (SETOP_MOTOR)
+    """
+    with metricas.medir('scraper', motor=MOTOR_SCRAPER):
+        if MOTOR_SCRAPER == 'async':
+            from scraper.scraping_async import scraper_seinfra_async
+            return asyncio.run(scraper_seinfra_async(carregador, exportar_csv, manifesto))
+        return scraper_seinfra(carregador, exportar_csv, manifesto)
+
+def importar_em_streaming(log_message=print, manifesto=None):
+    """
+    Pipeline sem o CSV intermediário: cada planilha processada vai
+    direto para o carregador do banco. Retorna o resultado da carga
+    ou None em caso de erro.
+    """
+    from scraper import test_db
+    
+    log_message("\n" + "="*50)
+    log_message("INICIANDO SCRAPING COM IMPORTAÇÃO EM STREAMING")
+    log_message("="*50)
+    
+    carregador = test_db.CarregadorPrecos(log_message)
+    try:
+        executar_scraper(carregador=carregador, exportar_csv=EXPORTAR_CSV, manifesto=manifesto)
+        if not carregador.registros:
+            log_message("\nNenhum registro foi enviado para o banco")
+            carregador.cancelar()
+            return None
+        with metricas.medir('importacao'):
+            resultado = carregador.finalizar()
+        log_message("\nImportação concluída com sucesso!")
+        return resultado
+    except Exception as e:
+        carregador.cancelar()
+        log_message(f"\nErro durante a importação em streaming: {str(e)}")
+        return None
+
+def finalizar_execucao(inicio, log_message=print, manifesto=None):
+    if manifesto and not manifesto.finalizar():
+        log_message("\nAlgumas planilhas falharam; retome a execução para reprocessar só elas")
+    
+    fim = time.time()
+    tempo_total = fim - inicio
+    minutos = int(tempo_total // 60)
+    segundos = int(tempo_total % 60)
+    
+    log_message("\n" + "="*50)
+    log_message("PROCESSO COMPLETO")
+    log_message(f"Tempo total: {minutos}min {segundos}s")
+    log_message("="*50)
+    
+    return {
+        'status': 'success',
+        'message': 'PROCESSO CONCLUÍDO COM SUCESSO',
+        'tempo_execucao': f'{minutos}:{segundos}'
+    }
+
+def iniciar_scraping(request=None, retomar=False):
+    """
+    Executa o scraper e a importação, registrando as métricas da execução
+    (e o perfil do cProfile, com SETOP_PERFIL=1). Com retomar=True,
+    continua a execução anterior a partir do checkpoint.
+    """
+    metricas.iniciar_execucao()
+    try:
+        with metricas.perfil():
+            return _executar_scraping(request, retomar)
+    finally:
+        metricas.finalizar_execucao()
+
+def _executar_scraping(request=None, retomar=False):
     def log_message(message):
         # Envia mensagem tanto para console quanto para web
         print(message)
@@ -227,10 +417,33 @@ def iniciar_scraping(request=None):
         log_message("="*50)
         
         inicio = time.time()
+        if MODO_PIPELINE == 'distribuido':
+            # O estado de cada região fica no banco; não usa o checkpoint em disco
+            from scraper.distribuido import coordenar
+            if coordenar(log_message, retomar) is None:
+                return {
+                    'status': 'error',
+                    'message': 'Erro na importação para o banco',
+                    'tempo_execucao': '0:0'
+                }
+            return finalizar_execucao(inicio, log_message)
+        
+        manifesto = abrir_manifesto(retomar)
+        
+        if MODO_PIPELINE == 'stream':
+            resultado = importar_em_streaming(log_message, manifesto)
+            if resultado is None:
+                return {
+                    'status': 'error',
+                    'message': 'Erro na importação para o banco',
+                    'tempo_execucao': '0:0'
+                }
+            return finalizar_execucao(inicio, log_message, manifesto)
+        
         log_message("Chamando scraper_seinfra...")
         
         try:
-            csv_path = scraper_seinfra()
+            csv_path = executar_scraper(manifesto=manifesto)
             log_message("scraper_seinfra retornou com sucesso!")
             log_message(f"CSV Path retornado: {csv_path}")
         except Exception as e:
@@ -245,10 +458,11 @@ def iniciar_scraping(request=None):
             log_message("="*50)
             
             log_message("Importando módulo test_db...")
-            import test_db
+            from scraper import test_db
             
             log_message("\nIniciando importação para o banco de dados...")
-            resultado = test_db.importar_csv_direto(csv_path, request)
+            with metricas.medir('importacao'):
+                resultado = test_db.importar_csv_direto(csv_path, request)
             
             if resultado:
                 log_message("\nImportação concluída com sucesso!")
@@ -267,21 +481,7 @@ def iniciar_scraping(request=None):
                 'tempo_execucao': '0:0'
             }
         
-        fim = time.time()
-        tempo_total = fim - inicio
-        minutos = int(tempo_total // 60)
-        segundos = int(tempo_total % 60)
-        
-        log_message("\n" + "="*50)
-        log_message("PROCESSO COMPLETO")
-        log_message(f"Tempo total: {minutos}min {segundos}s")
-        log_message("="*50)
-        
-        return {
-            'status': 'success',
-            'message': 'PROCESSO CONCLUÍDO COM SUCESSO',
-            'tempo_execucao': f'{minutos}:{segundos}'
-        }
+        return finalizar_execucao(inicio, log_message, manifesto)
         
     except Exception as e:
         log_message("\n" + "="*50)
@@ -297,5 +497,10 @@ def iniciar_scraping(request=None):
         }
 
 if __name__ == "__main__":
-    resultado = iniciar_scraping()
+    import argparse
+    parser = argparse.ArgumentParser(description="Executa o scraper do SETOP e a importação")
+    parser.add_argument('--retomar', '--resume', action='store_true',
+                        help="Continua a execução interrompida, reprocessando só as planilhas pendentes ou com erro")
+    args = parser.parse_args()
+    resultado = iniciar_scraping(retomar=args.retomar)
     print(f"\n{resultado['message']}")
\ No newline at end of file
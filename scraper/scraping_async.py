@@ -0,0 +1,258 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import aiohttp
+from scraper.cache import obter_cache
+from scraper.descoberta import (
+    URL_SETOP, MODO_DESCOBERTA, extrair_regioes, extrair_planilhas, criar_tarefa,
+    descobrir_planilhas_selenium
+)
+from scraper.downloads import MAX_DOWNLOADS
+from scraper.controle_host import MAX_POR_HOST, STATUS_RETRY, obter_controlador, segundos_retry_after
+from scraper.scraping import (
+    MAX_PROCESSOS, SaidasScraper, preparar_diretorio_saida, processar_planilha
+)
+from scraper import metricas
+
+# Tamanho das filas entre as etapas; limita quantas planilhas baixadas
+# ou processadas ficam em memória esperando a etapa seguinte
+TAMANHO_FILA = int(os.environ.get('SETOP_TAMANHO_FILA', '4'))
+
+FIM = object()
+
+async def buscar(session, url, headers=None, max_retries=3, backoff_factor=0.5):
+    """
+    GET com retry passando pelo controlador do host (o mesmo dos downloads
+    síncronos, ver downloads.requisitar); retorna (status, corpo, cabeçalhos)
+    """
+    controlador = obter_controlador(url)
+    for tentativa in range(max_retries + 1):
+        if tentativa:
+            metricas.contar('setop_retries_total')
+        await controlador.reservar_async()
+        liberado = False
+        try:
+            inicio = time.perf_counter()
+            async with session.get(url, headers=headers or {}) as response:
+                retry_after = segundos_retry_after(response.headers.get('Retry-After')) \
+                    if response.status in STATUS_RETRY else None
+                controlador.liberar(response.status, time.perf_counter() - inicio, retry_after)
+                liberado = True
+                if response.status not in STATUS_RETRY or tentativa == max_retries:
+                    return response.status, await response.read(), response.headers
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if tentativa == max_retries:
+                raise
+        finally:
+            if not liberado:
+                controlador.liberar(falha=True)
+        await asyncio.sleep(backoff_factor * (2 ** tentativa))
+
+async def _listar_regiao(session, regiao):
+    status, corpo, _ = await buscar(session, regiao['href'])
+    if status != 200:
+        raise RuntimeError(f"Status code: {status}")
+    links = extrair_planilhas(corpo.decode('utf-8', errors='replace'), regiao['href'])
+    if not links:
+        print(f"Nenhuma planilha encontrada para a região {regiao['nome']}")
+    return [criar_tarefa(regiao['nome'], link) for link in links]
+
+async def _enfileirar(tarefas, indice, manifesto, fila_downloads, fila_carga):
+    """
+    Numera as planilhas e as envia para download; as já concluídas no
+    checkpoint vão direto para a carga. Retorna o próximo índice.
+    """
+    if manifesto:
+        await asyncio.to_thread(manifesto.registrar_tarefas, tarefas)
+    for tarefa in tarefas:
+        tarefa['indice'] = indice
+        indice += 1
+        df_processado = await asyncio.to_thread(manifesto.ler_concluida, tarefa['url']) if manifesto else None
+        if df_processado is not None:
+            tarefa['origem'] = 'checkpoint'
+            await fila_carga.put((tarefa, df_processado))
+        else:
+            await fila_downloads.put(tarefa)
+    return indice
+
+async def _descobrir(session, manifesto, fila_downloads, fila_carga):
+    """
+    Etapa 1: lê o mapa de regiões e enfileira as planilhas de cada região
+    assim que a página dela é lida
+    """
+    regioes_info = []
+    # No modo 'selenium' o mapa nem é lido via HTTP, como em descobrir_planilhas
+    if MODO_DESCOBERTA != 'selenium':
+        print(f"Tentando acessar: {URL_SETOP}")
+        try:
+            status, corpo, _ = await buscar(session, URL_SETOP)
+            if status == 200:
+                regioes_info = extrair_regioes(corpo.decode('utf-8', errors='replace'), URL_SETOP)
+        except Exception as e:
+            print(f"Erro na descoberta via HTTP: {str(e)}")
+        if not regioes_info:
+            print("Nenhuma região encontrada via HTTP, tentando com Selenium...")
+
+    indice = 0
+    if not regioes_info:
+        regioes_info, tarefas = await asyncio.to_thread(descobrir_planilhas_selenium)
+        if manifesto:
+            tarefas = await asyncio.to_thread(manifesto.planejar, tarefas)
+        await _enfileirar(tarefas, indice, manifesto, fila_downloads, fila_carga)
+        return
+
+    print(f"Encontradas {len(regioes_info)} regiões")
+
+    async def listar(regiao):
+        try:
+            return await _listar_regiao(session, regiao)
+        except Exception as e:
+            print(f"Erro ao processar região {regiao['nome']}: {str(e)}")
+            return []
+
+    descobertas = set()
+    for pendente in asyncio.as_completed([listar(regiao) for regiao in regioes_info]):
+        tarefas = await pendente
+        descobertas.update(tarefa['url'] for tarefa in tarefas)
+        indice = await _enfileirar(tarefas, indice, manifesto, fila_downloads, fila_carga)
+    if manifesto:
+        # Planilhas do checkpoint cujas regiões falharam nesta descoberta
+        restantes = manifesto.nao_descobertas(descobertas)
+        indice = await _enfileirar(restantes, indice, manifesto, fila_downloads, fila_carga)
+    print(f"\nTotal de planilhas encontradas em {len(regioes_info)} regiões: {indice}")
+
+async def _baixar_planilha(session, cache, url):
+    inicio = time.perf_counter()
+    status = None
+    try:
+        headers = cache.cabecalhos_condicionais(url) if cache else {}
+        status, corpo, cabecalhos = await buscar(session, url, headers)
+        metricas.contar('setop_bytes_baixados_total', len(corpo))
+        if status == 304 and cache:
+            return await asyncio.to_thread(cache.registrar_nao_modificada, url)
+        if status == 200:
+            if cache:
+                return await asyncio.to_thread(cache.registrar_download, url, corpo, cabecalhos)
+            return corpo
+        print(f"Erro ao baixar planilha. Status code: {status}")
+    except Exception as e:
+        status = type(e).__name__
+        print(f"Erro ao baixar planilha: {str(e)}")
+    finally:
+        metricas.contar('setop_downloads_total', status=str(status))
+        metricas.contar('setop_etapa_segundos_total', time.perf_counter() - inicio, etapa='download')
+    return None
+
+async def _baixar(session, cache, fila_downloads, fila_processamento):
+    """
+    Etapa 2: baixa as planilhas (várias em paralelo)
+    """
+    while (tarefa := await fila_downloads.get()) is not FIM:
+        content = await _baixar_planilha(session, cache, tarefa['url'])
+        if content is None:
+            print(f"Erro ao baixar planilha {tarefa['url']}")
+        else:
+            tarefa['bytes'] = len(content)
+        await fila_processamento.put((tarefa, content))
+
+async def _processar(pool, cache, fila_processamento, fila_carga):
+    """
+    Etapa 3: lê as planilhas nos processos do pool, fora do event loop
+    """
+    loop = asyncio.get_running_loop()
+    while (item := await fila_processamento.get()) is not FIM:
+        tarefa, content = item
+        if content is None:
+            # Falha no download: a carga registra a planilha como erro
+            await fila_carga.put((tarefa, None))
+            continue
+
+        # Planilha inalterada desde a última execução: reaproveita o processamento
+        df_processado = await asyncio.to_thread(cache.ler_processado, tarefa['url']) if cache else None
+        if df_processado is not None:
+            print(f"Planilha {tarefa['indice'] + 1} inalterada: {tarefa['regiao']}")
+            tarefa['origem'] = 'cache'
+        else:
+            print(f"Processando planilha {tarefa['indice'] + 1}: {tarefa['regiao']}")
+            try:
+                df_processado = await loop.run_in_executor(
+                    pool, processar_planilha, tarefa['url'], tarefa['regiao'], content, tarefa['ano']
+                )
+            except Exception as e:
+                # Ex.: processo do pool encerrado de forma inesperada
+                print(f"Erro ao processar planilha {tarefa['url']}: {str(e)}")
+                df_processado = None
+            if cache and df_processado is not None:
+                await asyncio.to_thread(cache.salvar_processado, tarefa['url'], df_processado)
+
+        # None também segue para a carga, que registra a planilha como erro
+        await fila_carga.put((tarefa, df_processado))
+
+async def _carregar(saidas, fila_carga):
+    """
+    Etapa 4: envia cada planilha para o banco/CSV/exportação
+    """
+    while (item := await fila_carga.get()) is not FIM:
+        await asyncio.to_thread(saidas.entregar, *item)
+
+async def _medir(etapa, corotina):
+    with metricas.medir(etapa):
+        await corotina
+
+async def _etapa(trabalhadores, fila_seguinte, consumidores):
+    # Quando todos os trabalhadores da etapa terminam, avisa a etapa seguinte
+    await asyncio.gather(*trabalhadores)
+    for _ in range(consumidores):
+        await fila_seguinte.put(FIM)
+
+async def scraper_seinfra_async(carregador=None, exportar_csv=True, manifesto=None):
+    """
+    Versão asyncio do scraper_seinfra: descoberta, downloads, leitura e
+    carga rodam como etapas sobrepostas ligadas por filas limitadas.
+    """
+    print("Iniciando scraper_seinfra_async...")
+    csv_path = preparar_diretorio_saida()
+    cache = obter_cache()
+    saidas = SaidasScraper(csv_path, carregador, exportar_csv, manifesto)
+
+    fila_downloads = asyncio.Queue(maxsize=MAX_DOWNLOADS * 2)
+    fila_processamento = asyncio.Queue(maxsize=TAMANHO_FILA)
+    fila_carga = asyncio.Queue(maxsize=TAMANHO_FILA)
+
+    conector = aiohttp.TCPConnector(limit=MAX_DOWNLOADS, limit_per_host=MAX_POR_HOST)
+    timeout = aiohttp.ClientTimeout(sock_connect=30, sock_read=30)
+
+    try:
+        print(f"Baixando até {MAX_DOWNLOADS} planilhas e processando até {MAX_PROCESSOS} em paralelo")
+        with ProcessPoolExecutor(max_workers=MAX_PROCESSOS, mp_context=get_context('spawn')) as pool:
+            async with aiohttp.ClientSession(connector=conector, timeout=timeout) as session:
+                async with asyncio.TaskGroup() as grupo:
+                    grupo.create_task(_etapa(
+                        [_medir('descoberta', _descobrir(session, manifesto, fila_downloads, fila_carga))],
+                        fila_downloads, MAX_DOWNLOADS
+                    ))
+                    grupo.create_task(_etapa(
+                        [_baixar(session, cache, fila_downloads, fila_processamento) for _ in range(MAX_DOWNLOADS)],
+                        fila_processamento, MAX_PROCESSOS
+                    ))
+                    grupo.create_task(_etapa(
+                        [_processar(pool, cache, fila_processamento, fila_carga) for _ in range(MAX_PROCESSOS)],
+                        fila_carga, 1
+                    ))
+                    grupo.create_task(_carregar(saidas, fila_carga))
+
+        return await asyncio.to_thread(saidas.finalizar)
+
+    except Exception as e:
+        print(f"Erro em scraper_seinfra_async: {str(e)}")
+        raise
+    finally:
+        saidas.fechar()
+        if cache:
+            cache.salvar()
+            print(cache.relatorio())
+        if manifesto:
+            print(manifesto.relatorio())
+        print("Finalizando scraper_seinfra_async...")
@@ -1,77 +1,805 @@
 import psycopg2
 import pandas as pd
 import os
+import re
+import sys
+import time
+import hashlib
+from datetime import datetime
+from io import StringIO
+from scraper.banco import DATABASE_URL, ANO_DESCONHECIDO
+from scraper import metricas
 
-def importar_csv_direto(arquivo_csv, request=None):
+CONN_STR = DATABASE_URL
+
+# Modo de carga: 'incremental' (upsert) ou 'troca' (tabela sombra + rename)
+MODO_CARGA = os.environ.get('SETOP_MODO_CARGA', 'incremental')
+SNAPSHOTS_MANTIDOS = int(os.environ.get('SETOP_SNAPSHOTS', '2'))
+TIMEOUT_TROCA = os.environ.get('SETOP_TIMEOUT_TROCA', '10s')
+PREFIXO_SNAPSHOT = 'precos_fatos_snap_'
+
+# Snapshots do formato anterior (linhas completas), removidos na conversão
+PREFIXO_SNAPSHOT_ANTIGO = 'precos_setop_snap_'
+
+# Colunas do CSV consolidado e os respectivos campos/tamanhos na tabela
+COLUNAS_PRECOS = [
+    ('CÓDIGO', 'codigo', 50),
+    ('DESCRIÇÃO DO SERVIÇO', 'descricao_servico', None),
+    ('UNIDADE', 'unidade', 20),
+    ('CUSTO UNITÁRIO', 'custo_unitario', None),
+    ('regiao', 'regiao', 50),
+    ('ANO', 'ano', 20),
+]
+
+def preparar_dados(df):
+    """
+    Converte o DataFrame do scraper para as colunas da tabela precos_setop,
+    truncando os textos e convertendo o custo de forma vetorizada
+    """
+    dados = pd.DataFrame(index=df.index)
+    for coluna_csv, coluna_db, tamanho in COLUNAS_PRECOS:
+        if coluna_csv not in df.columns:
+            # CSVs gerados antes da coluna ANO
+            dados[coluna_db] = None
+        elif coluna_db == 'ano':
+            anos = df[coluna_csv]
+            dados[coluna_db] = anos.astype(str).str.slice(0, tamanho).where(
+                anos.notna() & (anos != ANO_DESCONHECIDO), None
+            )
+        elif coluna_db == 'custo_unitario':
+            dados[coluna_db] = pd.to_numeric(df[coluna_csv], errors='coerce')
+        elif tamanho:
+            dados[coluna_db] = df[coluna_csv].astype(str).str.slice(0, tamanho)
+        else:
+            dados[coluna_db] = df[coluna_csv]
+    return dados
+
+def copiar_dataframe(cursor, dados, tabela, tamanho_lote=100000):
+    """
+    Envia o DataFrame para o PostgreSQL com COPY FROM STDIN, em lotes
+    para limitar a memória usada pelo buffer
+    """
+    colunas = ', '.join(dados.columns)
+    comando = f"COPY {tabela} ({colunas}) FROM STDIN WITH (FORMAT csv)"
+    for inicio in range(0, len(dados), tamanho_lote):
+        buffer = StringIO()
+        dados.iloc[inicio:inicio + tamanho_lote].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor.copy_expert(comando, buffer)
+
+# Índices da tabela de fatos: (sufixo do nome, definição)
+INDICES_PRECOS = [
+    # Sem edição identificada o ano é nulo, e NULL conta como um valor na chave
+    ('chave', 'UNIQUE INDEX', '(servico_id, regiao_id, ano) NULLS NOT DISTINCT'),
+    # Consulta e remoção por região/ano
+    ('regiao_ano', 'INDEX', '(regiao_id, ano, servico_id)'),
+]
+
+# Índice trigram para a busca na descrição (requer a extensão pg_trgm)
+INDICE_TRIGRAM = ('descricao_trgm', 'INDEX', 'USING gin (descricao_servico gin_trgm_ops)')
+
+def ddl_tabela_precos(tabela):
+    """
+    Tabela de fatos estreita: só os ids do serviço e da região, o ano e o
+    custo. Código, descrição e unidade ficam uma única vez em servicos,
+    e o nome da região em regioes.
+    """
+    return f"""
+        CREATE TABLE IF NOT EXISTS {tabela} (
+            servico_id INTEGER NOT NULL,
+            regiao_id SMALLINT NOT NULL,
+            ano VARCHAR(20),
+            custo_unitario DECIMAL(10,2),
+            data_importacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """
+
+def criar_dimensoes(cursor):
+    """
+    Dimensões dos preços: um serviço por código (com a descrição e a
+    unidade da edição mais recente carregada) e uma linha por região
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS servicos (
+            id SERIAL PRIMARY KEY,
+            codigo VARCHAR(50) NOT NULL UNIQUE,
+            descricao_servico TEXT,
+            unidade VARCHAR(20),
+            ano VARCHAR(20)
+        );
+        CREATE TABLE IF NOT EXISTS regioes (
+            id SMALLSERIAL PRIMARY KEY,
+            nome VARCHAR(50) NOT NULL UNIQUE
+        );
+    """)
+    if _pg_trgm_disponivel(cursor):
+        sufixo, tipo, colunas = INDICE_TRIGRAM
+        cursor.execute(f"CREATE {tipo} IF NOT EXISTS servicos_{sufixo} ON servicos {colunas};")
+
+def consulta_precos(tabela_fatos):
+    """
+    SELECT com as colunas de precos_setop sobre uma tabela de fatos
+    """
+    return f"""
+        SELECT s.codigo, s.descricao_servico, s.unidade, f.custo_unitario, r.nome AS regiao, f.ano,
+               md5(concat_ws('|', s.descricao_servico, s.unidade, f.custo_unitario::text)) AS hash_conteudo,
+               f.data_importacao
+        FROM {tabela_fatos} f
+        JOIN servicos s ON s.id = f.servico_id
+        JOIN regioes r ON r.id = f.regiao_id
+    """
+
+def criar_view_precos(cursor, recriar=False):
+    """
+    precos_setop como view sobre os fatos e as dimensões, com as mesmas
+    colunas da tabela larga anterior (usada pela API, pela matriz e pelo
+    histórico). Criada só se ainda não existir: CREATE OR REPLACE VIEW
+    bloqueia as consultas à view até o fim da transação, que numa carga
+    pode durar a execução inteira. Só a troca a recria (recriar=True), já
+    que a view fica presa à tabela de fatos pela qual foi criada.
+    """
+    if not recriar:
+        cursor.execute("SELECT to_regclass('precos_setop') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            return
+    cursor.execute(f"CREATE OR REPLACE VIEW precos_setop AS {consulta_precos('precos_fatos')};")
+
+def _pg_trgm_disponivel(cursor):
+    cursor.execute("SAVEPOINT pg_trgm;")
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        cursor.execute("RELEASE SAVEPOINT pg_trgm;")
+        return True
+    except psycopg2.Error as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT pg_trgm;")
+        print(f"Extensão pg_trgm indisponível, busca por descrição sem índice: {str(e).strip().splitlines()[0]}")
+        return False
+
+def criar_indices(cursor, tabela):
+    """
+    Cria os índices da tabela de fatos (nomeados a partir da tabela)
+    """
+    for sufixo, tipo, colunas in INDICES_PRECOS:
+        cursor.execute(f"CREATE {tipo} IF NOT EXISTS {tabela}_{sufixo} ON {tabela} {colunas};")
+
+def registrar_versao(cursor):
+    """
+    Incrementa a versão dos dados de precos_setop na transação da carga.
+    A API de consulta usa a versão no ETag e na chave do cache.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS precos_setop_versao (
+            id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+            versao BIGINT NOT NULL,
+            atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO precos_setop_versao (id, versao) VALUES (1, 1)
+        ON CONFLICT (id) DO UPDATE SET
+            versao = precos_setop_versao.versao + 1,
+            atualizado_em = CURRENT_TIMESTAMP;
+    """)
+
+def converter_tabela_larga(cursor, log_message=print):
+    """
+    Converte a tabela precos_setop do formato anterior (uma linha completa
+    por código/região/ano) para as dimensões e a tabela de fatos. Retorna
+    True se a tabela foi convertida (e a matriz, removida).
+    """
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('precos_setop')")
+    linha = cursor.fetchone()
+    if linha is None or linha[0] != 'r':
+        return False
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'precos_setop' AND column_name = 'hash_conteudo'
+    """)
+    formato_antigo = cursor.fetchone() is None
+    # A matriz depende da tabela antiga (só nesta conversão, feita uma vez);
+    # é recriada sobre a view em criar_tabela_precos
+    cursor.execute("DROP MATERIALIZED VIEW IF EXISTS precos_matriz;")
+    if formato_antigo:
+        # Formato mais antigo (recarregado a cada execução, sem ano): não há o que converter
+        log_message("Tabela no formato antigo encontrada, recriando...")
+    else:
+        log_message("Convertendo precos_setop para serviços, regiões e fatos...")
+        cursor.execute("""
+            INSERT INTO regioes (nome) SELECT DISTINCT regiao FROM precos_setop
+            ON CONFLICT (nome) DO NOTHING;
+            INSERT INTO servicos (codigo, descricao_servico, unidade, ano)
+            SELECT DISTINCT ON (codigo) codigo, descricao_servico, unidade, NULLIF(ano, %(desconhecido)s)
+            FROM precos_setop
+            ORDER BY codigo, NULLIF(ano, %(desconhecido)s) DESC NULLS LAST
+            ON CONFLICT (codigo) DO NOTHING;
+        """, {'desconhecido': ANO_DESCONHECIDO})
+        cursor.execute(ddl_tabela_precos('precos_fatos'))
+        cursor.execute("""
+            INSERT INTO precos_fatos (servico_id, regiao_id, ano, custo_unitario, data_importacao)
+            SELECT s.id, r.id, NULLIF(p.ano, %s), p.custo_unitario, p.data_importacao
+            FROM precos_setop p
+            JOIN servicos s ON s.codigo = p.codigo
+            JOIN regioes r ON r.nome = p.regiao;
+        """, (ANO_DESCONHECIDO,))
+        log_message(f"{cursor.rowcount} preços convertidos")
+        # Enquanto a tabela antiga existe, o histórico ainda pode começar
+        # com a descrição e a unidade de cada linha (os fatos só guardam
+        # as da edição mais recente de cada código)
+        criar_tabela_historico(cursor, log_message)
+    cursor.execute("DROP TABLE precos_setop;")
+
+    # Snapshots no formato anterior não podem ser restaurados sobre os fatos
+    cursor.execute("""
+        SELECT tablename FROM pg_tables
+        WHERE schemaname = current_schema() AND tablename LIKE %s;
+    """, (PREFIXO_SNAPSHOT_ANTIGO + '%',))
+    for (snapshot,) in cursor.fetchall():
+        cursor.execute(f"DROP TABLE {snapshot};")
+        log_message(f"Snapshot no formato anterior removido: {snapshot}")
+    return True
+
+def permitir_ano_nulo(cursor, log_message=print):
+    """
+    Bancos anteriores ao ano nulo: o ano 'N/A' vira NULL nos fatos (e nos
+    snapshots), em servicos e no histórico, e as chaves passam a tratar
+    NULL como um valor (NULLS NOT DISTINCT)
+    """
+    cursor.execute("""
+        SELECT table_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND column_name = 'ano' AND is_nullable = 'NO'
+          AND (table_name = 'precos_fatos' OR table_name LIKE %s)
+        ORDER BY table_name;
+    """, (PREFIXO_SNAPSHOT + '%',))
+    tabelas = [linha[0] for linha in cursor.fetchall()]
+    if tabelas:
+        log_message("Convertendo o ano 'N/A' para nulo...")
+        cursor.execute("UPDATE servicos SET ano = NULL WHERE ano = %s;", (ANO_DESCONHECIDO,))
+    for tabela in tabelas:
+        cursor.execute(f"ALTER TABLE {tabela} ALTER COLUMN ano DROP NOT NULL;")
+        cursor.execute(f"UPDATE {tabela} SET ano = NULL WHERE ano = %s;", (ANO_DESCONHECIDO,))
+        cursor.execute(f"DROP INDEX IF EXISTS {tabela}_chave;")
+        criar_indices(cursor, tabela)
+
+    cursor.execute("""
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = to_regclass('precos_historico') AND conname = 'precos_historico_pkey'
+    """)
+    if cursor.fetchone():
+        cursor.execute("""
+            ALTER TABLE precos_historico DROP CONSTRAINT precos_historico_pkey;
+            ALTER TABLE precos_historico ALTER COLUMN ano DROP NOT NULL;
+            ALTER TABLE precos_historico ADD CONSTRAINT precos_historico_chave
+                UNIQUE NULLS NOT DISTINCT (codigo, regiao, ano, valido_de);
+        """)
+        criar_particoes_historico(cursor, [None])
+        # As linhas passam para a partição do ano nulo
+        cursor.execute("UPDATE precos_historico SET ano = NULL WHERE ano = %s;", (ANO_DESCONHECIDO,))
+        cursor.execute(f"DROP TABLE IF EXISTS {_nome_particao_historico(ANO_DESCONHECIDO)};")
+
+def criar_tabela_precos(cursor, log_message=print, criar_fatos=True):
+    """
+    Cria as dimensões, a tabela de fatos precos_fatos com chave natural
+    (serviço, região, ano) e a view precos_setop. No modo troca a tabela
+    de fatos só é criada na primeira troca.
+    """
+    criar_dimensoes(cursor)
+    convertida = converter_tabela_larga(cursor, log_message)
+    permitir_ano_nulo(cursor, log_message)
+    cursor.execute("SELECT to_regclass('precos_fatos') IS NOT NULL")
+    if criar_fatos or cursor.fetchone()[0]:
+        cursor.execute(ddl_tabela_precos('precos_fatos'))
+        criar_indices(cursor, 'precos_fatos')
+        criar_view_precos(cursor)
+        if convertida:
+            atualizar_matriz(cursor, log_message)
+    # Antes da carga: a primeira versão do histórico são os preços anteriores a ela
+    criar_tabela_historico(cursor, log_message)
+
+def criar_staging(cursor):
+    """
+    Tabela temporária que recebe o COPY antes do merge
+    """
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS precos_staging (
+            ordem SERIAL,
+            planilha INTEGER,
+            codigo VARCHAR(50),
+            descricao_servico TEXT,
+            unidade VARCHAR(20),
+            custo_unitario DECIMAL(10,2),
+            regiao VARCHAR(50),
+            ano VARCHAR(20)
+        ) ON COMMIT DROP;
+    """)
+
+def preparar_novos(cursor):
+    """
+    Gera a tabela temporária precos_novos a partir da staging, com uma
+    linha por chave e o hash do conteúdo. Retorna o total de linhas.
+    """
+    # Chaves repetidas na mesma carga: fica a da última planilha na ordem
+    # da descoberta e, dentro dela, a última linha. A ordem de chegada na
+    # staging depende de quais downloads terminam primeiro e não decide.
+    # Sem o índice da planilha (importação do CSV), vale a ordem do arquivo.
+    cursor.execute("""
+        CREATE TEMP TABLE precos_novos ON COMMIT DROP AS
+        SELECT DISTINCT ON (codigo, regiao, ano)
+               codigo, descricao_servico, unidade, custo_unitario, regiao, ano,
+               md5(concat_ws('|', descricao_servico, unidade, custo_unitario::text)) AS hash_conteudo
+        FROM precos_staging
+        WHERE codigo IS NOT NULL
+        ORDER BY codigo, regiao, ano, planilha DESC NULLS LAST, ordem DESC;
+    """)
+    cursor.execute("SELECT count(*) FROM precos_novos")
+    return cursor.fetchone()[0]
+
+def preparar_fatos(cursor, log_message=print):
+    """
+    Atualiza as dimensões com os serviços e regiões de precos_novos e gera
+    a tabela temporária fatos_novos, com os ids no lugar dos textos
+    """
+    cursor.execute("""
+        INSERT INTO regioes (nome) SELECT DISTINCT regiao FROM precos_novos
+        ON CONFLICT (nome) DO NOTHING;
+    """)
+    # Um serviço por código: vale a descrição da edição mais recente
+    # (uma edição antiga recarregada não sobrescreve a atual)
+    cursor.execute("""
+        WITH upsert AS (
+            INSERT INTO servicos (codigo, descricao_servico, unidade, ano)
+            SELECT DISTINCT ON (codigo) codigo, descricao_servico, unidade, ano
+            FROM precos_novos
+            ORDER BY codigo, ano DESC NULLS LAST
+            ON CONFLICT (codigo) DO UPDATE SET
+                descricao_servico = EXCLUDED.descricao_servico,
+                unidade = EXCLUDED.unidade,
+                ano = EXCLUDED.ano
+            WHERE (servicos.ano IS NULL OR EXCLUDED.ano >= servicos.ano)
+              AND (servicos.descricao_servico, servicos.unidade, servicos.ano)
+                IS DISTINCT FROM (EXCLUDED.descricao_servico, EXCLUDED.unidade, EXCLUDED.ano)
+            RETURNING (xmax = 0) AS inserido
+        )
+        SELECT count(*) FILTER (WHERE inserido), count(*) FILTER (WHERE NOT inserido)
+        FROM upsert;
+    """)
+    novos, atualizados = cursor.fetchone()
+    log_message(f"Serviços: {novos} novos, {atualizados} com descrição ou unidade atualizada")
+
+    cursor.execute("""
+        CREATE TEMP TABLE fatos_novos ON COMMIT DROP AS
+        SELECT s.id AS servico_id, r.id AS regiao_id, n.ano, n.custo_unitario
+        FROM precos_novos n
+        JOIN servicos s ON s.codigo = n.codigo
+        JOIN regioes r ON r.nome = n.regiao;
+    """)
+
+def merge_staging(cursor, log_message=print):
+    """
+    Aplica a staging em precos_fatos com INSERT ... ON CONFLICT DO UPDATE.
+    Linhas com o mesmo custo não são tocadas; linhas que sumiram das
+    planilhas carregadas (mesma região e ano) são removidas.
+    """
+    total = preparar_novos(cursor)
+    preparar_fatos(cursor, log_message)
+
+    cursor.execute("""
+        WITH upsert AS (
+            INSERT INTO precos_fatos (servico_id, regiao_id, ano, custo_unitario)
+            SELECT servico_id, regiao_id, ano, custo_unitario
+            FROM fatos_novos
+            ON CONFLICT (servico_id, regiao_id, ano) DO UPDATE SET
+                custo_unitario = EXCLUDED.custo_unitario,
+                data_importacao = CURRENT_TIMESTAMP
+            WHERE precos_fatos.custo_unitario IS DISTINCT FROM EXCLUDED.custo_unitario
+            RETURNING (xmax = 0) AS inserido
+        )
+        SELECT count(*) FILTER (WHERE inserido), count(*) FILTER (WHERE NOT inserido)
+        FROM upsert;
+    """)
+    inseridos, atualizados = cursor.fetchone()
+
+    cursor.execute("""
+        DELETE FROM precos_fatos p
+        WHERE EXISTS (
+              SELECT 1 FROM (SELECT DISTINCT regiao_id, ano FROM fatos_novos) e
+              WHERE e.regiao_id = p.regiao_id AND e.ano IS NOT DISTINCT FROM p.ano
+          )
+          AND NOT EXISTS (
+              SELECT 1 FROM fatos_novos n
+              WHERE n.servico_id = p.servico_id AND n.regiao_id = p.regiao_id
+                AND n.ano IS NOT DISTINCT FROM p.ano
+          );
+    """)
+    removidos = cursor.rowcount
+
+    return {
+        'inseridos': inseridos,
+        'atualizados': atualizados,
+        'inalterados': total - inseridos - atualizados,
+        'removidos': removidos,
+    }
+
+def _nome_particao_historico(ano):
+    if ano is None:
+        return "precos_historico_sem_ano"
+    nome = re.sub(r'[^a-z0-9]+', '_', ano.lower()).strip('_')
+    if nome != ano:
+        # Evita que anos diferentes gerem o mesmo nome (ex.: '2024/1' e '2024-1')
+        nome = f"{nome or 'sem_ano'}_{hashlib.md5(ano.encode()).hexdigest()[:6]}"
+    return f"precos_historico_{nome}"
+
+def criar_tabela_historico(cursor, log_message=print):
+    """
+    Histórico de preços particionado por ano: uma linha por versão de
+    (codigo, regiao, ano), válida de valido_de até valido_ate (aberta
+    enquanto for o preço atual). Só é gravada quando o conteúdo muda.
+    """
+    cursor.execute("SELECT to_regclass('precos_historico') IS NOT NULL")
+    if cursor.fetchone()[0]:
+        return
+    log_message("Criando tabela de histórico de preços...")
+    cursor.execute("""
+        CREATE TABLE precos_historico (
+            codigo VARCHAR(50) NOT NULL,
+            regiao VARCHAR(50) NOT NULL,
+            ano VARCHAR(20),
+            descricao_servico TEXT,
+            unidade VARCHAR(20),
+            custo_unitario DECIMAL(10,2),
+            hash_conteudo CHAR(32) NOT NULL,
+            valido_de TIMESTAMP NOT NULL,
+            valido_ate TIMESTAMP,
+            CONSTRAINT precos_historico_chave UNIQUE NULLS NOT DISTINCT (codigo, regiao, ano, valido_de)
+        ) PARTITION BY LIST (ano);
+        CREATE INDEX precos_historico_atuais ON precos_historico (codigo, regiao, ano)
+            WHERE valido_ate IS NULL;
+    """)
+    cursor.execute("SELECT to_regclass('precos_setop') IS NOT NULL")
+    if cursor.fetchone()[0]:
+        # Os preços já carregados viram a primeira versão do histórico, com
+        # o hash calculado dos valores de cada linha, como em preparar_novos
+        cursor.execute("SELECT DISTINCT NULLIF(ano, %s) FROM precos_setop", (ANO_DESCONHECIDO,))
+        criar_particoes_historico(cursor, [linha[0] for linha in cursor.fetchall()])
+        cursor.execute("""
+            INSERT INTO precos_historico
+                (codigo, regiao, ano, descricao_servico, unidade, custo_unitario, hash_conteudo, valido_de)
+            SELECT codigo, regiao, NULLIF(ano, %s), descricao_servico, unidade, custo_unitario,
+                   md5(concat_ws('|', descricao_servico, unidade, custo_unitario::text)),
+                   coalesce(data_importacao, now())
+            FROM precos_setop;
+        """, (ANO_DESCONHECIDO,))
+
+def criar_particoes_historico(cursor, anos):
+    for ano in anos:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {_nome_particao_historico(ano)} "
+            f"PARTITION OF precos_historico FOR VALUES IN (%s);",
+            (ano,)
+        )
+
+def registrar_historico(cursor, completo=False, log_message=print):
+    """
+    Grava no histórico as linhas de precos_novos cujo conteúdo mudou e
+    fecha as versões que mudaram ou sumiram. Com completo=False só as
+    regiões/anos presentes na carga são considerados (merge incremental);
+    com completo=True, precos_novos é a tabela inteira (troca/restauração).
+    """
+    criar_tabela_historico(cursor, log_message)
+    cursor.execute("SELECT DISTINCT ano FROM precos_novos")
+    criar_particoes_historico(cursor, [linha[0] for linha in cursor.fetchall()])
+
+    escopo = "" if completo else """
+          AND EXISTS (
+              SELECT 1 FROM (SELECT DISTINCT regiao, ano FROM precos_novos) e
+              WHERE e.regiao = h.regiao AND e.ano IS NOT DISTINCT FROM h.ano
+          )"""
+    cursor.execute(f"""
+        UPDATE precos_historico h SET valido_ate = now()
+        WHERE h.valido_ate IS NULL
+          {escopo}
+          AND NOT EXISTS (
+              SELECT 1 FROM precos_novos n
+              WHERE n.codigo = h.codigo AND n.regiao = h.regiao AND n.ano IS NOT DISTINCT FROM h.ano
+                AND n.hash_conteudo = h.hash_conteudo
+          );
+    """)
+    encerradas = cursor.rowcount
+    cursor.execute("""
+        INSERT INTO precos_historico
+            (codigo, regiao, ano, descricao_servico, unidade, custo_unitario, hash_conteudo, valido_de)
+        SELECT n.codigo, n.regiao, n.ano, n.descricao_servico, n.unidade, n.custo_unitario, n.hash_conteudo, now()
+        FROM precos_novos n
+        WHERE NOT EXISTS (
+            SELECT 1 FROM precos_historico h
+            WHERE h.codigo = n.codigo AND h.regiao = n.regiao AND h.ano IS NOT DISTINCT FROM n.ano
+              AND h.valido_ate IS NULL
+        );
+    """)
+    log_message(f"Histórico: {cursor.rowcount} novas versões, {encerradas} versões encerradas")
+
+def atualizar_matriz(cursor, log_message=print):
+    """
+    Matriz código x região pré-calculada (view materializada precos_matriz):
+    custo de cada região e mínimo/máximo/mediana/amplitude por código e ano.
+    Criada na primeira importação e atualizada com REFRESH CONCURRENTLY
+    nas seguintes, sem bloquear as consultas.
+    """
+    cursor.execute("SELECT to_regclass('precos_matriz') IS NOT NULL")
+    if cursor.fetchone()[0]:
+        log_message("Atualizando matriz de preços por região...")
+        cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY precos_matriz;")
+        return
+
+    log_message("Criando matriz de preços por região...")
+    cursor.execute("""
+        CREATE MATERIALIZED VIEW precos_matriz AS
+        SELECT codigo, ano,
+               min(descricao_servico) AS descricao_servico,
+               min(unidade) AS unidade,
+               count(*) AS regioes,
+               min(custo_unitario) AS custo_minimo,
+               max(custo_unitario) AS custo_maximo,
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY custo_unitario)::DECIMAL(10,2) AS custo_mediano,
+               avg(custo_unitario)::DECIMAL(10,2) AS custo_medio,
+               max(custo_unitario) - min(custo_unitario) AS amplitude,
+               round((max(custo_unitario) - min(custo_unitario)) * 100 / NULLIF(min(custo_unitario), 0), 2)
+                   AS amplitude_percentual,
+               jsonb_object_agg(regiao, custo_unitario ORDER BY regiao) AS custos_por_regiao
+        FROM precos_setop
+        GROUP BY codigo, ano;
+    """)
+    # Índice único exigido pelo REFRESH CONCURRENTLY (e usado nas consultas)
+    cursor.execute("CREATE UNIQUE INDEX precos_matriz_chave ON precos_matriz (codigo, ano);")
+
+def _renomear_tabela(cursor, origem, destino):
+    # Renomeia a tabela junto com a chave primária e os índices,
+    # para que a tabela ativa sempre tenha os nomes canônicos
+    cursor.execute(f"ALTER TABLE {origem} RENAME TO {destino};")
+    for sufixo in [indice[0] for indice in INDICES_PRECOS]:
+        cursor.execute(f"ALTER INDEX IF EXISTS {origem}_{sufixo} RENAME TO {destino}_{sufixo};")
+
+def trocar_tabela(cursor, tabela_nova, log_message=print):
+    """
+    Coloca tabela_nova no lugar de precos_fatos na transação atual e
+    aponta a view precos_setop para ela. A tabela anterior vira um
+    snapshot precos_fatos_snap_<data>. Os bloqueios exclusivos sobre
+    precos_fatos e a view duram até o fim da transação: a troca deve ser
+    o último passo antes do commit.
+    """
+    # Não deixa a troca esperar indefinidamente por consultas longas
+    cursor.execute(f"SET LOCAL lock_timeout = '{TIMEOUT_TROCA}';")
+    # A matriz depende só da view, que continua a mesma: é mantida e
+    # atualizada com REFRESH CONCURRENTLY depois do commit da troca
+    cursor.execute("SELECT to_regclass('precos_fatos') IS NOT NULL")
+    if cursor.fetchone()[0]:
+        snapshot = f"{PREFIXO_SNAPSHOT}{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        _renomear_tabela(cursor, 'precos_fatos', snapshot)
+        log_message(f"Tabela anterior guardada como {snapshot}")
+    _renomear_tabela(cursor, tabela_nova, 'precos_fatos')
+    criar_view_precos(cursor, recriar=True)
+
+def listar_snapshots(cursor):
+    """
+    Snapshots disponíveis para rollback, do mais recente para o mais antigo
+    """
+    cursor.execute("""
+        SELECT tablename FROM pg_tables
+        WHERE schemaname = current_schema() AND tablename LIKE %s
+        ORDER BY tablename DESC;
+    """, (PREFIXO_SNAPSHOT + '%',))
+    return [linha[0] for linha in cursor.fetchall()]
+
+def limpar_snapshots(cursor, manter, log_message=print):
+    """
+    Remove os snapshots mais antigos, mantendo os `manter` mais recentes
+    """
+    for snapshot in listar_snapshots(cursor)[manter:]:
+        cursor.execute(f"DROP TABLE {snapshot};")
+        log_message(f"Snapshot removido: {snapshot}")
+
+def montar_tabela_sombra(cursor, log_message=print):
+    """
+    Monta um novo snapshot completo em uma tabela sombra, cria os índices
+    e roda ANALYZE. Retorna o nome da tabela e o resultado da carga; a
+    troca com precos_fatos fica para trocar_tabela(), logo antes do commit.
+    """
+    total = preparar_novos(cursor)
+    preparar_fatos(cursor, log_message)
+    tabela_nova = f"precos_fatos_novo_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+    log_message(f"Montando tabela sombra {tabela_nova}...")
+    cursor.execute(ddl_tabela_precos(tabela_nova))
+    cursor.execute(f"""
+        INSERT INTO {tabela_nova} (servico_id, regiao_id, ano, custo_unitario)
+        SELECT servico_id, regiao_id, ano, custo_unitario
+        FROM fatos_novos;
+    """)
+    # Índices criados depois da carga, de uma vez só
+    criar_indices(cursor, tabela_nova)
+    cursor.execute(f"ANALYZE {tabela_nova};")
+    return tabela_nova, {'inseridos': total, 'atualizados': 0, 'inalterados': 0, 'removidos': 0}
+
+def concluir_troca(cursor, tabela_nova, log_message=print):
+    """
+    Remove os snapshots excedentes e troca tabela_nova com precos_fatos.
+    A tabela atual vira o snapshot mais recente, então sobram
+    SNAPSHOTS_MANTIDOS (ao menos um, para o rollback).
+    """
+    limpar_snapshots(cursor, max(0, SNAPSHOTS_MANTIDOS - 1), log_message)
+    trocar_tabela(cursor, tabela_nova, log_message)
+
+def restaurar_snapshot(snapshot=None):
+    """
+    Volta precos_fatos para um snapshot anterior (o mais recente, por padrão)
+    """
+    conn = psycopg2.connect(CONN_STR)
+    try:
+        cursor = conn.cursor()
+        snapshots = listar_snapshots(cursor)
+        if not snapshots:
+            print("Nenhum snapshot disponível")
+            return False
+        snapshot = snapshot or snapshots[0]
+        if snapshot not in snapshots:
+            print(f"Snapshot não encontrado: {snapshot}")
+            return False
+        # O histórico registra a volta para os preços do snapshot, lidos
+        # dele mesmo antes da troca, que fica para o fim da transação
+        cursor.execute(f"""
+            CREATE TEMP TABLE precos_novos ON COMMIT DROP AS
+            SELECT codigo, descricao_servico, unidade, custo_unitario, regiao, ano, hash_conteudo
+            FROM ({consulta_precos(snapshot)}) p;
+        """)
+        registrar_historico(cursor, completo=True)
+        registrar_versao(cursor)
+        trocar_tabela(cursor, snapshot)
+        conn.commit()
+        print(f"precos_fatos restaurada a partir de {snapshot}")
+        atualizar_matriz(cursor)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+class CarregadorPrecos:
+    """
+    Carga em lotes para precos_fatos: cada DataFrame recebido vai direto
+    para a staging via COPY e o merge (ou a troca de tabela) é aplicado
+    em finalizar(), tudo em uma única transação.
+    """
+    def __init__(self, log_message=print):
+        self.log_message = log_message
+        self.registros = 0
+        self.tempo_copy = 0.0
+
+        self.log_message("\nTestando conexão com o banco...")
+        self.conn = psycopg2.connect(CONN_STR)
+        self.log_message("Conexão bem sucedida!")
+        self.cursor = self.conn.cursor()
+
+        # Cria as tabelas se não existirem (no modo troca, os fatos
+        # são criados na troca), em uma transação própria: a conversão do
+        # formato anterior não fica bloqueando as consultas durante a carga
+        self.log_message("\nCriando tabelas se não existirem...")
+        criar_tabela_precos(self.cursor, self.log_message, criar_fatos=MODO_CARGA != 'troca')
+        self.conn.commit()
+        criar_staging(self.cursor)
+
+    def adicionar(self, df, planilha=None):
+        """
+        Envia um lote (ex.: uma planilha) para a tabela de staging.
+        planilha é o índice da planilha na ordem da descoberta, que decide
+        entre chaves repetidas.
+        """
+        dados = preparar_dados(df)
+        dados['planilha'] = planilha
+        inicio = time.time()
+        copiar_dataframe(self.cursor, dados, 'precos_staging')
+        tempo = time.time() - inicio
+        self.tempo_copy += tempo
+        self.registros += len(dados)
+        metricas.contar('setop_etapa_segundos_total', tempo, etapa='copy')
+        metricas.contar('setop_linhas_enviadas_total', len(dados))
+
+    def adicionar_consulta(self, sql, parametros=()):
+        """
+        Copia para a staging o resultado de uma consulta com as colunas de
+        COLUNAS_PRECOS seguidas do índice da planilha (ex.: as linhas
+        gravadas no banco pelos workers do modo distribuído), sem passar os
+        dados pelo Python
+        """
+        colunas = ', '.join([coluna_db for _, coluna_db, _ in COLUNAS_PRECOS] + ['planilha'])
+        inicio = time.time()
+        self.cursor.execute(f"INSERT INTO precos_staging ({colunas}) {sql}", parametros)
+        self.tempo_copy += time.time() - inicio
+        self.registros += self.cursor.rowcount
+        metricas.contar('setop_linhas_enviadas_total', self.cursor.rowcount)
+
+    def finalizar(self, ao_confirmar=None):
+        """
+        Aplica a staging em precos_fatos, faz o commit e fecha a conexão.
+        ao_confirmar(cursor) é chamado antes do commit, para gravar algo
+        na mesma transação da carga. No modo troca, o histórico, a versão
+        e ao_confirmar rodam antes da troca da tabela, para que os
+        bloqueios dela sobre precos_setop durem só até o commit.
+        """
+        self.log_message(f"{self.registros} registros carregados na staging em {self.tempo_copy:.2f}s "
+                         f"({self.registros / self.tempo_copy if self.tempo_copy else 0:.0f} registros/s)")
+
+        if MODO_CARGA == 'troca':
+            # Novo snapshot completo trocado de forma atômica com o atual
+            self.log_message("\nCarregando com troca atômica de tabela...")
+            with metricas.medir('troca'):
+                tabela_nova, resultado = montar_tabela_sombra(self.cursor, self.log_message)
+        else:
+            # Merge incremental: só as linhas novas ou alteradas são escritas
+            self.log_message("\nAplicando merge incremental...")
+            with metricas.medir('merge'):
+                resultado = merge_staging(self.cursor, self.log_message)
+        self.log_message(f"Inseridos: {resultado['inseridos']} | Atualizados: {resultado['atualizados']} | "
+                         f"Inalterados: {resultado['inalterados']} | Removidos: {resultado['removidos']}")
+        for operacao, quantidade in resultado.items():
+            metricas.contar('setop_linhas_carregadas_total', quantidade, operacao=operacao)
+        with metricas.medir('historico'):
+            registrar_historico(self.cursor, MODO_CARGA == 'troca', self.log_message)
+        if MODO_CARGA != 'troca':
+            with metricas.medir('matriz'):
+                atualizar_matriz(self.cursor, self.log_message)
+        registrar_versao(self.cursor)
+        if ao_confirmar:
+            ao_confirmar(self.cursor)
+
+        # Commit e fechamento; no modo troca, a troca é o último passo antes
+        # do commit e entra no tempo dele (o tempo em que as consultas esperam)
+        with metricas.medir('commit'):
+            if MODO_CARGA == 'troca':
+                concluir_troca(self.cursor, tabela_nova, self.log_message)
+            self.conn.commit()
+        self.log_message("Dados commitados com sucesso!")
+
+        if MODO_CARGA == 'troca':
+            # Depois do commit: o REFRESH não prolonga os bloqueios da troca
+            # sobre precos_fatos e a matriz continua legível durante a carga
+            with metricas.medir('matriz'):
+                atualizar_matriz(self.cursor, self.log_message)
+            self.conn.commit()
+
+        self.cursor.close()
+        self.conn.close()
+        self.log_message("Conexão fechada!")
+        return resultado
+
+    def cancelar(self):
+        """
+        Descarta tudo o que foi enviado e fecha a conexão
+        """
+        try:
+            self.conn.rollback()
+            self.conn.close()
+        except Exception:
+            pass
+
+def importar_csv_direto(arquivo_csv, request=None, tamanho_lote=100000):
     def log_message(message):
         print(message)
         if request and hasattr(request, 'send_event'):
             request.send_event({'message': message})
 
+    carregador = None
     try:
         log_message("\n" + "="*50)
         log_message("INICIANDO IMPORTAÇÃO DO CSV PARA O BANCO")
         log_message("="*50)
         
-        # Primeiro testa a conexão
-        log_message("\nTestando conexão com o banco...")
-        conn_str = "postgresql://postgres:postgres@db:5432/postgres"
-        conn = psycopg2.connect(conn_str)
-        log_message("Conexão bem sucedida!")
-        
-        cursor = conn.cursor()
+        carregador = CarregadorPrecos(log_message)
         
-        # Agora tenta ler o CSV
+        # Lê o CSV em blocos e envia cada um para a staging
         log_message(f"\nTentando ler arquivo: {arquivo_csv}")
-        df = pd.read_csv(arquivo_csv, encoding='utf-8-sig')
-        log_message(f"CSV lido com sucesso! Total de registros: {len(df)}")
+        leitor = pd.read_csv(arquivo_csv, encoding='utf-8-sig', chunksize=tamanho_lote,
+                             dtype={'CÓDIGO': str, 'UNIDADE': str, 'ANO': str})
+        for df in leitor:
+            carregador.adicionar(df)
+        log_message(f"CSV lido com sucesso! Total de registros: {carregador.registros}")
         
-        # Cria a tabela se não existir
-        log_message("\nCriando tabela se não existir...")
-        create_table_query = """
-        CREATE TABLE IF NOT EXISTS precos_setop (
-            id SERIAL PRIMARY KEY,
-            codigo VARCHAR(50),
-            descricao_servico TEXT,
-            unidade VARCHAR(20),
-            custo_unitario DECIMAL(10,2),
-            regiao VARCHAR(50),
-            data_importacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """
-        
-        # Drop a tabela antiga e cria nova
-        log_message("Removendo tabela antiga...")
-        cursor.execute("DROP TABLE IF EXISTS precos_setop;")
-        cursor.execute(create_table_query)
-        log_message("Tabela recriada!")
-        
-        # Prepara e insere os dados
-        log_message("\nPreparando dados para inserção...")
-        valores = []
-        for _, row in df.iterrows():
-            valores.append((
-                str(row['CÓDIGO'])[:50],
-                row['DESCRIÇÃO DO SERVIÇO'],
-                str(row['UNIDADE'])[:20],
-                float(row['CUSTO UNITÁRIO']),
-                row['regiao'][:50]
-            ))
-        
-        log_message(f"Inserindo {len(valores)} registros...")
-        insert_query = """
-        INSERT INTO precos_setop (codigo, descricao_servico, unidade, custo_unitario, regiao)
-        VALUES (%s, %s, %s, %s, %s);
-        """
-        cursor.executemany(insert_query, valores)
-        
-        # Commit e fechamento
-        conn.commit()
-        log_message("Dados commitados com sucesso!")
-        
-        cursor.close()
-        conn.close()
-        log_message("Conexão fechada!")
+        carregador.finalizar()
         
         log_message("\n" + "="*50)
         log_message("IMPORTAÇÃO CONCLUÍDA COM SUCESSO")
@@ -79,13 +807,19 @@ def importar_csv_direto(arquivo_csv, request=None):
         return True
         
     except Exception as e:
+        if carregador:
+            carregador.cancelar()
         log_message(f"Erro: {str(e)}")
         import traceback
         log_message(traceback.format_exc())
         return False
 
 if __name__ == "__main__":
-    # Para teste direto no container
-    csv_path = '/app/data/planilhas_consolidadas.csv'
-    resultado = importar_csv_direto(csv_path)
+    # Rollback: python -m scraper.test_db --restaurar [snapshot]
+    if len(sys.argv) > 1 and sys.argv[1] == '--restaurar':
+        resultado = restaurar_snapshot(sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        # Para teste direto no container
+        csv_path = '/app/data/planilhas_consolidadas.csv'
+        resultado = importar_csv_direto(csv_path)
     print("Sucesso!" if resultado else "Falha!")
\ No newline at end of file
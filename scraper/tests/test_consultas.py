@@ -0,0 +1,17 @@
+import unittest
+from scraper import consultas
+
+class FiltroAnoTests(unittest.TestCase):
+    """
+    Filtro por ano da API: 'N/A' é o ano nulo do banco
+    """
+    def test_ano_desconhecido_vira_nulo(self):
+        self.assertEqual(consultas.filtro_ano('N/A'), ("ano IS NULL", []))
+
+    def test_ano_da_edicao(self):
+        self.assertEqual(consultas.filtro_ano('2024'), ("ano = %s", ['2024']))
+
+    def test_ano_invalido(self):
+        for ano in ('abc', '2024-01', ' 2024', '²'):
+            with self.assertRaises(ValueError):
+                consultas.filtro_ano(ano)
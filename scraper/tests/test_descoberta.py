@@ -0,0 +1,177 @@
+import os
+import asyncio
+import unittest
+from unittest import mock
+from scraper import descoberta, scraping_async
+
+PAGINAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'paginas')
+
+URL_MAPA = "https://www.infraestrutura.mg.gov.br/component/gmg/page/102-consulta-a-planilha-preco-setop"
+URL_CENTRAL = "https://www.infraestrutura.mg.gov.br/component/gmg/page/1571-regiao-central"
+URL_NORTE = "https://www.infraestrutura.mg.gov.br/component/gmg/page/1572-regiao-norte"
+URL_ZONA_DA_MATA = "https://www.infraestrutura.mg.gov.br/component/gmg/page/1573-zona-da-mata-leste"
+
+def ler_pagina(nome):
+    with open(os.path.join(PAGINAS, nome), encoding='utf-8') as f:
+        return f.read()
+
+# Páginas salvas servidas no lugar do site, pela URL pedida
+SITE = {
+    URL_MAPA: 'mapa.html',
+    URL_CENTRAL: 'regiao_central.html',
+    URL_NORTE: 'regiao_sem_planilhas.html',
+}
+
+def baixar_salva(session, url):
+    if url not in SITE:
+        raise ConnectionError(f"Página não salva: {url}")
+    return ler_pagina(SITE[url])
+
+class ExtratorLinksTests(unittest.TestCase):
+    """
+    Parser HTML contra páginas do SETOP salvas em disco
+    """
+    def test_regioes_do_mapa(self):
+        regioes = descoberta.extrair_regioes(ler_pagina('mapa.html'), URL_MAPA)
+        self.assertEqual(regioes, [
+            {'nome': 'Região Central', 'href': URL_CENTRAL},
+            {'nome': 'Região Norte', 'href': URL_NORTE},
+            {'nome': 'Zona da Mata Leste', 'href': URL_ZONA_DA_MATA},
+        ])
+
+    def test_mapa_sem_planilhas(self):
+        # O PDF da metodologia não é planilha
+        self.assertEqual(descoberta.extrair_planilhas(ler_pagina('mapa.html'), URL_MAPA), [])
+
+    def test_planilhas_da_regiao(self):
+        links = descoberta.extrair_planilhas(ler_pagina('regiao_central.html'), URL_CENTRAL)
+        self.assertEqual(links, [
+            {
+                'url': "https://www.infraestrutura.mg.gov.br/images/documentos/setop/2024/Central_Jan_2024.xlsx",
+                'texto': '2024 - Janeiro',
+            },
+            {
+                'url': "https://www.infraestrutura.mg.gov.br/images/documentos/setop/2023/Central_Jul_2023.xlsx",
+                'texto': '2023 - Julho',
+            },
+            {
+                'url': "https://www.infraestrutura.mg.gov.br/component/images/documentos/setop/2019/Central_Out_2019.xls",
+                'texto': '2019 - Outubro',
+            },
+            {
+                'url': "https://www.infraestrutura.mg.gov.br/images/documentos/setop/relatorio.xlsx",
+                'texto': '',
+            },
+        ])
+
+    def test_tarefas_da_regiao(self):
+        with mock.patch.object(descoberta, '_baixar_pagina', side_effect=baixar_salva):
+            tarefas = descoberta.listar_planilhas_regiao(
+                {'nome': 'Região Central', 'href': URL_CENTRAL}, session=object()
+            )
+        self.assertEqual([(t['regiao'], t['ano']) for t in tarefas], [
+            ('Região Central', '2024'),
+            ('Região Central', '2023'),
+            ('Região Central', '2019'),
+            ('Região Central', 'N/A'),
+        ])
+        self.assertEqual(
+            tarefas[0]['url'],
+            "https://www.infraestrutura.mg.gov.br/images/documentos/setop/2024/Central_Jan_2024.xlsx"
+        )
+
+    def test_descoberta_http(self):
+        # A região Norte não tem planilhas e a Zona da Mata não foi salva:
+        # a falha de uma região não interrompe as outras
+        with mock.patch.object(descoberta, '_baixar_pagina', side_effect=baixar_salva):
+            regioes, tarefas = descoberta.descobrir_planilhas_http(URL_MAPA, session=object())
+        self.assertEqual(len(regioes), 3)
+        self.assertEqual(
+            [t['url'] for t in tarefas],
+            [link['url'] for link in descoberta.extrair_planilhas(ler_pagina('regiao_central.html'), URL_CENTRAL)]
+        )
+        self.assertEqual({t['regiao'] for t in tarefas}, {'Região Central'})
+
+class EscolhaModoTests(unittest.TestCase):
+    """
+    Escolha entre a descoberta via HTTP e via Selenium
+    """
+    RESULTADO_SELENIUM = ([{'nome': 'Selenium', 'href': URL_CENTRAL}], [])
+
+    def descobrir(self, modo, http):
+        with mock.patch.object(descoberta, 'descobrir_planilhas_http', **http) as via_http, \
+                mock.patch.object(descoberta, 'descobrir_planilhas_selenium',
+                                  return_value=self.RESULTADO_SELENIUM) as via_selenium:
+            resultado = descoberta.descobrir_planilhas(modo)
+        return resultado, via_http, via_selenium
+
+    def test_http_com_regioes_nao_abre_navegador(self):
+        esperado = ([{'nome': 'Região Central', 'href': URL_CENTRAL}], [{'url': 'x.xlsx'}])
+        resultado, via_http, via_selenium = self.descobrir('http', {'return_value': esperado})
+        self.assertEqual(resultado, esperado)
+        via_http.assert_called_once()
+        via_selenium.assert_not_called()
+
+    def test_http_sem_regioes_cai_para_selenium(self):
+        resultado, _, via_selenium = self.descobrir('http', {'return_value': ([], [])})
+        self.assertEqual(resultado, self.RESULTADO_SELENIUM)
+        via_selenium.assert_called_once()
+
+    def test_erro_http_cai_para_selenium(self):
+        resultado, _, via_selenium = self.descobrir('http', {'side_effect': ConnectionError("recusada")})
+        self.assertEqual(resultado, self.RESULTADO_SELENIUM)
+        via_selenium.assert_called_once()
+
+    def test_modo_selenium_nao_tenta_http(self):
+        resultado, via_http, via_selenium = self.descobrir('selenium', {'return_value': ([], [])})
+        self.assertEqual(resultado, self.RESULTADO_SELENIUM)
+        via_http.assert_not_called()
+        via_selenium.assert_called_once()
+
+    def test_modo_padrao_da_configuracao(self):
+        with mock.patch.object(descoberta, 'MODO_DESCOBERTA', 'selenium'):
+            resultado, via_http, _ = self.descobrir(None, {'return_value': ([], [])})
+        self.assertEqual(resultado, self.RESULTADO_SELENIUM)
+        via_http.assert_not_called()
+
+    def test_mapa_salvo_via_http(self):
+        # Mapa salvo de verdade, sem Selenium
+        http = descoberta.descobrir_planilhas_http
+        with mock.patch.object(descoberta, '_baixar_pagina', side_effect=baixar_salva), \
+                mock.patch.object(descoberta, 'descobrir_planilhas_http',
+                                  side_effect=lambda: http(URL_MAPA, session=object())), \
+                mock.patch.object(descoberta, 'descobrir_planilhas_selenium') as via_selenium:
+            regioes, tarefas = descoberta.descobrir_planilhas('http')
+        via_selenium.assert_not_called()
+        self.assertEqual([r['nome'] for r in regioes], ['Região Central', 'Região Norte', 'Zona da Mata Leste'])
+        self.assertEqual(len(tarefas), 4)
+
+    def descobrir_async(self, modo, http):
+        """
+        Etapa de descoberta do motor async; retorna as tarefas enfileiradas
+        """
+        async def rodar():
+            fila = asyncio.Queue()
+            await scraping_async._descobrir(None, None, fila, asyncio.Queue())
+            return [fila.get_nowait() for _ in range(fila.qsize())]
+
+        tarefa = {'regiao': 'Região Central', 'url': 'x.xlsx', 'ano': '2024'}
+        with mock.patch.object(scraping_async, 'MODO_DESCOBERTA', modo), \
+                mock.patch.object(scraping_async, 'buscar', **http) as via_http, \
+                mock.patch.object(scraping_async, 'descobrir_planilhas_selenium',
+                                  return_value=([{'nome': 'Região Central', 'href': URL_CENTRAL}], [tarefa])) \
+                as via_selenium:
+            return asyncio.run(rodar()), via_http, via_selenium
+
+    def test_async_modo_selenium_nao_tenta_http(self):
+        enfileiradas, via_http, via_selenium = self.descobrir_async('selenium', {})
+        via_http.assert_not_called()
+        via_selenium.assert_called_once()
+        self.assertEqual([tarefa['url'] for tarefa in enfileiradas], ['x.xlsx'])
+
+    def test_async_http_sem_regioes_cai_para_selenium(self):
+        _, via_http, via_selenium = self.descobrir_async(
+            'http', {'return_value': (200, b'<html></html>', {})}
+        )
+        via_http.assert_called_once()
+        via_selenium.assert_called_once()
@@ -0,0 +1,51 @@
+import unittest
+from unittest import mock
+import requests
+from scraper import downloads
+from scraper.controle_host import ControladorHost
+
+URL = "https://www.infraestrutura.mg.gov.br/images/documentos/setop/2024/Central_Jan_2024.xlsx"
+
+class RequisitarTests(unittest.TestCase):
+    """
+    A vaga do host volta ao controlador qualquer que seja o erro da requisição
+    """
+    def setUp(self):
+        self.controlador = ControladorHost('teste', inicial=2)
+        patcher = mock.patch.object(downloads, 'obter_controlador', return_value=self.controlador)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def requisitar(self, erro):
+        session = mock.Mock()
+        session.get.side_effect = erro
+        with self.assertRaises(type(erro)):
+            downloads.requisitar(session, URL, max_retries=2, backoff_factor=0)
+        return session
+
+    def test_erro_sem_retry_libera_vaga(self):
+        # Mais chamadas do que o limite: sem devolver a vaga, a terceira travaria
+        for _ in range(3):
+            session = self.requisitar(requests.TooManyRedirects("redirecionamentos demais"))
+            session.get.assert_called_once()
+            self.assertEqual(self.controlador.em_voo, 0)
+
+    def test_outros_erros_liberam_vaga(self):
+        for erro in (requests.exceptions.ChunkedEncodingError("corpo truncado"),
+                     requests.exceptions.InvalidURL("url inválida"),
+                     ValueError("erro depois da resposta")):
+            self.requisitar(erro)
+            self.assertEqual(self.controlador.em_voo, 0)
+
+    def test_timeout_repete_e_libera_vaga(self):
+        session = self.requisitar(requests.Timeout("timeout"))
+        self.assertEqual(session.get.call_count, 3)
+        self.assertEqual(self.controlador.em_voo, 0)
+
+    def test_resposta_libera_vaga(self):
+        response = mock.Mock(status_code=200, headers={})
+        response.elapsed.total_seconds.return_value = 0.01
+        session = mock.Mock()
+        session.get.return_value = response
+        self.assertIs(downloads.requisitar(session, URL), response)
+        self.assertEqual(self.controlador.em_voo, 0)
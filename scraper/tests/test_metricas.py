@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+from collections import defaultdict
+from unittest import mock
+from scraper import metricas
+
+class EstadoMetricasTests(unittest.TestCase):
+    """
+    Estado do /metrics gravado por vários workers no mesmo diretório
+    """
+    def setUp(self):
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        self.arquivo = os.path.join(diretorio.name, 'metricas_estado.json')
+        patcher = mock.patch.object(metricas, 'ARQUIVO_ESTADO', self.arquivo)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def salvar_como(self, pid, contadores, medidas):
+        # Contadores de um processo (pid) gravados com salvar_estado()
+        with mock.patch.object(metricas, '_contadores', defaultdict(float)), \
+                mock.patch.object(metricas, '_medidas', {}), \
+                mock.patch('os.getpid', return_value=pid):
+            for nome, valor, rotulos in contadores:
+                metricas.contar(nome, valor, **rotulos)
+            for nome, valor, rotulos in medidas:
+                metricas.medida(nome, valor, **rotulos)
+            metricas.salvar_estado()
+
+    def valores(self, grupo):
+        return {(nome, tuple(sorted(rotulos.items()))): valor
+                for nome, rotulos, valor in metricas.ler_estado()[grupo]}
+
+    def test_workers_nao_sobrescrevem_uns_aos_outros(self):
+        self.salvar_como(101, [('setop_downloads_total', 3, {'status': '200'})],
+                         [('setop_limite_host', 2.0, {'host': 'a'})])
+        self.salvar_como(202, [('setop_downloads_total', 4, {'status': '200'}),
+                               ('setop_retries_total', 1, {})],
+                         [('setop_limite_host', 5.0, {'host': 'a'})])
+        # Um arquivo por processo
+        self.assertEqual(len([nome for nome in os.listdir(os.path.dirname(self.arquivo))
+                              if nome.endswith('.json')]), 2)
+        self.assertEqual(self.valores('contadores'), {
+            ('setop_downloads_total', (('status', '200'),)): 7,
+            ('setop_retries_total', ()): 1,
+        })
+        self.assertEqual(len(self.valores('medidas')), 1)
+
+    def test_processo_regrava_o_proprio_arquivo(self):
+        self.salvar_como(101, [('setop_retries_total', 1, {})], [])
+        self.salvar_como(101, [('setop_retries_total', 2, {})], [])
+        self.assertEqual(self.valores('contadores'), {('setop_retries_total', ()): 2})
+
+    def test_sem_estado(self):
+        self.assertEqual(metricas.ler_estado(), {'contadores': [], 'medidas': []})
@@ -1,85 +1,31 @@
-from django.shortcuts import render
-from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import render, get_object_or_404
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponse, HttpResponseNotModified
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
 import json
-import subprocess
-import os
-import queue
-import threading
-import sys
-from datetime import datetime
+import hashlib
+from scraper.models import Execucao
+from scraper.execucoes import enfileirar_execucao
+from scraper.eventos import obter_transmissor
+from scraper import consultas, metricas
+from scraper.exportacao_banco import ExportacaoPrecos, ler_intervalo
 
-# Fila global para mensagens
-message_queue = queue.Queue()
-
-class StreamToQueue:
-    def __init__(self, queue):
-        self.queue = queue
-
-    def write(self, text):
-        if text.strip():  # Ignora linhas vazias
-            timestamp = datetime.now().strftime('%H:%M:%S')
-            self.queue.put(f"[{timestamp}] {text.strip()}")
-
-    def flush(self):
-        pass
+# Validade das respostas da API de preços no cache; uma nova importação
+# muda a versão dos dados e invalida tudo antes disso
+CACHE_PRECOS_SEGUNDOS = 3600
 
 def scraper_view(request):
     if request.method == 'POST':
         try:
-            print("Iniciando processo de scraping...")
-            
-            # Configura o redirecionamento da saída
-            original_stdout = sys.stdout
-            sys.stdout = StreamToQueue(message_queue)
-            
-            # Inicia o processo em uma thread separada
-            def run_scraper():
-                try:
-                    script_dir = os.path.dirname(os.path.abspath(__file__))
-                    script_path = os.path.join(script_dir, 'scraping.py')
-                    
-                    # Configura o ambiente para o subprocess
-                    env = os.environ.copy()
-                    env['PYTHONPATH'] = os.path.dirname(script_dir)  # Adiciona o diretório pai ao PYTHONPATH
-                    
-                    # Executa o script como módulo Python
-                    process = subprocess.Popen(
-                        ['python', '-c', 
-                         f'import sys; sys.path.append("{os.path.dirname(script_dir)}"); '
-                         f'from scraper.scraping import scraper_seinfra; '
-                         'scraper_seinfra()'],
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        universal_newlines=True,
-                        bufsize=1,
-                        env=env,
-                        cwd=script_dir
-                    )
-                    
-                    # Lê a saída em tempo real
-                    while True:
-                        output = process.stdout.readline()
-                        if output == '' and process.poll() is not None:
-                            break
-                        if output:
-                            message_queue.put(output.strip())
-                    
-                    # Captura erros
-                    _, stderr = process.communicate()
-                    if stderr:
-                        message_queue.put(f"ERRO: {stderr}")
-                        
-                finally:
-                    sys.stdout = original_stdout
-            
-            # Inicia a thread
-            thread = threading.Thread(target=run_scraper)
-            thread.daemon = True
-            thread.start()
-            
+            # A execução fica na fila até o worker (manage.py worker_scraper)
+            # pegá-la; se já houver uma ativa, reaproveita ela
+            parametros = {'retomar': True} if request.POST.get('retomar') == '1' else {}
+            execucao, criada = enfileirar_execucao(parametros)
             return JsonResponse({
                 'status': 'started',
-                'message': 'Processo iniciado'
+                'message': 'Processo iniciado' if criada else 'Já existe uma execução em andamento',
+                'job_id': execucao.id,
+                'job_status': execucao.status,
             })
                 
         except Exception as e:
@@ -90,15 +36,218 @@ def scraper_view(request):
             })
     return render(request, 'scraper/index.html')
 
-def progress_stream(request):
-    def event_stream():
-        while True:
-            try:
-                # Pega mensagem da fila com timeout
-                message = message_queue.get(timeout=1)
-                yield f"data: {json.dumps({'message': message})}\n\n"
-            except queue.Empty:
-                # Se não houver mensagens, envia heartbeat
-                yield f"data: {json.dumps({'heartbeat': True})}\n\n"
-    
-    return StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+def jobs_view(request):
+    execucoes = Execucao.objects.all()[:20]
+    return JsonResponse({'jobs': [execucao.como_dict() for execucao in execucoes]})
+
+def job_view(request, job_id):
+    execucao = get_object_or_404(Execucao, id=job_id)
+    return JsonResponse(execucao.como_dict())
+
+FILTROS_PRECOS = ['codigo', 'regiao', 'ano', 'q', 'cursor', 'limite']
+FILTROS_MATRIZ = ['codigo', 'ano', 'cursor', 'limite']
+FILTROS_HISTORICO = ['codigo', 'regiao', 'ano', 'data', 'cursor', 'limite']
+FILTROS_VARIACAO = ['de', 'para', 'codigo', 'regiao', 'cursor', 'limite']
+
+def _consulta_em_cache(request, nome, campos, consulta):
+    """
+    Executa consulta(filtros, limite) e guarda a resposta em cache,
+    identificada por um ETag que muda a cada importação
+    """
+    filtros = {chave: request.GET[chave] for chave in campos if request.GET.get(chave)}
+    try:
+        limite = min(int(filtros.get('limite', consultas.LIMITE_PADRAO)), consultas.LIMITE_MAXIMO)
+        if limite < 1:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'erro': 'limite inválido'}, status=400)
+
+    versao = consultas.versao_dados()
+    assinatura = hashlib.md5(json.dumps(filtros, sort_keys=True).encode()).hexdigest()
+    etag = f'"{nome}-{versao}-{assinatura}"'
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    chave_cache = f"{nome}:{versao}:{assinatura}"
+    corpo = cache.get(chave_cache)
+    if corpo is None:
+        try:
+            resultado = consulta(filtros, limite)
+        except ValueError as e:
+            return JsonResponse({'erro': str(e)}, status=400)
+        corpo = json.dumps(resultado, ensure_ascii=False)
+        cache.set(chave_cache, corpo, CACHE_PRECOS_SEGUNDOS)
+
+    response = HttpResponse(corpo, content_type='application/json; charset=utf-8')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+def precos_view(request):
+    """
+    Consulta aos preços importados
+    """
+    return _consulta_em_cache(request, 'precos', FILTROS_PRECOS, lambda filtros, limite: consultas.buscar_precos(
+        codigo=filtros.get('codigo'),
+        regiao=filtros.get('regiao'),
+        ano=filtros.get('ano'),
+        busca=filtros.get('q'),
+        cursor=filtros.get('cursor'),
+        limite=limite,
+    ))
+
+def matriz_view(request):
+    """
+    Comparação de cada código entre as regiões (matriz pré-calculada
+    na importação)
+    """
+    return _consulta_em_cache(request, 'matriz', FILTROS_MATRIZ, lambda filtros, limite: consultas.buscar_matriz(
+        codigo=filtros.get('codigo'),
+        ano=filtros.get('ano'),
+        cursor=filtros.get('cursor'),
+        limite=limite,
+    ))
+
+def historico_view(request):
+    """
+    Versões anteriores dos preços, ou o preço vigente em uma data
+    """
+    return _consulta_em_cache(request, 'historico', FILTROS_HISTORICO, lambda filtros, limite: consultas.buscar_historico(
+        codigo=filtros.get('codigo'),
+        regiao=filtros.get('regiao'),
+        ano=filtros.get('ano'),
+        data=filtros.get('data'),
+        cursor=filtros.get('cursor'),
+        limite=limite,
+    ))
+
+def variacao_view(request):
+    """
+    Variação de preços entre duas edições das planilhas
+    """
+    return _consulta_em_cache(request, 'variacao', FILTROS_VARIACAO, lambda filtros, limite: consultas.buscar_variacao(
+        de=filtros.get('de'),
+        para=filtros.get('para'),
+        codigo=filtros.get('codigo'),
+        regiao=filtros.get('regiao'),
+        cursor=filtros.get('cursor'),
+        limite=limite,
+    ))
+
+def exportacao_view(request):
+    """
+    Exportação completa de precos_setop (ou de uma região/ano) em CSV,
+    CSV com gzip ou Parquet, enviada em blocos enquanto é lida do banco.
+    O ETag muda a cada importação; com If-Range, um download interrompido
+    é retomado com Range.
+    """
+    try:
+        exportacao = ExportacaoPrecos(
+            formato=request.GET.get('formato', 'csv'),
+            regiao=request.GET.get('regiao') or None,
+            ano=request.GET.get('ano') or None,
+            comprimir=request.GET.get('gzip') == '1',
+        )
+    except ValueError as e:
+        return JsonResponse({'erro': str(e)}, status=400)
+    except LookupError as e:
+        return JsonResponse({'erro': str(e)}, status=404)
+
+    filtros = {**exportacao.filtros, 'formato': exportacao.formato, 'gzip': exportacao.comprimir}
+    assinatura = hashlib.md5(json.dumps(filtros, sort_keys=True).encode()).hexdigest()
+    etag = f'"exportacao-{exportacao.versao}-{assinatura}"'
+    cabecalhos = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'no-cache',
+        'Content-Disposition': f'attachment; filename="{exportacao.nome_arquivo}"',
+    }
+    if request.headers.get('If-None-Match') == etag:
+        exportacao.fechar()
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    # Tamanho conhecido de uma exportação anterior da mesma versão gerada
+    # até o fim. Sem ele, o tamanho é medido em segundo plano (nunca antes
+    # do primeiro byte): até lá, um Range recebe o arquivo inteiro.
+    chave_tamanho = f"exportacao-tamanho:{etag}"
+    total = cache.get(chave_tamanho)
+
+    def guardar_tamanho(tamanho):
+        cache.set(chave_tamanho, tamanho, CACHE_PRECOS_SEGUNDOS)
+
+    def medir_tamanho():
+        if cache.get(chave_tamanho) is None:
+            exportacao.medir_em_segundo_plano(guardar_tamanho)
+
+    intervalo = None
+    range_pedido = request.headers.get('Range')
+    if range_pedido and request.headers.get('If-Range', etag) == etag:
+        if total is None:
+            medir_tamanho()
+        intervalo = ler_intervalo(range_pedido, total)
+        if intervalo is False:
+            exportacao.fechar()
+            return HttpResponse(status=416, headers={**cabecalhos, 'Content-Range': f'bytes */{total}'})
+
+    if request.method == 'HEAD':
+        exportacao.fechar()
+        response = HttpResponse(content_type=exportacao.tipo_conteudo, headers=cabecalhos)
+        if total is not None:
+            response['Content-Length'] = total
+        return response
+
+    inicio, fim = intervalo or (0, None)
+    corpo = exportacao.corpo(
+        isinstance(request, ASGIRequest), inicio, fim,
+        ao_concluir=guardar_tamanho,
+        # Download interrompido: o tamanho fica pronto para a retomada
+        ao_interromper=medir_tamanho if total is None else None,
+    )
+    response = StreamingHttpResponse(
+        corpo, content_type=exportacao.tipo_conteudo, status=206 if intervalo else 200, headers=cabecalhos
+    )
+    if intervalo:
+        response['Content-Range'] = f'bytes {inicio}-{fim}/{total}'
+        response['Content-Length'] = fim - inicio + 1
+    elif total is not None:
+        response['Content-Length'] = total
+    return response
+
+def metricas_view(request):
+    """
+    Métricas no formato do Prometheus: contadores salvos pelo worker e
+    execuções por status
+    """
+    estado = metricas.ler_estado()
+    for status, _ in Execucao.STATUS:
+        estado['medidas'].append(['setop_execucoes', {'status': status}, Execucao.objects.filter(status=status).count()])
+    return HttpResponse(metricas.formato_prometheus(estado), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+async def progress_stream(request):
+    job_id = request.GET.get('job')
+    execucoes = Execucao.objects.all()
+    execucao = await (execucoes.filter(id=job_id) if job_id else execucoes).afirst()
+
+    # O navegador reenvia o id do último evento recebido ao reconectar
+    try:
+        ultimo_id = int(request.headers.get('Last-Event-ID') or request.GET.get('desde') or 0)
+    except ValueError:
+        ultimo_id = 0
+
+    async def event_stream():
+        if execucao is None:
+            yield f"data: {json.dumps({'message': 'ERRO: execução não encontrada'})}\n\n"
+            return
+        async for evento in obter_transmissor(execucao.id).acompanhar(ultimo_id):
+            if evento is None:
+                # Comentário SSE: mantém a conexão aberta sem gerar mensagem
+                yield ": heartbeat\n\n"
+            elif evento[0] == 'fim':
+                yield f"data: {json.dumps({'fim': True, 'job_status': evento[1]})}\n\n"
+            else:
+                evento_id, mensagem = evento
+                yield f"id: {evento_id}\ndata: {json.dumps({'message': mensagem})}\n\n"
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response